@@ -14,6 +14,7 @@ from .buttons import Button
 from .timer import Timer
 from .countdown import CountdownTimer
 from .skill import Skill
+from .net_overlay import NetOverlay
 __all__ = [
     "Background",
     "Title",
@@ -27,4 +28,5 @@ __all__ = [
     "Message",
     "Button",
     "Countdown",
+    "NetOverlay",
 ]
@@ -1,14 +1,19 @@
 # countdown_timer.py
+import math
 import time
 import pygame
 from ..utils import GameConfig
 from .entity import Entity
 
+# longest countdown we show for an `until`, whatever the clock estimate says
+MAX_COUNTDOWN = 5  # seconds
+
+
 class CountdownTimer(Entity):
     def __init__(self, config: GameConfig) -> None:
         super().__init__(config)
         self.countdown_duration = 3  # 3 seconds
-        self.start_time = time.time()
+        self.end_time = time.time() + self.countdown_duration
         self.remaining_time = self.countdown_duration
         
         # Create transparent overlay surface with per-pixel alpha
@@ -19,15 +24,19 @@ class CountdownTimer(Entity):
         # Font for countdown numbers
         self.font = pygame.font.Font("assets/font/PressStart2P-Regular.ttf", 200)  # Large font for countdown
 
-    def reset(self) -> None:
-        """Reset the countdown timer"""
-        self.start_time = time.time()
-        self.remaining_time = self.countdown_duration
+    def reset(self, until=None) -> None:
+        """Reset the countdown timer to end in countdown_duration seconds,
+        or at time.time() `until` but no more than MAX_COUNTDOWN from now"""
+        now = time.time()
+        if until is None:
+            self.end_time = now + self.countdown_duration
+        else:
+            self.end_time = min(until, now + MAX_COUNTDOWN)
+        self.update_countdown()
 
     def update_countdown(self) -> None:
         """Update the remaining countdown time"""
-        elapsed = time.time() - self.start_time
-        self.remaining_time = max(0, self.countdown_duration - int(elapsed))
+        self.remaining_time = max(0, math.ceil(self.end_time - time.time()))
 
     def is_finished(self) -> bool:
         """Check if countdown has finished"""
@@ -54,9 +63,11 @@ class CountdownTimer(Entity):
             )
             self.config.screen.blit(number_text, number_rect)
 
-    def pause_with_countdown(self) -> None:
-        """Pause the game for 3 seconds with countdown display"""
-        self.reset()  # Reset timer to start countdown
+    async def pause_with_countdown(self, until=None) -> None:
+        """Pause the game for 3 seconds (or until time.time() `until`) with
+        countdown display. Yields to the event loop every frame, so the
+        network keeps running meanwhile."""
+        self.reset(until)  # Reset timer to start countdown
         
         while not self.is_finished():
             # Handle quit events
@@ -75,10 +86,11 @@ class CountdownTimer(Entity):
             pygame.display.flip()
             
             # Control frame rate
-            self.config.tick()
+            await self.config.tick()
+
 
 # Standalone function for easy use
-def pause_with_countdown(config: GameConfig) -> None:
+async def pause_with_countdown(config: GameConfig) -> None:
     """Simple function to pause with 3-second countdown"""
     countdown = CountdownTimer(config)
-    countdown.pause_with_countdown()
\ No newline at end of file
+    await countdown.pause_with_countdown()
\ No newline at end of file
@@ -1,8 +1,12 @@
 import pygame
 import random as Random
+from ..net.rooms import RoomQuery
 from ..utils import GameConfig, Mode
 from .entity import Entity
 
+# rows of the room browser; the server sends one page of this many
+ROOM_ROWS = 6
+
 class Message(Entity):
     def __init__(self, config: GameConfig, mode: Mode) -> None:
         super().__init__(config)
@@ -23,6 +27,14 @@ class Message(Entity):
         self.password_error = False
         self.password_active = False
         self.password_input_rect = pygame.Rect(config.window.width // 2 - 150, 325, 300, 40)
+        self.rooms = []
+        self.room_rows = []  # rendered (no, room number, players) of each row
+        self.room_total = 0
+        self.page_offset = 0
+        self.room_sort = 0  # index into RoomQuery.SORTS
+        self.open_only = True
+        self.rectRoom = []
+        self.rectPrevPage = self.rectNextPage = self.rectFilter = self.rectSort = pygame.Rect(0, 0, 0, 0)
 
         # create room
         self.random_number = Random.randint(100000, 999999)
@@ -48,8 +60,71 @@ class Message(Entity):
     def set_mode(self, mode) -> None:
         self.mode = mode
 
-    def set_rooms(self, room_list):
+    def set_rooms(self, room_list, total=None):
+        """Show a page of `total` rooms. Without a total, room_list is the
+        whole list (from a server that does not page) and is paged here."""
+        if total is None:
+            total = len(room_list)
+            room_list = room_list[self.page_offset:self.page_offset + ROOM_ROWS]
         self.rooms = room_list
+        self.room_total = total
+        # Rendered once per page rather than every frame
+        self.room_rows = []
+        for room in room_list:
+            roomNo, roomNum, _, capacity = [part.strip() for part in room.split(':')[:4]]
+            self.room_rows.append((
+                self.FONT.render(roomNo, True, self.BLACK),
+                self.FONT.render(roomNum, True, self.BLACK),
+                self.FONT.render(f"{capacity}/4", True, self.BLACK),
+            ))
+
+    def room_query(self):
+        return RoomQuery(
+            self.page_offset, ROOM_ROWS, RoomQuery.SORTS[self.room_sort], 1 if self.open_only else 0
+        )
+
+    def find_room(self, room_num):
+        """Row showing room `room_num`, or None"""
+        for index, room in enumerate(self.rooms):
+            if room.split(':')[1].strip() == room_num:
+                return index
+        return None
+
+    def is_full(self, index):
+        return int(self.rooms[index].split(':')[3]) >= 4
+
+    def turn_page(self, step):
+        """Move `step` pages; False if there is no such page"""
+        offset = self.page_offset + step * ROOM_ROWS
+        if offset < 0 or offset >= self.room_total:
+            return False
+        self.page_offset = offset
+        return True
+
+    def clamp_page(self):
+        """Back to the last page if rooms went away under this one; True
+        if the page changed"""
+        last = max(0, (self.room_total - 1) // ROOM_ROWS * ROOM_ROWS)
+        if self.page_offset <= last:
+            return False
+        self.page_offset = last
+        return True
+
+    def click_room_controls(self, pos):
+        """Handle a click on the paging, filter and sort controls; True if
+        a different part of the room list should be shown"""
+        if self.rectPrevPage.collidepoint(pos):
+            return self.turn_page(-1)
+        if self.rectNextPage.collidepoint(pos):
+            return self.turn_page(1)
+        if self.rectFilter.collidepoint(pos):
+            self.open_only = not self.open_only
+        elif self.rectSort.collidepoint(pos):
+            self.room_sort = (self.room_sort + 1) % len(RoomQuery.SORTS)
+        else:
+            return False
+        self.page_offset = 0
+        return True
 
     def set_room_title(self, title):
         self.room_num = title
@@ -117,6 +192,30 @@ class Message(Entity):
             if player_id == int(self.player_id):
                 self.rectPlayer = name_rect
 
+    def draw_room_controls(self):
+        posControls = 225 + ROOM_ROWS * 50 + 20
+        pages = max(1, -(-self.room_total // ROOM_ROWS))
+        page = self.page_offset // ROOM_ROWS + 1
+
+        txtFilter = self.FONT.render("OPEN ONLY" if self.open_only else "ALL ROOMS", True, self.BLACK)
+        self.rectFilter = self.draw_control(txtFilter, (225, posControls))
+
+        txtSort = self.FONT.render(f"BY {RoomQuery.SORTS[self.room_sort].upper()}", True, self.BLACK)
+        self.rectSort = self.draw_control(txtSort, (800 - txtSort.get_width(), posControls))
+
+        txtPage = self.FONT.render(f"{page}/{pages}", True, self.BLACK)
+        posPage = (self.config.window.width - txtPage.get_width()) // 2
+        self.draw_message(txtPage, (posPage, posControls))
+        txtPrev = self.FONT.render("<", True, self.BLACK if page > 1 else (150, 150, 150))
+        txtNext = self.FONT.render(">", True, self.BLACK if page < pages else (150, 150, 150))
+        self.rectPrevPage = self.draw_control(txtPrev, (posPage - 40, posControls))
+        self.rectNextPage = self.draw_control(txtNext, (posPage + txtPage.get_width() + 24, posControls))
+
+    def draw_control(self, surface, pos):
+        """Blit a clickable label; its rect, padded to be easier to hit"""
+        self.draw_message(surface, pos)
+        return surface.get_rect(topleft=pos).inflate(16, 16)
+
     def draw(self, selected_room=None, mouse_pos=None):
         if self.mode == "Solo":
             self.ready_pos = ((self.config.window.width - self.ready_message.get_width()) // 2, int(self.config.window.height * 0.12))
@@ -144,34 +243,22 @@ class Message(Entity):
 
             self.rectRoom = []
             posRoom = 225
-            if self.rooms:
-                for index, room in enumerate(self.rooms):
-                    roomNo = room.split(':')[0].strip()
-                    self.roomNum = room.split(':')[1].strip()
-                    self.roomCapacity = int(room.split(':')[3].strip())
-                    txtRoomNo = self.FONT.render(roomNo, True, self.BLACK)
-                    txtRoomNum = self.FONT.render(self.roomNum, True, self.BLACK)
-
-                    if self.roomCapacity == 1:
-                        txtPerson = self.FONT.render("1/4", True, self.BLACK)
-                    elif self.roomCapacity == 2:
-                        txtPerson = self.FONT.render("2/4", True, self.BLACK)
-                    elif self.roomCapacity == 3:
-                        txtPerson = self.FONT.render("3/4", True, self.BLACK)
-
-                    row_rect = pygame.Rect(200, posRoom-10, 600, 40)
-                    self.rectRoom.append(row_rect)
-
-                    is_hovered = mouse_pos and row_rect.collidepoint(mouse_pos)
-                    is_selected = selected_room == index
-
-                    if is_selected or is_hovered:
-                        pygame.draw.rect(self.config.screen, (139, 69, 19), row_rect)
-
-                    self.config.screen.blit(txtRoomNo, (225, posRoom))
-                    self.config.screen.blit(txtRoomNum, (int((self.config.window.width - txtRoomNum.get_width()) // 2), posRoom))
-                    self.config.screen.blit(txtPerson, (715, posRoom))
-                    posRoom += 50
+            for index, (txtRoomNo, txtRoomNum, txtPerson) in enumerate(self.room_rows):
+                row_rect = pygame.Rect(200, posRoom-10, 600, 40)
+                self.rectRoom.append(row_rect)
+
+                is_hovered = mouse_pos and row_rect.collidepoint(mouse_pos)
+                is_selected = selected_room == index
+
+                if is_selected or is_hovered:
+                    pygame.draw.rect(self.config.screen, (139, 69, 19), row_rect)
+
+                self.config.screen.blit(txtRoomNo, (225, posRoom))
+                self.config.screen.blit(txtRoomNum, (int((self.config.window.width - txtRoomNum.get_width()) // 2), posRoom))
+                self.config.screen.blit(txtPerson, (715, posRoom))
+                posRoom += 50
+
+            self.draw_room_controls()
 
             if self.show_password_prompt:
                 messageBox = self.config.images.container["message box"]
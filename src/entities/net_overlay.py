@@ -0,0 +1,80 @@
+import time
+
+import pygame
+
+from ..utils import GameConfig
+from .entity import Entity
+
+REFRESH = 0.5  # seconds between recomputed figures
+PING_INTERVAL = 1.0  # seconds between RTT probes while shown
+
+
+class NetOverlay(Entity):
+    """Network diagnostics over the multiplayer scenes, toggled with F3.
+
+    Figures come from `network.stats`; while the overlay is shown it also
+    pings the server once a second so RTT and jitter stay current.
+    """
+
+    def __init__(self, config: GameConfig) -> None:
+        super().__init__(config, x=10, y=10)
+        self.font = pygame.font.Font("assets/font/PressStart2P-Regular.ttf", 10)
+        self.network = None
+        self.visible = False
+        self.lines = []
+        self.next_refresh = 0
+        self.next_ping = 0
+
+    def toggle(self) -> None:
+        self.visible = not self.visible
+        if self.visible and self.network:
+            # Restart the rate window so the first figures are not averaged
+            # over the whole time the overlay was hidden
+            self.network.stats.rates()
+            self.next_refresh = time.monotonic() + REFRESH
+
+    def update(self) -> None:
+        now = time.monotonic()
+        if now >= self.next_ping:
+            self.next_ping = now + PING_INTERVAL
+            self.network.send_ping()
+        if now < self.next_refresh:
+            return
+        self.next_refresh = now + REFRESH
+
+        stats = self.network.stats
+        snapshots, bytes_in, bytes_out, batch = stats.rates(now)
+        rtt = "-" if stats.rtt is None else f"{stats.rtt * 1000:.0f} ms"
+        age = stats.snapshot_age(now)
+        age = "-" if age is None else f"{age * 1000:.0f} ms"
+        transport = "udp" if self.network.udp_ready else ("tcp" if self.network.binary else "text")
+        texts = [
+            f"NET {transport}",
+            f"rtt    {rtt}",
+            f"jitter {stats.jitter * 1000:.1f} ms",
+            f"snaps  {snapshots:.1f}/s",
+            f"in     {bytes_in / 1024:.1f} KB/s",
+            f"out    {bytes_out / 1024:.1f} KB/s",
+            f"queue  {batch} msg {stats.buffered} B",
+            f"state  {age} old",
+        ]
+        self.lines = [self.font.render(text, True, (255, 255, 255)) for text in texts]
+        self.w = max(line.get_width() for line in self.lines) + 12
+        self.h = sum(line.get_height() + 4 for line in self.lines) + 8
+
+    def draw(self) -> None:
+        if not self.lines:
+            return
+        panel = pygame.Surface((self.w, self.h), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 160))
+        self.config.screen.blit(panel, (self.x, self.y))
+        y = self.y + 6
+        for line in self.lines:
+            self.config.screen.blit(line, (self.x + 6, y))
+            y += line.get_height() + 4
+
+    def tick(self) -> None:
+        if not (self.visible and self.network):
+            return
+        self.update()
+        super().tick()
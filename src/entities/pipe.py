@@ -1,6 +1,7 @@
 import random
 from typing import List
 
+from ..net.lockstep import Course
 from ..utils import GameConfig
 from .entity import Entity
 
@@ -27,6 +28,11 @@ class Pipes(Entity):
         self.bottom = self.config.window.viewport_height
         self.upper = []
         self.lower = []
+        # multiplayer course: seeded gaps, one pipe every `spacing` px
+        self.course = None
+        self.spawned = 0
+        self.distance = 0
+        self.scrolling = True
         self.spawn_initial_pipes()
 
     def set_mode(self, mode: str):
@@ -40,22 +46,40 @@ class Pipes(Entity):
     def reset(self):
         self.upper = []
         self.lower = []
+        self.course = None
         self.resume()
 
+    def set_schedule(self, seed: int, spacing: float) -> None:
+        """Start a multiplayer course: a pipe every `spacing` pixels of
+        scrolling, gaps drawn from random.Random(seed). Every client gets the
+        same seed from the server, so all of them build the same course."""
+        self.upper = []
+        self.lower = []
+        self.course = Course(seed, spacing, self.config.window.viewport_height)
+        self.spawned = 0
+        self.distance = 0
+
     def tick(self) -> None:
         if self.mode == "solo" and self.can_spawn_pipes():
             self.spawn_new_pipes()
+        elif self.mode == "multi" and self.course:
+            self.spawn_scheduled_pipes()
         self.remove_old_pipes()
 
         for up_pipe, low_pipe in zip(self.upper, self.lower):
             up_pipe.tick()
             low_pipe.tick()
 
+        if self.scrolling:
+            self.distance += 8
+
     def stop(self) -> None:
+        self.scrolling = False
         for pipe in self.upper + self.lower:
             pipe.vel_x = 0
 
     def resume(self) -> None:
+        self.scrolling = True
         for pipe in self.upper + self.lower:
             pipe.vel_x = -8
 
@@ -72,18 +96,16 @@ class Pipes(Entity):
         self.upper.append(upper)
         self.lower.append(lower)
 
-    def multi_spawn_new_pipes(self, gap_y: int = None):
-        """Spawns a new pipe. If gap_y is given, uses it for multiplayer consistency."""
-        if gap_y is None:
-            # Solo mode random pipe generation
-            base_y = self.config.window.viewport_height
-            gap_y = random.randint(
-                int(base_y * 0.2),
-                int(base_y * 0.6 - self.pipe_gap)
-            )
-
-        upper, lower = self.multi_make_random_pipes(gap_y)
-        self.set_pipes(upper, lower)
+    def spawn_scheduled_pipes(self):
+        """Spawn every pipe of the course that the scrolled distance has reached"""
+        while self.distance >= self.spawned * self.course.spacing:
+            upper, lower = self.multi_make_random_pipes(self.course.gap(self.spawned))
+            # Place by distance, not by when this frame happened to run
+            offset = self.distance - self.spawned * self.course.spacing
+            upper.x -= offset
+            lower.x -= offset
+            self.set_pipes(upper, lower)
+            self.spawned += 1
 
     def remove_old_pipes(self):
         # remove first pipe if its out of the screen
@@ -2,6 +2,7 @@ from enum import Enum
 from itertools import cycle
 import pygame
 
+from ..net.lockstep import HASH_INTERVAL, INPUT_FLAP, Course, LockstepSim
 from ..utils import GameConfig, clamp
 from .entity import Entity
 from .floor import Floor
@@ -52,6 +53,9 @@ class Player(Entity):
         self.penetration_active = False
         self.penetration_timer = 0
 
+        # Input-only match: the bird is driven by a LockstepSim
+        self.lockstep = None
+
         self.set_mode(PlayerMode.SHM)
 
     def set_mode(self, mode: PlayerMode) -> None:
@@ -135,7 +139,9 @@ class Player(Entity):
         # Penetration
         self.penetration_active = False
         self.penetration_timer = 0
-        
+
+        self.lockstep = None
+
         self.resume_wings()
         self.set_mode(PlayerMode.MULTI)
 
@@ -226,8 +232,39 @@ class Player(Entity):
         if self.vel_y < self.max_vel_y:
             self.vel_y += self.acc_y
 
+    def start_lockstep(self, course: Course) -> None:
+        self.lockstep = LockstepSim(self.id, course)
+
+    def lockstep_input(self, kind: int) -> None:
+        """Queue an input for the frame about to be simulated and send it"""
+        self.lockstep.add_input(self.lockstep.frame, kind)
+        self.network.send_input(self.lockstep.frame, kind)
+
+    def tick_lockstep(self) -> None:
+        sim = self.lockstep
+        resync, self.network.resync = self.network.resync, None
+        if resync:
+            sim.rewind(*resync)
+
+        frame = sim.frame
+        sim.advance_to(frame + 1)
+        if frame % HASH_INTERVAL == 0:
+            self.network.send_state_hash(frame, sim.hashes[frame])
+
+        bird = sim.bird
+        self.x, self.y, self.rot = bird.x, bird.y, bird.rot
+        self.waiting_to_respawn = bird.waiting_to_respawn
+        self.just_respawned = bird.just_respawned
+        self.respawn_grace_timer = bird.grace_timer
+        self.penetration_active = bool(bird.penetration_timer)
+        self.time_freeze = bool(bird.freeze_timer)
+
     def tick_multi(self) -> None:
         """Update player position and state in MULTI mode"""
+        if self.lockstep:
+            self.tick_lockstep()
+            return
+
         if hasattr(self.network, 'teleport_active') and self.network.teleport_active:
             self.teleport_to_position(self.network.teleport_x, self.network.teleport_y)
             self.network.teleport_active = False
@@ -291,8 +328,7 @@ class Player(Entity):
         if hasattr(self, 'network') and self.network and self.network.running:
             x, y, rot, respawn, penetration, time_freeze = self.get_own_state()
             if hasattr(self.network, 'room_num') and self.network.room_num:
-                message = f"{self.network.room_num}:{self.network.id}:{x}:{y}:{rot}:{respawn}:{penetration}:{time_freeze}"
-                self.network.send(message)
+                self.network.send_position(x, y, rot, respawn, penetration, time_freeze, force=True)
             
     def rotate(self):
         self.rot = clamp(self.rot + self.vel_rot, self.rot_min, self.rot_max)
@@ -333,7 +369,6 @@ class Player(Entity):
         for player in players:
             if player is None:
                 continue
-            first_player = max(players, key=lambda p: p["x"])
             player_id = player.get("player_id")
             skin_id = player.get("skin_id")
             x = player.get("x")
@@ -373,6 +408,10 @@ class Player(Entity):
         self.frame = 0
 
     def flap(self):
+        if self.lockstep:
+            self.lockstep_input(INPUT_FLAP)
+            self.config.sounds.wing.play()
+            return
         if self.y > self.min_y:
             self.vel_y = self.flap_acc
             self.flapped = True
@@ -398,13 +437,15 @@ class Player(Entity):
     def collided_push(self, pipes: Pipes):
         if self.mode != PlayerMode.MULTI or self.just_respawned or self.penetration_active:
             return
+        if self.lockstep:
+            return  # done by the simulation
         for pipe in pipes.upper + pipes.lower:
             if self.collide(pipe):
                 self.x = pipe.x - self.w - 5
                 return
 
     def respawn(self, config: GameConfig):
-        if self.mode != PlayerMode.MULTI:
+        if self.mode != PlayerMode.MULTI or self.lockstep:
             return
         if self.x <= 0 and not self.waiting_to_respawn:
             self.waiting_to_respawn = True
@@ -1,5 +1,6 @@
 import pygame
 import random
+from ..net.lockstep import INPUT_BOOST, INPUT_PENETRATION
 from ..utils import GameConfig
 from .entity import Entity
 from .player import Player
@@ -28,15 +29,18 @@ class Skill(Entity):
     def add_random_skill(self):
         if not self.other_players:
             return
-        # Sort players by x position (assuming further right == higher rank)
-        sorted_players = sorted(self.other_players, key=lambda p: p['x'], reverse=True)
-        player_ids_in_order = [p['player_id'] for p in sorted_players]
-
-        # Get this player's rank (1-based index)
-        try:
-            player_rank = player_ids_in_order.index(self.player.id) + 1
-        except ValueError:
-            return  # Player not found in ranking list
+        # Our place in the race (1-based), as ranked by the server
+        player_rank = next(
+            (p.get('rank') for p in self.other_players if p['player_id'] == self.player.id), None
+        )
+        if not player_rank:
+            # Not ranked (yet): fall back to sorting by x (further right == higher rank)
+            sorted_players = sorted(self.other_players, key=lambda p: p['x'], reverse=True)
+            player_ids_in_order = [p['player_id'] for p in sorted_players]
+            try:
+                player_rank = player_ids_in_order.index(self.player.id) + 1
+            except ValueError:
+                return  # Player not found in ranking list
 
         # Skill pool based on rank
         rank_skill_pool = {
@@ -67,7 +71,11 @@ class Skill(Entity):
 
         print(f"Player {self.player.id} using skill: {skill}")
 
-        if skill == "penetration":
+        if skill in ("penetration", "speed_boost") and self.player.lockstep:
+            # Lockstep birds only change through inputs
+            kind = INPUT_PENETRATION if skill == "penetration" else INPUT_BOOST
+            self.player.lockstep_input(kind)
+        elif skill == "penetration":
             self.player.penetration_active = True
             self.player.penetration_timer = 3.0  # seconds
         elif skill == "speed_boost":
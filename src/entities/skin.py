@@ -58,9 +58,15 @@ class Skin(Entity):
         return pos_map.get(str(player_id), (0, 0))
     
     def determine_rank(self,players):
-        # Sort players by x (descending), then y (optional), and return the top one
-        sorted_players = sorted(players, key=lambda p: p['x'], reverse=True)
-        return sorted_players
+        # Podium order from the ranks the server sends with each snapshot
+        ranked_players = [None] * len(players)
+        for player in players:
+            rank = player.get('rank')
+            if not rank or rank > len(players) or ranked_players[rank - 1] is not None:
+                # Not ranked (yet): fall back to sorting by x
+                return sorted(players, key=lambda p: p['x'], reverse=True)
+            ranked_players[rank - 1] = player
+        return ranked_players
 
     def draw_rank(self, other_players):
         ranked_players = self.determine_rank(other_players)
@@ -3,25 +3,32 @@ import pygame
 from ..utils import GameConfig
 from .entity import Entity
 
+MATCH_TIME = 1 * 300  # 5 minutes in seconds, unless the server says otherwise
+
 class Timer(Entity):
     def __init__(self, config: GameConfig) -> None:
         super().__init__(config)
         self.y = self.config.window.height * 0.1
-        self.total_time = 1 * 300  # 5 minutes in seconds
+        self.total_time = MATCH_TIME
         self.start_time = None
         self.remaining_time = self.total_time
         self.colon_image = pygame.font.SysFont(None, 48).render(":", True, (255, 255, 255))
 
-    def start(self):
-        self.start_time = time.time()
+    def start(self, start_time=None, end_time=None):
+        """Start now, or run from `start_time` to `end_time` (time.time()
+        values, e.g. the match window announced by the server)"""
+        self.start_time = time.time() if start_time is None else start_time
+        if end_time is not None:
+            self.total_time = end_time - self.start_time
 
     def reset(self) -> None:
         self.start_time = time.time()
+        self.total_time = MATCH_TIME
         self.remaining_time = self.total_time
 
     def update_timer(self) -> None:
-        elapsed = time.time() - self.start_time
-        self.remaining_time = max(0, self.total_time - int(elapsed))
+        elapsed = max(0, time.time() - self.start_time)
+        self.remaining_time = max(0, int(self.total_time - int(elapsed)))
 
     def time_up(self) -> bool:
         self.update_timer()
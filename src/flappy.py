@@ -1,8 +1,8 @@
 import asyncio
 import sys
+import time
 import pygame
-import random
-from pygame.locals import K_ESCAPE, K_SPACE, K_UP, KEYDOWN, QUIT
+from pygame.locals import K_ESCAPE, K_F3, K_SPACE, K_UP, KEYDOWN, QUIT
 
 from .entities import (
     Background,
@@ -20,9 +20,13 @@ from .entities import (
     Timer,
     CountdownTimer,
     Skin,
-    Skill
+    Skill,
+    NetOverlay
 )
-from .utils import GameConfig, Images, Sounds, Window, Mode, Network, Video
+from .utils import GameConfig, Images, Sounds, Window, Mode, AsyncNetwork, Video
+
+# seconds to wait at the end of a match for the server's final snapshot
+MATCH_END_GRACE = 1.0
     
 class Flappy:
     def __init__(self):
@@ -159,6 +163,11 @@ class Flappy:
             pygame.quit()
             sys.exit()
 
+    def check_overlay_event(self, event):
+        """F3 shows/hides the network diagnostics in multiplayer scenes"""
+        if event.type == KEYDOWN and event.key == K_F3:
+            self.net_overlay.toggle()
+
     def is_tap_event(self, event):
         m_left, _, _ = pygame.mouse.get_pressed()
         space_or_up = event.type == KEYDOWN and (
@@ -167,16 +176,19 @@ class Flappy:
         screen_tap = event.type == pygame.FINGERDOWN
         return m_left or space_or_up or screen_tap
 
-    def get_player_id(self, data):
-        return self.network.send_receive_id(data)
+    async def get_player_id(self, data):
+        return await self.network.send_receive_id(data)
     
     def get_selected_room_number(self):
         return self.message.rooms[self.selected_room].split(':')[1].strip()
 
-    def on_pipe_received(self, gap_y):
-        """Called by network thread when a new pipe needs to be spawned."""
-        self.pipes.multi_spawn_new_pipes(gap_y)
-    
+    def browse_rooms(self):
+        """Show the page of rooms the browser's controls now point at"""
+        self.selected_room = None
+        self.network.subscribe_rooms(self.message.room_query())
+        # Servers that do not page sent everything; page it here meanwhile
+        self.message.set_rooms(self.network.room_list, self.network.room_total)
+
     def restart(self):
         self.container = Container(self.config, self.mode)
         self.floor = Floor(self.config)
@@ -309,6 +321,7 @@ class Flappy:
                 self.background = Background(self.config)
                 self.title = Title(self.config)
                 self.scoreboard = ScoreBoard(self.config)
+                self.net_overlay = NetOverlay(self.config)
                 self.mode.set_mode("Default")
                 self.restart()
                 await self.main_interface()
@@ -346,8 +359,7 @@ class Flappy:
             self.config.screen.blit(skill_text_surf, skill_button_rect)
             
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     async def solo_ready_interface(self):
         """Shows welcome solo_ready_interface screen animation of flappy bird"""
@@ -376,8 +388,7 @@ class Flappy:
             self.config.screen.blit(btnBack, rectBack)
             
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     async def play(self):
         self.gamemode = self.mode.get_mode()
@@ -419,9 +430,8 @@ class Flappy:
             self.player.tick()
             self.button.tick()
 
-            self.config.tick()
+            await self.config.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
     
     async def game_resume(self):
         self.pipes.resume()
@@ -462,8 +472,7 @@ class Flappy:
             self.config.screen.blit(btnBack, rectBack)
             
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     async def solo_game_over(self):
         """crashes the player down and shows gameover image"""
@@ -499,50 +508,54 @@ class Flappy:
             self.medal.tick()
             self.button.tick()
 
-            self.config.tick()
+            await self.config.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
 
     async def game_room_interface(self): # receive the room list from the server
         self.restart()
-        self.network = Network()
+        if getattr(self, "network", None):
+            self.network.disconnect()
+        self.network = await AsyncNetwork.open()
+        self.net_overlay.network = self.network
         self.mode.set_mode("Game Room")
         self.message.set_mode(self.mode.get_mode())
         self.container.set_mode(self.mode.get_mode())
         self.button.set_mode(self.mode.get_mode())
         self.selected_room = None
         
-        # Initialize timing for room list updates
-        last_room_update = 0
-        update_interval = 1.0  # Update room list every 1 second
+        # Servers that push the room list only need to be asked once;
+        # older ones are polled with "Game Room" every second
+        update_interval = 1.0
         current_time = pygame.time.get_ticks() / 1000.0
-        
-        # Request initial room list
-        self.network.send(self.mode.get_mode())
-        room_list_data = self.network.receive_room_list()
+        last_room_update = current_time
+
+        # Replies and pushed changes land in network.room_list; only the
+        # page on screen is subscribed to, see RoomQuery
+        self.network.subscribe_rooms(self.message.room_query())
+        room_list_data = self.network.room_list
         self.message.set_rooms(room_list_data)
         
         while True:
             # Get current time
             current_time = pygame.time.get_ticks() / 1000.0
             
-            # Only request room list update periodically
-            if current_time - last_room_update >= update_interval:
-                try:
-                    # Set socket to non-blocking for this check
-                    self.network.client.settimeout(0.05)  # 50ms timeout
-                    self.network.send(self.mode.get_mode())
-                    room_list_data = self.network.receive_room_list()
-                    self.message.set_rooms(room_list_data)
-                    last_room_update = current_time
-                finally:
-                    # Reset socket to blocking mode
-                    self.network.client.settimeout(None)
+            if self.network.rooms_version is None and current_time - last_room_update >= update_interval:
+                self.network.send(self.mode.get_mode())
+                last_room_update = current_time
+            if self.network.room_list is not room_list_data:
+                # Rows move as rooms come and go: follow the selected room
+                selected = self.get_selected_room_number() if self.selected_room is not None else None
+                room_list_data = self.network.room_list
+                self.message.set_rooms(room_list_data, self.network.room_total)
+                self.selected_room = self.message.find_room(selected)
+                if self.message.clamp_page():
+                    self.browse_rooms()
 
             btnBack, rectBack = self.back_button()
 
             mouse_pos = pygame.mouse.get_pos()
             for event in pygame.event.get():
+                self.check_overlay_event(event)
                 self.check_quit_event(event)
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if rectBack.collidepoint(event.pos):
@@ -553,17 +566,22 @@ class Flappy:
                         if rect.collidepoint(event.pos):
                             self.selected_room = i  # Set selected index
 
+                    if not self.message.show_password_prompt and self.message.click_room_controls(event.pos):
+                        self.browse_rooms()
+
                     if self.button.rectCreate.collidepoint(event.pos):
                         await self.create_room_interface()
                         return
 
-                    if self.button.rectJoin.collidepoint(event.pos) and self.selected_room is not None:
+                    if (self.button.rectJoin.collidepoint(event.pos) and self.selected_room is not None
+                            and not self.message.is_full(self.selected_room)):
                         self.roomPassword = self.message.rooms[self.selected_room].split(':')[2].strip()
+                        # The row may change under the password prompt
+                        self.message.room_num = self.get_selected_room_number()
                         if self.roomPassword == "":
-                            self.message.room_num = self.get_selected_room_number()
                             # Add a small delay to ensure room list updates have stopped
                             await asyncio.sleep(0.1)
-                            reply = self.get_player_id(f"Join Room:{self.message.room_num}")
+                            reply = await self.get_player_id(f"Join Room:{self.message.room_num}")
                             permission = reply.split(":")[3]
                             await self.room_lobby_interface(permission)
                             return
@@ -587,8 +605,7 @@ class Flappy:
                                 self.button.show_password_prompt = False
                                 self.message.password_active = False
                                 self.message.password_error = False
-                                self.message.room_num = self.get_selected_room_number()
-                                reply = self.get_player_id(f"Join Room:{self.message.room_num}")
+                                reply = await self.get_player_id(f"Join Room:{self.message.room_num}")
                                 permission = reply.split(":")[3]
                                 await self.room_lobby_interface(permission)
                                 return
@@ -601,6 +618,11 @@ class Flappy:
                             self.message.password_active = False
                             self.message.password_error = False
 
+                if event.type == pygame.KEYDOWN and not self.message.show_password_prompt:
+                    if event.key in (pygame.K_PAGEUP, pygame.K_PAGEDOWN):
+                        if self.message.turn_page(-1 if event.key == pygame.K_PAGEUP else 1):
+                            self.browse_rooms()
+
                 if event.type == pygame.KEYDOWN and self.message.show_password_prompt and self.message.password_active:
                     if event.key == pygame.K_BACKSPACE:
                         self.message.txtPassword = self.message.txtPassword[:-1]
@@ -610,8 +632,7 @@ class Flappy:
                             self.button.show_password_prompt = False
                             self.message.password_active = False
                             self.message.password_error = False
-                            self.message.room_num = self.get_selected_room_number()
-                            reply = self.get_player_id(f"Join Room:{self.message.room_num}")
+                            reply = await self.get_player_id(f"Join Room:{self.message.room_num}")
                             permission = reply.split(":")[3]
                             await self.room_lobby_interface(permission)
                             return
@@ -628,9 +649,9 @@ class Flappy:
             self.config.screen.blit(btnBack, rectBack)
             self.button.tick()
             
+            self.net_overlay.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     async def create_room_interface(self): # send the create room request to the server
         self.mode.set_mode("Create Room")
@@ -641,6 +662,7 @@ class Flappy:
         while True:
             btnBack, rectBack = self.back_button()
             for event in pygame.event.get():
+                self.check_overlay_event(event)
                 self.check_quit_event(event)
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if rectBack.collidepoint(event.pos):
@@ -656,7 +678,7 @@ class Flappy:
                     if self.button.rectCreate.collidepoint(event.pos):
                         self.network.kicked = False
                         self.message.password_active = False
-                        reply = self.get_player_id(f"Create Room:{self.message.random_number}:{self.message.txtPassword}")
+                        reply = await self.get_player_id(f"Create Room:{self.message.random_number}:{self.message.txtPassword}")
                         permission = reply.split(":")[3]
                         await self.room_lobby_interface(permission)
                         return
@@ -667,7 +689,7 @@ class Flappy:
                     elif event.key == pygame.K_RETURN:
                         self.network.kicked = False
                         self.message.password_active = False
-                        reply = self.get_player_id(f"Create Room:{self.message.random_number}:{self.message.txtPassword}")
+                        reply = await self.get_player_id(f"Create Room:{self.message.random_number}:{self.message.txtPassword}")
                         permission = reply.split(":")[3]
                         await self.room_lobby_interface(permission)
                         return
@@ -681,9 +703,9 @@ class Flappy:
             self.config.screen.blit(btnBack, rectBack)
             self.button.tick()
             
+            self.net_overlay.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     async def room_lobby_interface(self, state):
         # Safety check for network ID
@@ -691,6 +713,11 @@ class Flappy:
             print("Warning: Network ID is empty, defaulting to 0")
             self.network.id = "0"
         self.floor.resume()
+        # We are in the lobby already, whatever Restart is still on its
+        # way; and the Start that began the last match (the host gets its
+        # own back) must not begin the next one
+        self.network.restart = False
+        self.network.game_start = False
         self.skin = Skin(self.config, self.network.id)
         self.mode.set_mode(f"Room Lobby: {state}")
         self.message.set_mode(self.mode.get_mode())
@@ -764,6 +791,7 @@ class Flappy:
                 self.button.ready_count = sum(1 for player in self.network.lobby_state if player["ready"])
 
             for event in pygame.event.get():
+                self.check_overlay_event(event)
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if rectBack.collidepoint(event.pos):
                         if state == "host":
@@ -829,6 +857,7 @@ class Flappy:
                         
                     if hasattr(self.button, "rectStart") and self.button.rectStart.collidepoint(event.pos):
                         self.network.send("Start")
+                        self.network.restart = False
                         self.network.stop_listeners()
                         self._lobby_listener_started = False
                         self.network.game_start = False
@@ -849,7 +878,13 @@ class Flappy:
                     else:
                         self.message.txtPlayerName += event.unicode
 
-            self.network.send(f"Update:{self.message.room_num}:{self.network.id}:{self.message.txtPlayerName}:{self.skin.get_skin_id()}:{self.message.isReady}:{self.message.isHost}:")
+            self.network.send_lobby_update(
+                self.message.room_num,
+                self.message.txtPlayerName,
+                self.skin.get_skin_id(),
+                self.message.isReady,
+                self.message.isHost,
+            )
                 
             self.background.tick()
             self.floor.tick()
@@ -868,16 +903,15 @@ class Flappy:
                 self.message.draw_name_message()
                 self.button.draw_enter_button()
 
+            self.net_overlay.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     # Modified multi_gameplay method with skill integration
     async def multi_gameplay(self):
         self.player.id = int(self.network.id)
         self.pipes.set_mode("multi")
         self.skill = Skill(self.config, self.player)
-        self.network.pipe_callback = self.on_pipe_received
         self.player.network = self.network
         # Wait until lobby_state is received and includes this player
         while not self.network.lobby_state or not any(p["player_id"] == self.player.id for p in self.network.lobby_state):
@@ -892,15 +926,43 @@ class Flappy:
         if self.network.running:
             self.network.send(f"Ready:{self.message.room_num}:{self.player.id}")
 
-        # Wait for "AllReady" signal from server
+        # Wait for "AllReady" signal from server. Players that are not
+        # ready in time are kicked, or everyone goes back to the lobby;
+        # the room closes if the host goes away meanwhile.
         while not getattr(self.network, "all_ready", False):
+            if self.network.kicked:
+                print("Not ready in time, removed from the room.")
+                self.network.disconnect()
+                self.network.stop_listeners()
+                self._game_listener_started = False
+                self.network.kicked = False
+                await self.game_room_interface()
+                return
+            if self.network.room_closed:
+                print("Room has been closed by the host.")
+                self.network.disconnect()
+                self.network.stop_listeners()
+                self._game_listener_started = False
+                self.network.room_closed = False
+                await self.game_room_interface()
+                return
+            if self.network.restart:
+                self.network.restart = False
+                self._game_listener_started = False
+                await self.room_lobby_interface("host" if int(self.network.id) == 0 else "member")
+                return
             await asyncio.sleep(0.1)
+        self.pipes.set_schedule(self.network.pipe_seed, self.network.pipe_spacing)
 
-        # Now everyone is ready – begin countdown
+        # Now everyone is ready – begin countdown. With a server that
+        # announces the match window, both ends are on its clock.
+        start, end = self.network.match_window()
         countdown_timer = CountdownTimer(self.config)
-        countdown_timer.pause_with_countdown()
-        self.timer.start()
+        await countdown_timer.pause_with_countdown(start)
+        self.timer.start(start, end)
         self.player.set_mode(PlayerMode.MULTI)
+        if self.network.lockstep:
+            self.player.start_lockstep(self.pipes.course)
 
         while True:
             for p in self.network.lobby_state:
@@ -914,16 +976,6 @@ class Flappy:
 
         while True:
             self.skill.other_players = self.network.game_state
-            if self.player.id == 0 and self.pipes.can_spawn_pipes():
-                # Only player 1 generates and sends pipe position
-                base_y = self.config.window.viewport_height
-                gap_y = random.randint(
-                    int(base_y * 0.2),
-                    int(base_y * 0.6 - self.pipes.pipe_gap)
-                )
-                self.network.send(f"Pipe:{self.message.room_num}:{gap_y}")
-                self.pipes.multi_spawn_new_pipes(gap_y)
-
             if not self.player.penetration_active and self.player.collided_push(self.pipes):
                 pass
 
@@ -931,12 +983,14 @@ class Flappy:
                 pass  
                 
             if self.timer.time_up():
+                await self.wait_match_end()
                 self.network.stop_listeners()
                 self._game_listener_started = False
                 await self.leaderboard_interface()
                 return
             
             for event in pygame.event.get():
+                self.check_overlay_event(event)
                 if self.is_tap_event(event):
                     self.player.flap()
                 elif event.type == pygame.KEYDOWN:
@@ -954,13 +1008,23 @@ class Flappy:
             self.skill.tick()
             self.player.tick()
             
-            x, y, rot, respawn, penetration, time_freeze = self.player.get_own_state()
-            self.network.send(f"{self.message.room_num}:{self.network.id}:{x}:{y}:{rot}:{respawn}:{penetration}:{time_freeze}")
-            self.player.draw_other(self.network.game_state)
+            if not self.player.lockstep:
+                x, y, rot, respawn, penetration, time_freeze = self.player.get_own_state()
+                self.network.send_position(x, y, rot, respawn, penetration, time_freeze)
+            self.player.draw_other(self.network.smoothed_game_state())
         
+            self.net_overlay.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
+
+    async def wait_match_end(self):
+        """Give the server's final snapshot (MatchEnd) a moment to arrive,
+        so the leaderboard ranks everyone from the same final state"""
+        if self.network.match_times is None:
+            return
+        deadline = time.time() + MATCH_END_GRACE
+        while not self.network.match_over and time.time() < deadline:
+            await asyncio.sleep(0.02)
 
     async def leaderboard_interface(self):
         self.player.stop_wings()
@@ -1002,10 +1066,10 @@ class Flappy:
                 return
             
             for event in pygame.event.get():
+                self.check_overlay_event(event)
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if hasattr(self.button, "rectRestart") and self.button.rectRestart.collidepoint(event.pos):
                         self.network.send(f"Restart:")
-                        self.network.restart = True
                         self._game_listener_started = False
                         self.network.all_ready = False
                         self.player.reset()
@@ -1035,9 +1099,9 @@ class Flappy:
             self.message.tick()
             self.button.tick()
             
+            self.net_overlay.tick()
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
+            await self.config.tick()
 
     def get_skill_description(self, skill_id):
         """Get description for a specific skill"""
@@ -1243,5 +1307,4 @@ class Flappy:
             self.config.screen.blit(back_button_surf, back_button_rect)
 
             pygame.display.update()
-            await asyncio.sleep(0)
-            self.config.tick()
\ No newline at end of file
+            await self.config.tick()
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""Headless load generator for the multiplayer server.
+
+Spawns bot clients on localhost that speak the same binary protocol as
+`Network`: per room one bot creates the room and up to three join, they go
+through Update -> Start -> Ready and then stream positions at the game's
+frame rate. Each bot sends its frame counter as x, so the moment that value
+comes back in a snapshot gives the snapshot latency.
+
+    python -m src.loadgen --rooms 50 --duration 30 --spawn-server
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from .net import protocol
+
+HOST = "127.0.0.1"
+PORT = 5555
+FPS = 30
+SETUP_TIMEOUT = 10  # seconds for a room to reach AllReady
+DRAIN_TIME = 1  # seconds to wait for the last snapshots after sending stops
+
+
+class Stats:
+    def __init__(self):
+        self.positions_sent = 0
+        self.positions_superseded = 0  # coalesced away by the room tick
+        self.snapshots = 0
+        self.bytes_received = 0
+        self.latencies = []
+        self.errors = 0
+
+
+class Bot:
+    def __init__(self, stats, room_num, host):
+        self.stats = stats
+        self.room_num = room_num
+        self.host = host
+        self.player_id = None
+        self.reader = None
+        self.writer = None
+        self.listener = None
+        self.decoder = protocol.FrameDecoder()
+        self.joined = asyncio.Event()
+        self.all_ready = asyncio.Event()
+        self.sent_at = {}  # frame counter -> send time, until echoed
+        self.frame = 0
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection(HOST, port)
+        self.writer.write(protocol.HELLO)
+        reply = await self.reader.readexactly(len(protocol.HELLO_ACK))
+        if reply != protocol.HELLO_ACK:
+            raise ConnectionError("server did not accept the binary protocol")
+
+    def send(self, text):
+        self.writer.write(protocol.encode_text(text))
+
+    async def listen(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                self.stats.bytes_received += len(data)
+                self.decoder.feed(data)
+                for msg_type, payload in self.decoder.frames():
+                    self.handle_frame(msg_type, payload)
+        except (ConnectionError, ValueError):
+            self.stats.errors += 1
+
+    def handle_frame(self, msg_type, payload):
+        if msg_type == protocol.MSG_GAME_DELTA:
+            self.stats.snapshots += 1
+            now = time.perf_counter()
+            for player_id, changes in protocol.decode_game_delta(payload):
+                if player_id == self.player_id and "x" in changes:
+                    self.echoed(int(changes["x"]), now)
+        elif msg_type == protocol.MSG_TEXT:
+            self.handle_text(str(payload, "utf-8").strip())
+
+    def handle_text(self, message):
+        if message.startswith("Joined:"):
+            self.player_id = int(message.split(":")[2])
+            self.joined.set()
+        elif message.startswith("UpdateID:"):
+            self.player_id = int(message.split(":")[1])
+        elif message == "Start":
+            self.send(f"Ready:{self.room_num}:{self.player_id}")
+        elif message.startswith("AllReady"):
+            self.all_ready.set()
+
+    def echoed(self, frame, now):
+        sent = self.sent_at.pop(frame, None)
+        if sent is None:
+            return
+        self.stats.latencies.append(now - sent)
+        # Anything older never made it into a snapshot of its own
+        for old in [f for f in self.sent_at if f < frame]:
+            del self.sent_at[old]
+            self.stats.positions_superseded += 1
+
+    async def play(self, fps, until):
+        loop = asyncio.get_running_loop()
+        interval = 1 / fps
+        next_frame = loop.time()
+        while loop.time() < until:
+            self.frame += 1
+            self.sent_at[self.frame] = time.perf_counter()
+            self.writer.write(
+                protocol.encode_position(self.player_id, self.frame, 200.0, 0.0, False, False, False)
+            )
+            self.stats.positions_sent += 1
+            next_frame += interval
+            await asyncio.sleep(max(0, next_frame - loop.time()))
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+async def set_up_room(stats, port, room_num, players):
+    """Connect a room's bots and walk them to AllReady; returns the bots"""
+    bots = [Bot(stats, room_num, host=(i == 0)) for i in range(players)]
+    try:
+        for bot in bots:
+            await bot.connect(port)
+            bot.listener = asyncio.create_task(bot.listen())
+            bot.send(f"Create Room:{room_num}:" if bot.host else f"Join Room:{room_num}")
+            await bot.joined.wait()
+
+        for bot in bots:
+            bot.send(f"Update:{room_num}:{bot.player_id}:Bot {room_num}-{bot.player_id}:0:True")
+        bots[0].send("Start")
+        await asyncio.gather(*(bot.all_ready.wait() for bot in bots))
+    except BaseException:
+        for bot in bots:
+            bot.close()
+        raise
+    return bots
+
+
+async def run(args):
+    stats = Stats()
+    setups = [
+        asyncio.wait_for(
+            set_up_room(stats, args.port, str(args.room_base + i), args.players),
+            SETUP_TIMEOUT,
+        )
+        for i in range(args.rooms)
+    ]
+    rooms = []
+    failed_rooms = 0
+    for result in await asyncio.gather(*setups, return_exceptions=True):
+        if isinstance(result, BaseException):
+            failed_rooms += 1
+        else:
+            rooms.append(result)
+    bots = [bot for room in rooms for bot in room]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    snapshots_before = stats.snapshots
+    bytes_before = stats.bytes_received
+    await asyncio.gather(*(bot.play(args.fps, started + args.duration) for bot in bots))
+    await asyncio.sleep(DRAIN_TIME)
+    elapsed = loop.time() - started
+
+    unanswered = sum(len(bot.sent_at) for bot in bots)
+    for bot in bots:
+        bot.close()
+
+    latencies = sorted(stats.latencies)
+    return {
+        "config": {
+            "rooms": args.rooms,
+            "players": args.players,
+            "fps": args.fps,
+            "duration_s": args.duration,
+        },
+        "rooms_started": len(rooms),
+        "rooms_failed": failed_rooms,
+        "bots": len(bots),
+        "elapsed_s": round(elapsed, 3),
+        "positions_sent": stats.positions_sent,
+        "snapshots_received": stats.snapshots - snapshots_before,
+        "throughput": {
+            "positions_per_s": round(stats.positions_sent / elapsed, 1),
+            "snapshots_per_s": round((stats.snapshots - snapshots_before) / elapsed, 1),
+            "bytes_per_s": round((stats.bytes_received - bytes_before) / elapsed, 1),
+        },
+        "latency_ms": {
+            "samples": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "max": percentile(latencies, 100),
+        },
+        "dropped": {
+            "positions_superseded": stats.positions_superseded,
+            "positions_unanswered": unanswered,
+            "connection_errors": stats.errors,
+        },
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted seconds, in ms"""
+    if not values:
+        return None
+    index = max(0, -(-len(values) * pct // 100) - 1)
+    return round(values[int(index)] * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the multiplayer server with bot clients.")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--players", type=int, default=4, choices=range(1, 5), help="bots per room")
+    parser.add_argument("--fps", type=int, default=FPS, help="position packets per second per bot")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of gameplay")
+    parser.add_argument("--room-base", type=int, default=9000, help="first room number to use")
+    parser.add_argument("--output", default="loadgen-results.json")
+    parser.add_argument(
+        "--spawn-server",
+        action="store_true",
+        help="start `python -m src.server` on --port for the run",
+    )
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "src.server", "--host", HOST, "--port", str(args.port)],
+            stdout=subprocess.DEVNULL,
+        )
+        time.sleep(1)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+from . import protocol
+from .protocol import FrameDecoder
+from .rooms import RoomDirectory, RoomQuery, RoomRegistry, listing_message
+from .metrics import Metrics
+from .sharding import HashRing
+from .standings import Standings
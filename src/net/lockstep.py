@@ -0,0 +1,259 @@
+"""Deterministic bird physics for the input-only ("lockstep") match mode.
+
+In this mode a client no longer streams its bird's position. It sends only
+the frame-stamped inputs (flap and its own skills), and the client and the
+server both run the Bird below frame by frame from those inputs. Every
+HASH_INTERVAL frames the client reports state_hash() of its bird; if the
+server's bird hashed differently at that frame, the server answers with a
+resync carrying its authoritative state, and the client rewinds to it and
+replays its inputs since then.
+
+This mirrors Player.tick_multi/collided_push/respawn, but it uses only
+plain numbers (bounding boxes instead of pixel masks) so that it runs
+without pygame and gives identical results everywhere.
+"""
+import random
+import struct
+import zlib
+
+FPS = 30
+WIDTH = 1024
+HEIGHT = 768
+VIEWPORT_HEIGHT = HEIGHT * 0.79
+SCROLL = 8  # pipe speed, px per frame
+PIPE_W, PIPE_H = 83, 512
+PIPE_GAP = 150
+BIRD_W, BIRD_H = 50, 35
+MIN_Y = -2 * BIRD_H
+MAX_Y = VIEWPORT_HEIGHT - BIRD_H * 0.75
+START_X = (354, 304, 254, 204)  # by player_id, as in Player
+START_Y = 358
+
+RESPAWN_DELAY = 24
+RESPAWN_GRACE = 120
+BOOST_FRAMES = 5 * FPS
+PENETRATION_FRAMES = 3 * FPS
+FREEZE_FRAMES = 2 * FPS
+
+HASH_INTERVAL = 10  # frames between state hashes from the client
+HISTORY = 10 * FPS  # frames of inputs/hashes kept for replay and checks
+
+# input kinds
+INPUT_FLAP = 1
+INPUT_BOOST = 2
+INPUT_PENETRATION = 3
+
+# x, y, vel_x, vel_y, rot, respawn, grace, boost, penetration, freeze timers, flags
+STATE = struct.Struct(">5f5HB")
+_FLAPPED = 0x01
+_WAITING = 0x02
+_RESPAWNED = 0x04
+
+
+def _clamp(n, minn, maxn):
+    return max(min(maxn, n), minn)
+
+
+class Course:
+    """The seeded pipe course of a match (see Pipes.set_schedule)"""
+
+    def __init__(self, seed: int, spacing: float, viewport_height=VIEWPORT_HEIGHT) -> None:
+        self.spacing = spacing
+        self.rng = random.Random(seed)
+        self.low = int(viewport_height * 0.2)
+        self.high = int(viewport_height * 0.6 - PIPE_GAP)
+        self.gaps = []
+
+    def gap(self, index: int) -> int:
+        """gap_y of the index-th pipe"""
+        while len(self.gaps) <= index:
+            self.gaps.append(self.rng.randint(self.low, self.high))
+        return self.gaps[index]
+
+    def pipes(self, distance: float):
+        """(x, gap_y) of every pipe on screen after `distance` px of scrolling"""
+        first = max(0, int((distance - WIDTH - 10 - PIPE_W) // self.spacing))
+        index = first
+        while index * self.spacing <= distance:
+            x = WIDTH + 10 - (distance - index * self.spacing)
+            if x > -PIPE_W:
+                yield x, self.gap(index)
+            index += 1
+
+
+class Bird:
+    def __init__(self, player_id: int) -> None:
+        self.x = START_X[player_id % len(START_X)]
+        self.y = START_Y
+        self.vel_x = 0
+        self.vel_y = -9
+        self.rot = 80
+        self.flapped = False
+        self.waiting_to_respawn = False
+        self.respawn_timer = 0
+        self.just_respawned = False
+        self.grace_timer = 0
+        self.boost_timer = 0
+        self.penetration_timer = 0
+        self.freeze_timer = 0
+
+    def flap(self):
+        if self.y > MIN_Y:
+            self.vel_y = -9
+            self.flapped = True
+            self.rot = 80
+
+    def boost(self):
+        self.vel_x = 2
+        self.boost_timer = BOOST_FRAMES
+
+    def penetrate(self):
+        self.penetration_timer = PENETRATION_FRAMES
+
+    def freeze(self):
+        self.freeze_timer = FREEZE_FRAMES
+
+    def teleport(self, x, y):
+        self.x = x
+        self.y = y
+        self.vel_x = 0
+        self.vel_y = 0
+
+    def step(self, course: Course, distance: float) -> None:
+        """Advance one frame; `distance` is the scroll after this frame"""
+        if self.freeze_timer:
+            # Frozen birds hang in place
+            self.freeze_timer -= 1
+            self.vel_x = 0
+        else:
+            if self.boost_timer:
+                self.boost_timer -= 1
+                if not self.boost_timer:
+                    self.vel_x = 0
+            self.x += self.vel_x
+            if self.vel_y < 10 and not self.flapped:
+                self.vel_y += 1
+            self.flapped = False
+            self.y = _clamp(self.y + self.vel_y, MIN_Y, MAX_Y)
+            self.rot = _clamp(self.rot - 3, -90, 20)
+            if self.penetration_timer:
+                self.penetration_timer -= 1
+
+        if not (self.just_respawned or self.penetration_timer):
+            self.push_out(course, distance)
+        self.respawn()
+
+    def push_out(self, course, distance):
+        """Pipes push the bird back instead of killing it"""
+        for pipe_x, gap_y in course.pipes(distance):
+            if not (pipe_x < self.x + BIRD_W and self.x < pipe_x + PIPE_W):
+                continue
+            if self.y < gap_y or self.y + BIRD_H > gap_y + PIPE_GAP:
+                self.x = pipe_x - BIRD_W - 5
+                return
+
+    def respawn(self):
+        if self.x <= 0 and not self.waiting_to_respawn:
+            self.waiting_to_respawn = True
+            self.respawn_timer = 0
+        if self.waiting_to_respawn:
+            self.respawn_timer += 1
+            if self.respawn_timer >= RESPAWN_DELAY:
+                self.x = int(WIDTH * 0.2)
+                self.y = int((HEIGHT - BIRD_H) / 2)
+                self.vel_y = 0
+                self.rot = 0
+                self.waiting_to_respawn = False
+                self.just_respawned = True
+                self.grace_timer = 0
+        if self.just_respawned:
+            self.grace_timer += 1
+            if self.grace_timer >= RESPAWN_GRACE:
+                self.just_respawned = False
+                self.grace_timer = 0
+
+    def pack(self) -> bytes:
+        flags = (
+            (_FLAPPED if self.flapped else 0)
+            | (_WAITING if self.waiting_to_respawn else 0)
+            | (_RESPAWNED if self.just_respawned else 0)
+        )
+        return STATE.pack(
+            self.x, self.y, self.vel_x, self.vel_y, self.rot,
+            self.respawn_timer, self.grace_timer, self.boost_timer,
+            self.penetration_timer, self.freeze_timer, flags,
+        )
+
+    def unpack(self, data) -> None:
+        (
+            self.x, self.y, self.vel_x, self.vel_y, self.rot,
+            self.respawn_timer, self.grace_timer, self.boost_timer,
+            self.penetration_timer, self.freeze_timer, flags,
+        ) = STATE.unpack(data)
+        self.flapped = bool(flags & _FLAPPED)
+        self.waiting_to_respawn = bool(flags & _WAITING)
+        self.just_respawned = bool(flags & _RESPAWNED)
+
+    def state_hash(self) -> int:
+        return zlib.crc32(self.pack())
+
+    def snapshot(self) -> tuple:
+        """(x, y, rot, respawn, penetration, time_freeze) as in GameUpdate"""
+        return (
+            self.x, self.y, self.rot,
+            self.just_respawned, bool(self.penetration_timer), bool(self.freeze_timer),
+        )
+
+
+class LockstepSim:
+    """One bird driven by frame-stamped inputs.
+
+    Frame n's inputs are applied right before frame n is simulated. The
+    client keeps its inputs so it can rewind() to a resync and replay.
+    """
+
+    def __init__(self, player_id: int, course: Course) -> None:
+        self.bird = Bird(player_id)
+        self.course = course
+        self.frame = 0  # next frame to simulate
+        self.inputs = {}  # frame -> [input kinds]
+        self.hashes = {}  # frame -> state_hash() after that frame
+
+    def add_input(self, frame: int, kind: int) -> None:
+        # An input for a frame already simulated can only apply from now on
+        self.inputs.setdefault(max(frame, self.frame), []).append(kind)
+
+    def apply(self, kind: int) -> None:
+        if kind == INPUT_FLAP:
+            self.bird.flap()
+        elif kind == INPUT_BOOST:
+            self.bird.boost()
+        elif kind == INPUT_PENETRATION:
+            self.bird.penetrate()
+
+    def advance_to(self, frame: int) -> None:
+        while self.frame < frame:
+            for kind in self.inputs.get(self.frame, ()):
+                self.apply(kind)
+            self.bird.step(self.course, (self.frame + 1) * SCROLL)
+            if self.frame % HASH_INTERVAL == 0:
+                self.hashes[self.frame] = self.bird.state_hash()
+                self.hashes.pop(self.frame - HISTORY, None)
+            self.inputs.pop(self.frame - HISTORY, None)
+            self.frame += 1
+
+    def rewind(self, frame: int, state: bytes) -> None:
+        """Load the authoritative state at `frame` and replay up to now"""
+        current = self.frame
+        self.bird.unpack(state)
+        self.frame = frame
+        self.advance_to(current)
+
+
+def encode_resync(frame: int, bird: Bird) -> bytes:
+    return struct.pack(">I", frame) + bird.pack()
+
+
+def decode_resync(payload) -> tuple:
+    """returns (frame, packed bird state)"""
+    return struct.unpack_from(">I", payload)[0], bytes(payload[4:])
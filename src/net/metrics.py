@@ -0,0 +1,198 @@
+"""Server metrics: counters, gauges and histograms, exposed as Prometheus
+text over a small local HTTP endpoint (/metrics, plus /stats for JSON) and
+as a periodically rewritten JSON file.
+"""
+import asyncio
+import bisect
+import json
+import os
+import time
+
+PREFIX = "flappy_"
+
+# name -> (type, help)
+DESCRIPTIONS = {
+    "connections_active": ("gauge", "Open client connections"),
+    "connections_total": ("counter", "Client connections accepted"),
+    "rooms": ("gauge", "Rooms by state"),
+    "room_list_subscribers": ("gauge", "Clients subscribed to room list changes"),
+    "messages_received_total": ("counter", "Messages received from clients"),
+    "bytes_received_total": ("counter", "Bytes received from clients"),
+    "messages_sent_total": ("counter", "Messages written to clients"),
+    "bytes_sent_total": ("counter", "Bytes written to clients"),
+    "send_failures_total": ("counter", "Writes that failed or were given up"),
+    "idle_disconnects_total": ("counter", "Connections closed after idle_timeout without data"),
+    "ready_evictions_total": ("counter", "Players removed for not sending Ready within ready_timeout"),
+    "snapshots_superseded_total": ("counter", "Queued snapshots replaced by a newer one"),
+    "lockstep_resyncs_total": ("counter", "Lockstep birds resent to a client after a state hash mismatch"),
+    "lockstep_frames_rejected_total": ("counter", "Lockstep inputs and hashes dropped for a frame ahead of the match clock"),
+    "broadcast_seconds": ("histogram", "Time spent building and queueing a room broadcast"),
+}
+
+# seconds; a broadcast is a few dozen microseconds when healthy
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, n in zip(self.buckets + ("+Inf",), self.counts):
+            total += n
+            yield le, total
+
+
+class Metrics:
+    """All metrics of one server process.
+
+    Counters and histograms are keyed by (name, labels). Gauges are either
+    set directly or computed at read time by callables registered with
+    gauge(), which return {labels dict as tuple: value}.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.values = {}
+        self.histograms = {}
+        self.gauge_fns = {}
+        self.started = time.monotonic()
+        # consumer -> (time, counters) of its previous snapshot()
+        self._last = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.values[(name, _labels(labels))] = value
+
+    def add(self, name, value, **labels):
+        key = (name, _labels(labels))
+        self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, fn):
+        self.gauge_fns[name] = fn
+
+    def gauges(self):
+        gauges = dict(self.values)
+        for name, fn in self.gauge_fns.items():
+            for labels, value in fn().items():
+                gauges[(name, labels)] = value
+        return gauges
+
+    def render_prometheus(self) -> str:
+        series = {}
+        for (name, labels), value in list(self.counters.items()) + list(self.gauges().items()):
+            series.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), h in self.histograms.items():
+            lines = series.setdefault(name, [])
+            for le, total in h.cumulative():
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', le)])} {total}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {h.sum}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {h.count}")
+
+        out = []
+        for name, lines in series.items():
+            kind, help_text = DESCRIPTIONS.get(name, ("untyped", name))
+            out.append(f"# HELP {PREFIX}{name} {help_text}")
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    def snapshot(self, consumer="default") -> dict:
+        """JSON-friendly view; per_second covers the time since the
+        previous snapshot() for the same `consumer`, so /stats scrapes
+        and the periodic dump each get their own window"""
+        now = time.monotonic()
+        last_time, last_counters = self._last.get(consumer, (self.started, {}))
+        elapsed = max(now - last_time, 1e-9)
+        self._last[consumer] = (now, dict(self.counters))
+
+        def key(name, labels):
+            return name + _format_labels(labels)
+
+        return {
+            "uptime_s": round(now - self.started, 3),
+            "counters": {key(*k): v for k, v in self.counters.items()},
+            "per_second": {
+                key(*k): round((v - last_counters.get(k, 0)) / elapsed, 3)
+                for k, v in self.counters.items()
+            },
+            "gauges": {key(*k): v for k, v in self.gauges().items()},
+            "histograms": {
+                key(*k): {
+                    "count": h.count,
+                    "sum": h.sum,
+                    "mean": h.sum / h.count if h.count else None,
+                    "buckets": {str(le): total for le, total in h.cumulative()},
+                }
+                for k, h in self.histograms.items()
+            },
+        }
+
+
+async def serve_http(metrics, host, port):
+    """Serve GET /metrics (Prometheus text) and GET /stats (JSON)"""
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            path = request.split(b" ", 2)[1].decode()
+            if path == "/metrics":
+                status, kind = "200 OK", "text/plain; version=0.0.4"
+                body = metrics.render_prometheus().encode()
+            elif path == "/stats":
+                status, kind = "200 OK", "application/json"
+                body = json.dumps(metrics.snapshot("http")).encode()
+            else:
+                status, kind, body = "404 Not Found", "text/plain", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {kind}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def dump_periodically(metrics, path, interval):
+    """Rewrite `path` with metrics.snapshot("dump") every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(metrics.snapshot("dump"), f, indent=2)
+        os.replace(tmp, path)
@@ -0,0 +1,180 @@
+"""Simulated network conditions, for testing the netcode on localhost.
+
+A Scenario is a list of phases, each a set of Conditions (latency, jitter,
+loss, reordering, bandwidth) starting at some second of the run; fields a
+phase leaves out carry over from the one before. As JSON:
+
+    {"seed": 7, "phases": [
+        {"at": 0, "latency": 0.05, "jitter": 0.01},
+        {"at": 20, "loss": 0.1, "reorder": 0.05},
+        {"at": 40, "bandwidth": 16000}
+    ]}
+
+Every direction of every connection is a Link with its own random
+generator, seeded from the scenario seed and the link's name, that draws
+the same amount of randomness for each packet. Replaying a scenario thus
+gives the n-th packet of a link the same fate every time. Links deliver
+through the running asyncio loop; they are used by the client shim in
+AsyncNetwork and by the proxy in src/netsim.py.
+"""
+import asyncio
+import bisect
+import collections
+import json
+import random
+
+# A byte stream cannot lose data, but a lost TCP segment is resent after
+# about this long, and everything behind it waits
+RETRANSMIT_DELAY = 0.2  # seconds
+# extra delay for a reordered datagram, so later ones overtake it
+REORDER_DELAY = 0.03  # seconds
+
+
+class Conditions:
+    """latency and jitter in seconds; loss and reorder as probabilities
+    per packet; bandwidth in bytes per second, 0 for unlimited"""
+
+    FIELDS = ("latency", "jitter", "loss", "reorder", "bandwidth")
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, reorder=0.0, bandwidth=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.bandwidth = bandwidth
+
+    def updated(self, fields):
+        """A copy with `fields` (a dict, possibly partial) applied"""
+        unknown = fields.keys() - set(self.FIELDS) - {"at"}
+        if unknown:
+            raise ValueError(f"unknown condition(s): {', '.join(sorted(unknown))}")
+        values = {name: getattr(self, name) for name in self.FIELDS}
+        values.update((name, fields[name]) for name in self.FIELDS if name in fields)
+        return Conditions(**values)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)}" for name in self.FIELDS)
+        return f"Conditions({values})"
+
+
+class Scenario:
+    def __init__(self, phases, seed=0):
+        """`phases`: (start second, Conditions), in any order"""
+        self.phases = sorted(phases, key=lambda phase: phase[0])
+        if not self.phases or self.phases[0][0] > 0:
+            self.phases.insert(0, (0, Conditions()))
+        self.starts = [start for start, _ in self.phases]
+        self.seed = seed
+
+    @classmethod
+    def constant(cls, conditions, seed=0):
+        return cls([(0, conditions)], seed)
+
+    @classmethod
+    def from_dict(cls, data):
+        phases = []
+        conditions = Conditions()
+        for phase in sorted(data.get("phases", []), key=lambda phase: phase.get("at", 0)):
+            conditions = conditions.updated(phase)
+            phases.append((phase.get("at", 0), conditions))
+        return cls(phases, data.get("seed", 0))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def at(self, elapsed):
+        """Conditions `elapsed` seconds into the run"""
+        return self.phases[max(0, bisect.bisect_right(self.starts, elapsed) - 1)][1]
+
+    def link(self, name, ordered):
+        return Link(self, random.Random(f"{self.seed}:{name}"), ordered)
+
+
+class Link:
+    """One direction of a simulated connection.
+
+    `send` hands a packet to `deliver` once the scenario's conditions say
+    it arrives. Stream links (ordered=True) keep packets in order and turn
+    loss into a retransmission stall; datagram links drop and reorder.
+    The clock starts at a link's first packet.
+    """
+
+    def __init__(self, scenario, rng, ordered):
+        self.scenario = scenario
+        self.rng = rng
+        self.ordered = ordered
+        self.started = None
+        self.busy_until = 0.0  # when the bandwidth cap frees up
+        self.last_arrival = 0.0
+        self.queue = collections.deque()  # stream links: (arrival, deliver, args)
+
+    def schedule(self, size, now):
+        """Seconds until a `size` byte packet sent at `now` arrives, or
+        None if it is lost"""
+        if self.started is None:
+            self.started = now
+        conditions = self.scenario.at(now - self.started)
+        # Always three draws, so one packet's fate never shifts the next's
+        lost = self.rng.random() < conditions.loss
+        reordered = self.rng.random() < conditions.reorder
+        spread = self.rng.uniform(-1, 1)
+
+        sent = now
+        if conditions.bandwidth:
+            sent = max(now, self.busy_until) + size / conditions.bandwidth
+            self.busy_until = sent
+        arrival = sent + max(0.0, conditions.latency + spread * conditions.jitter)
+
+        if self.ordered:
+            if lost:
+                arrival += RETRANSMIT_DELAY
+            arrival = max(arrival, self.last_arrival)
+            self.last_arrival = arrival
+        elif lost:
+            return None
+        elif reordered:
+            arrival += REORDER_DELAY
+        return arrival - now
+
+    def send(self, size, deliver, *args):
+        """Call deliver(*args) when the packet arrives; False if it was lost"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        delay = self.schedule(size, now)
+        if delay is None:
+            return False
+        if not self.ordered:
+            loop.call_later(delay, deliver, *args)
+            return True
+        # Timers due at the same moment may run in any order, so a stream
+        # link delivers from its own queue
+        self.queue.append((now + delay, deliver, args))
+        if len(self.queue) == 1:
+            loop.call_at(now + delay, self._drain)
+        return True
+
+    def _drain(self):
+        loop = asyncio.get_running_loop()
+        # Timers may fire up to a clock tick early
+        now = loop.time() + 0.001
+        while self.queue and self.queue[0][0] <= now:
+            _, deliver, args = self.queue.popleft()
+            try:
+                deliver(*args)
+            except Exception as e:
+                print(f"[netsim] Delivery failed: {e}")
+        if self.queue:
+            loop.call_at(self.queue[0][0], self._drain)
+
+
+def links(scenario, name):
+    """The four links of one simulated connection, keyed by direction:
+    "up"/"down" for the TCP stream, "up_udp"/"down_udp" for datagrams"""
+    return {
+        "up": scenario.link(f"{name}:up", ordered=True),
+        "down": scenario.link(f"{name}:down", ordered=True),
+        "up_udp": scenario.link(f"{name}:up_udp", ordered=False),
+        "down_udp": scenario.link(f"{name}:down_udp", ordered=False),
+    }
@@ -0,0 +1,437 @@
+"""Framed binary wire protocol shared by the client and the server.
+
+Every message is a frame::
+
+    +----------------+-----------+-----------------+
+    | length (2B BE) | type (1B) | payload ...     |
+    +----------------+-----------+-----------------+
+
+where ``length`` counts the type byte plus the payload. Gameplay packets
+(positions and snapshots) are ``struct``-packed; every other command keeps
+its existing text form and travels inside a ``MSG_TEXT`` frame.
+
+Snapshots are delta-compressed: ``MSG_PLAYER_INFO`` carries the static
+roster (id, skin, name) once per match, and each ``MSG_GAME_DELTA`` only
+holds the dynamic fields that changed since the last delta sent to that
+client. Those include each bird's place in the race (rank, 1 = leader),
+which the server keeps so clients do not have to sort by x.
+
+In lockstep matches (see ``lockstep.py``) a client sends ``MSG_INPUT`` and
+``MSG_STATE_HASH`` instead of ``MSG_POSITION``; the server simulates its
+bird and corrects it with ``MSG_RESYNC``.
+
+A client opts in by sending ``HELLO`` as the very first bytes on a new
+connection. Servers that understand it answer ``HELLO_ACK`` and switch the
+connection to framing; older servers ignore it, so the client times out and
+keeps talking the plain text protocol, which ``TextDecoder`` splits back
+into messages.
+
+Binary clients may additionally move positions and snapshots to UDP. After
+joining a room the client sends ``UdpOpen`` over TCP; the server answers
+``UdpToken:<token>:<port>`` and the client greets that port with a
+``MSG_UDP_HELLO`` datagram, which the server echoes back. Once the echo
+arrives the client sends ``UdpReady`` over TCP, and only then does the
+server send its snapshots as datagrams; a client that gives up on UDP
+sends ``UdpClose`` to get them back on TCP. Each datagram is::
+
+    +-------------+-----------+------------+-----------------+
+    | token (4B)  | type (1B) | seq (4B)   | payload ...     |
+    +-------------+-----------+------------+-----------------+
+
+Receivers drop any datagram whose ``seq`` is not newer than the last one
+they accepted. Because datagrams may be lost, snapshots sent over UDP are
+always complete rather than deltas against a baseline.
+"""
+import re
+import struct
+
+HELLO = b"FLPB2\n"
+HELLO_ACK = b"FLPB2 OK\n"
+
+HEADER = struct.Struct(">HB")
+MAX_FRAME = 0xFFFF
+RECV_SIZE = 4096  # initial receive buffer; grows to fit the largest frame
+
+# message types
+MSG_TEXT = 0  # legacy text command or JSON document
+MSG_POSITION = 1  # client -> server: own bird state
+MSG_PLAYER_INFO = 2  # server -> client: static roster of the match
+MSG_GAME_DELTA = 3  # server -> client: changed dynamic fields per bird
+MSG_UDP_HELLO = 4  # datagram only: opens / acknowledges the UDP channel
+MSG_INPUT = 5  # client -> server, lockstep mode: frame-stamped input
+MSG_STATE_HASH = 6  # client -> server, lockstep mode: bird state hash at a frame
+MSG_RESYNC = 7  # server -> client, lockstep mode: authoritative bird state
+
+# skill / state flags packed into one byte
+FLAG_RESPAWN = 0x01
+FLAG_PENETRATION = 0x02
+FLAG_TIME_FREEZE = 0x04
+
+# bits of the per-player field mask in a MSG_GAME_DELTA
+FIELD_X = 0x01
+FIELD_Y = 0x02
+FIELD_ROT = 0x04
+FIELD_FLAGS = 0x08
+FIELD_RANK = 0x10
+
+# player_id, x, y, rot, flags
+POSITION = struct.Struct(">BfffB")
+# player_id, skin_id, name length (name bytes follow)
+PLAYER_INFO = struct.Struct(">BBB")
+# player_id, field mask (present fields follow in FIELD_* order)
+DELTA_ENTRY = struct.Struct(">BB")
+FLOAT = struct.Struct(">f")
+# frame, input kind
+INPUT = struct.Struct(">IB")
+# frame, state hash
+STATE_HASH = struct.Struct(">II")
+# token, type, seq
+DATAGRAM = struct.Struct(">IBI")
+SEQ_MASK = 0xFFFFFFFF
+
+
+def pack_flags(respawn, penetration, time_freeze):
+    return (
+        (FLAG_RESPAWN if respawn else 0)
+        | (FLAG_PENETRATION if penetration else 0)
+        | (FLAG_TIME_FREEZE if time_freeze else 0)
+    )
+
+
+def unpack_flags(flags):
+    return (
+        bool(flags & FLAG_RESPAWN),
+        bool(flags & FLAG_PENETRATION),
+        bool(flags & FLAG_TIME_FREEZE),
+    )
+
+
+def encode_frame(msg_type: int, payload: bytes = b"") -> bytes:
+    length = len(payload) + 1
+    if length > MAX_FRAME:
+        raise ValueError(f"frame too large: {length} bytes")
+    return HEADER.pack(length, msg_type) + payload
+
+
+def encode_text(text: str) -> bytes:
+    return encode_frame(MSG_TEXT, text.encode("utf-8"))
+
+
+def encode_position(player_id, x, y, rot, respawn, penetration, time_freeze) -> bytes:
+    return encode_frame(
+        MSG_POSITION, pack_position(player_id, x, y, rot, respawn, penetration, time_freeze)
+    )
+
+
+def pack_position(player_id, x, y, rot, respawn, penetration, time_freeze) -> bytes:
+    flags = pack_flags(respawn, penetration, time_freeze)
+    return POSITION.pack(int(player_id), x, y, rot, flags)
+
+
+def decode_position(payload) -> tuple:
+    """returns (player_id, x, y, rot, respawn, penetration, time_freeze)"""
+    player_id, x, y, rot, flags = POSITION.unpack_from(payload)
+    return (player_id, x, y, rot) + unpack_flags(flags)
+
+
+def encode_input(frame: int, kind: int) -> bytes:
+    return encode_frame(MSG_INPUT, INPUT.pack(frame, kind))
+
+
+def encode_state_hash(frame: int, state_hash: int) -> bytes:
+    return encode_frame(MSG_STATE_HASH, STATE_HASH.pack(frame, state_hash))
+
+
+def encode_player_info(players) -> bytes:
+    """Packs the static fields (player_id, skin_id, name) of every player"""
+    parts = [bytes((len(players),))]
+    for p in players:
+        name = p["name"].encode("utf-8")[:255]
+        parts.append(PLAYER_INFO.pack(p["player_id"], p["skin_id"], len(name)))
+        parts.append(name)
+    return encode_frame(MSG_PLAYER_INFO, b"".join(parts))
+
+
+def decode_player_info(payload) -> list:
+    players = []
+    offset = 1
+    for _ in range(payload[0]):
+        player_id, skin_id, name_len = PLAYER_INFO.unpack_from(payload, offset)
+        offset += PLAYER_INFO.size
+        name = bytes(payload[offset:offset + name_len]).decode("utf-8", "replace")
+        offset += name_len
+        players.append({"player_id": player_id, "name": name, "skin_id": skin_id})
+    return players
+
+
+def encode_game_delta(baseline: dict, states: dict):
+    """Packs the fields of `states` that differ from `baseline`.
+
+    Both map player_id -> (x, y, rot, flags, rank). `baseline` is what this client
+    last received and is updated in place. Returns None if nothing changed.
+    """
+    payload = pack_game_delta(baseline, states)
+    if payload is None:
+        return None
+    return encode_frame(MSG_GAME_DELTA, payload)
+
+
+def pack_game_delta(baseline: dict, states: dict):
+    """MSG_GAME_DELTA payload for encode_game_delta(), without the frame
+    header. An empty baseline gives a complete snapshot."""
+    entries = []
+    for player_id, state in states.items():
+        old = baseline.get(player_id)
+        mask = 0
+        fields = []
+        for i, bit in enumerate((FIELD_X, FIELD_Y, FIELD_ROT)):
+            if old is None or old[i] != state[i]:
+                mask |= bit
+                fields.append(FLOAT.pack(state[i]))
+        if old is None or old[3] != state[3]:
+            mask |= FIELD_FLAGS
+            fields.append(bytes((state[3],)))
+        if old is None or old[4] != state[4]:
+            mask |= FIELD_RANK
+            fields.append(bytes((state[4],)))
+        if mask:
+            entries.append(DELTA_ENTRY.pack(player_id, mask) + b"".join(fields))
+            baseline[player_id] = state
+
+    if not entries:
+        return None
+    return bytes((len(entries),)) + b"".join(entries)
+
+
+def decode_game_delta(payload) -> list:
+    """returns [(player_id, {changed GameUpdate keys})]"""
+    deltas = []
+    offset = 1
+    for _ in range(payload[0]):
+        player_id, mask = DELTA_ENTRY.unpack_from(payload, offset)
+        offset += DELTA_ENTRY.size
+        changes = {}
+        for key, bit in (("x", FIELD_X), ("y", FIELD_Y), ("rot", FIELD_ROT)):
+            if mask & bit:
+                changes[key] = FLOAT.unpack_from(payload, offset)[0]
+                offset += FLOAT.size
+        if mask & FIELD_FLAGS:
+            respawn, penetration, time_freeze = unpack_flags(payload[offset])
+            offset += 1
+            changes["respawn"] = respawn
+            changes["penetration"] = penetration
+            changes["time_freeze"] = time_freeze
+        if mask & FIELD_RANK:
+            changes["rank"] = payload[offset]
+            offset += 1
+        deltas.append((player_id, changes))
+    return deltas
+
+
+def encode_datagram(token: int, msg_type: int, seq: int, payload: bytes = b"") -> bytes:
+    return DATAGRAM.pack(token, msg_type, seq & SEQ_MASK) + payload
+
+
+def decode_datagram(data) -> tuple:
+    """returns (token, msg_type, seq, payload); raises struct.error if
+    the datagram is shorter than its header"""
+    token, msg_type, seq = DATAGRAM.unpack_from(data)
+    return token, msg_type, seq, bytes(data[DATAGRAM.size:])
+
+
+def seq_newer(seq: int, last) -> bool:
+    """True if `seq` comes after `last` (None = nothing seen yet),
+    allowing for 32-bit wraparound"""
+    if last is None:
+        return True
+    return 0 < ((seq - last) & SEQ_MASK) < 0x80000000
+
+
+class RecvBuffer:
+    """Preallocated receive buffer.
+
+    recv_into() the memoryview from writable(), then report the byte count
+    with written(); feed() copies bytes in for callers that already have
+    them. Unread bytes are moved to the front only when the free space at
+    the end runs low, and the buffer grows only for a frame bigger than
+    itself, so reading costs nothing per message.
+    """
+
+    def __init__(self, size: int = RECV_SIZE) -> None:
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0  # first unread byte
+        self.end = 0  # end of received bytes
+
+    def writable(self, min_free: int = RECV_SIZE // 2) -> memoryview:
+        if len(self.data) - self.end < min_free:
+            unread = self.end - self.start
+            if unread + min_free > len(self.data):
+                data = bytearray(max(2 * len(self.data), unread + min_free))
+                data[:unread] = self.view[self.start:self.end]
+                self.data, self.view = data, memoryview(data)
+            elif unread:
+                self.data[:unread] = self.view[self.start:self.end]
+            self._moved(self.start)
+            self.start, self.end = 0, unread
+        return self.view[self.end:]
+
+    def written(self, count: int) -> None:
+        self.end += count
+
+    def feed(self, data) -> None:
+        self.writable(len(data))[:len(data)] = data
+        self.written(len(data))
+
+    def unread(self) -> memoryview:
+        return self.view[self.start:self.end]
+
+    def _moved(self, offset: int) -> None:
+        """Hook for decoders that keep positions into the buffer"""
+
+
+class FrameDecoder(RecvBuffer):
+    """Incremental frame parser.
+
+    frames() yields every complete (msg_type, payload) and leaves any
+    trailing partial frame for the next read. Payloads are memoryviews into
+    the buffer, valid until the next read into it. A frame counts as read
+    once the loop asks for the next one, so a caller that stops early
+    finds the frame it stopped at still in unread(). Each byte is scanned
+    once.
+    """
+
+    def frames(self):
+        view = self.view
+        while self.end - self.start >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(view, self.start)
+            if length == 0:
+                raise ValueError("malformed frame: zero length")
+            frame_end = self.start + 2 + length
+            if frame_end > self.end:
+                break
+            yield msg_type, view[self.start + HEADER.size:frame_end]
+            self.start = frame_end
+
+
+# Heads of the unframed text messages. A body may hold anything up to
+# where the next message begins
+TEXT_HEADS = (
+    b"Joined:", b"UpdateID:", b"AllReady", b"GetFrozen:", b"TeleportTo:",
+    b"UdpToken:", b"Restart", b"Start", b"Kicked", b"Pong:", b"MatchEnd",
+    b"Heartbeat", b"Pipe:",
+)
+TEXT_HEAD = re.compile(b"|".join(TEXT_HEADS))
+# where the next message may begin, after a body or unrecognised bytes
+TEXT_RESYNC = re.compile(rb"[{\[]|" + TEXT_HEAD.pattern)
+# bytes that matter while scanning a JSON document
+JSON_TOKENS = re.compile(rb'[{}\[\]"\\]')
+WHITESPACE = b" \t\r\n"
+
+
+class TextDecoder(RecvBuffer):
+    """Incremental splitter for the plain text protocol.
+
+    Text servers write their messages back to back without separators
+    (``StartUpdateID:1{"type": ...}``). JSON documents end at their
+    closing bracket; other messages are a known head plus a body that
+    ends where the next message starts. Servers write each message
+    whole, so a message that runs to the end of the buffer is complete
+    if the socket had nothing more to read (see feed()). A JSON document
+    cut short resumes its scan where it stopped, so each byte is scanned
+    once. frames() yields (MSG_TEXT, payload) like FrameDecoder, and its
+    payloads are memoryviews as well.
+    """
+
+    def __init__(self, size: int = RECV_SIZE) -> None:
+        super().__init__(size)
+        self.drained = True
+        # scan state of a JSON document that is still incomplete
+        self.scan = None
+        self.depth = 0
+        self.in_string = False
+
+    def written(self, count: int, drained: bool = True) -> None:
+        """`drained` is False when recv() filled all the space it was
+        given, i.e. the message at the end may continue in the next read"""
+        super().written(count)
+        self.drained = drained
+
+    def feed(self, data, drained: bool = True) -> None:
+        super().feed(data)
+        self.drained = drained
+
+    def _moved(self, offset: int) -> None:
+        if self.scan is not None:
+            self.scan -= offset
+
+    def frames(self):
+        while True:
+            data, offset = self.data, self.start
+            while offset < self.end and data[offset] in WHITESPACE:
+                offset += 1
+            self.start = offset
+            if offset == self.end:
+                break
+            if data[offset] in b"{[":
+                end = self._json_end(data, offset)
+            elif TEXT_HEAD.match(data, offset, self.end):
+                end = self._text_end(data, offset)
+            else:
+                end = self._skip(data, offset)
+                if end is not None:
+                    self.start = end
+                    continue
+            if end is None:
+                break
+            yield MSG_TEXT, self.view[offset:end]
+            self.start = end
+
+    def _json_end(self, buffer, start):
+        """End of the document at `start`, or None until more arrives"""
+        if self.scan is None:
+            self.scan, self.depth, self.in_string = start, 0, False
+        pos = self.scan
+        while True:
+            match = JSON_TOKENS.search(buffer, pos, self.end)
+            if match is None:
+                self.scan = self.end
+                return None
+            char = buffer[match.start()]
+            pos = match.end()
+            if self.in_string:
+                if char == 0x5C:  # backslash: skip the escaped byte
+                    if pos == self.end:
+                        self.scan = match.start()
+                        return None
+                    pos += 1
+                elif char == 0x22:
+                    self.in_string = False
+            elif char == 0x22:
+                self.in_string = True
+            elif char in b"{[":
+                self.depth += 1
+            elif char in b"}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.scan = None
+                    return pos
+
+    def _text_end(self, buffer, start):
+        head = TEXT_HEAD.match(buffer, start, self.end)
+        following = TEXT_RESYNC.search(buffer, head.end(), self.end)
+        if following:
+            return following.start()
+        # Runs to the end of what we have: complete unless more is coming
+        return None if not self.drained else self.end
+
+    def _skip(self, buffer, start):
+        """End of unrecognised bytes at `start`, or None if they may be
+        the beginning of a head"""
+        rest = bytes(buffer[start:min(start + 16, self.end)])
+        if any(h.startswith(rest) for h in TEXT_HEADS):
+            return None
+        following = TEXT_RESYNC.search(buffer, start + 1, self.end)
+        end = following.start() if following else self.end
+        print(f"[WARN] Skipping unrecognised text: {bytes(buffer[start:end])[:40]!r}")
+        return end
@@ -0,0 +1,320 @@
+import asyncio
+import json
+
+from .protocol import MAX_FRAME
+
+# seconds room list changes are collected before subscribers get them
+DIRECTORY_FLUSH = 0.2
+# rooms per RoomPage unless the client asks for fewer
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# room list messages are split or cut to this many bytes of JSON, so each
+# fits in one binary frame (MAX_FRAME counts the type byte); ENVELOPE is
+# kept for the fields around the list
+MAX_MESSAGE = MAX_FRAME - 1
+ENVELOPE = 256
+
+
+class RoomRegistry:
+    """Index of live rooms for the server.
+
+    Rooms are keyed by room number. `open` and `full` are insertion-ordered
+    dicts used as ordered sets, so the public room list keeps its order and
+    every join/leave/capacity change is O(1). `members` maps a client session
+    to its member record (which points back at its room).
+
+    Callables in `watchers` are called as watcher(room_num, entry) whenever
+    a room's public entry changes; entry is None once it is no longer
+    listed (its match started or it was removed). Full rooms stay listed.
+    """
+
+    def __init__(self, max_players: int) -> None:
+        self.max_players = max_players
+        self.rooms = {}
+        self.open = {}
+        self.full = {}
+        self.members = {}
+        self.watchers = []
+        self._listing = None
+
+    def __contains__(self, room_num) -> bool:
+        return room_num in self.rooms
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def get(self, room_num):
+        return self.rooms.get(room_num)
+
+    def add(self, room) -> None:
+        self.rooms[room.room_num] = room
+        self.update(room)
+
+    def remove(self, room) -> None:
+        num = room.room_num
+        self.rooms.pop(num, None)
+        self.open.pop(num, None)
+        self.full.pop(num, None)
+        for m in room.members:
+            self.members.pop(m["session"], None)
+        self._changed(num, None)
+
+    def update(self, room) -> None:
+        """Re-index a room after its capacity or listed state changed"""
+        num = room.room_num
+        if room.listed and len(room.members) < self.max_players:
+            self.full.pop(num, None)
+            # setdefault keeps an already open room in its list position
+            self.open.setdefault(num, room)
+        else:
+            self.open.pop(num, None)
+            if room.listed:
+                self.full[num] = room
+            else:
+                self.full.pop(num, None)
+        self._changed(num, room.entry if room.listed else None)
+
+    def _changed(self, room_num, entry) -> None:
+        self._listing = None
+        for watcher in self.watchers:
+            watcher(room_num, entry)
+
+    def add_member(self, room, member) -> None:
+        member["room"] = room
+        self.members[member["session"]] = member
+
+    def remove_member(self, member) -> None:
+        self.members.pop(member["session"], None)
+
+    def member_of(self, session):
+        return self.members.get(session)
+
+    def room_of(self, session):
+        member = self.members.get(session)
+        return member["room"] if member else None
+
+    def room_list(self) -> list:
+        """`id:name:password:capacity` entries of every open room"""
+        return [room.entry for room in self.open.values()]
+
+    def listing(self) -> str:
+        """JSON reply to a `Game Room` request, cached until the next change"""
+        if self._listing is None:
+            self._listing = listing_message(self.room_list())
+        return self._listing
+
+
+def players(entry) -> int:
+    return int(entry.rsplit(":", 1)[1])
+
+
+def split_runs(items, budget=MAX_MESSAGE - ENVELOPE):
+    """Split `items` into lists whose JSON takes at most `budget` bytes
+    (one item alone may take more). Always yields at least one list."""
+    run, size = [], 0
+    for item in items:
+        length = len(json.dumps(item)) + 2  # and a separator
+        if run and size + length > budget:
+            yield run
+            run, size = [], 0
+        run.append(item)
+        size += length
+    yield run
+
+
+def listing_message(entries) -> str:
+    """The `Game Room` reply: a JSON list of as many `entries` as fit in
+    one message. Clients that need every room page with RoomQuery."""
+    return json.dumps(next(split_runs(entries)))
+
+
+class RoomQuery:
+    """One page of the room directory: `limit` rooms from `offset` on, out
+    of the rooms with at least `free` open slots (0 includes full rooms),
+    in `sort` order. On the wire it is `offset:limit:sort:free`."""
+
+    SORTS = ("oldest", "newest", "players", "name")
+
+    def __init__(self, offset=0, limit=PAGE_SIZE, sort="oldest", free=1):
+        self.offset = max(0, offset)
+        self.limit = min(max(1, limit), MAX_PAGE_SIZE)
+        self.sort = sort if sort in self.SORTS else "oldest"
+        self.free = max(0, free)
+
+    @classmethod
+    def parse(cls, args):
+        """From a command's arguments; missing or empty ones keep their
+        default, and numbers that are not raise ValueError"""
+        values = {}
+        for name, value in zip(("offset", "limit", "sort", "free"), args):
+            if value:
+                values[name] = value if name == "sort" else int(value)
+        return cls(**values)
+
+    def __str__(self):
+        return f"{self.offset}:{self.limit}:{self.sort}:{self.free}"
+
+
+class RoomDirectory:
+    """Versioned room list that browsing clients subscribe to.
+
+    A client sends `Subscribe Rooms` once and gets the whole list as
+    RoomDirectory messages (numbered `part` of `parts`, as many as it
+    takes to keep each within MAX_MESSAGE). From then on, changes are
+    collected for DIRECTORY_FLUSH seconds and every subscriber gets them
+    as a RoomDiff of added, updated and removed rooms; several, each a
+    version of its own, if they do not fit in one message. Each diff
+    names the version it applies to, so a client that missed one can
+    tell and subscribe again.
+
+    With thousands of rooms a client only wants what fits on its screen:
+    `Subscribe Rooms:<RoomQuery>` gets a RoomPage instead, and a new one
+    only when a flush changed that page or the number of matching rooms.
+    The filtered and sorted order behind the pages is built once per
+    version for each (sort, free) in use, however many clients page it.
+
+    Entries are `room:password:players`; the display number in front of
+    them is up to the client. Feed it with `update`, which has the
+    signature of a RoomRegistry watcher.
+    """
+
+    def __init__(self, max_players, flush_delay=DIRECTORY_FLUSH):
+        self.max_players = max_players
+        self.flush_delay = flush_delay
+        self.entries = {}  # room_num -> entry, as of now
+        self.sent = {}  # room_num -> entry, as of `version`
+        self.counts = {}  # room_num -> players, in the order of `sent`
+        self.version = 0
+        self.changed = {}  # room numbers, as an ordered set
+        self.subscribers = {}  # key -> deliver(text)
+        self.viewers = {}  # key -> [deliver, query, (page, total) last sent]
+        self.views = {}  # (sort, free) -> room numbers in `sent`
+        self.flush_handle = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, room_num, entry) -> None:
+        """`entry` is the room's `id:room:password:players`, or None once
+        it is no longer open"""
+        if entry is None:
+            self.entries.pop(room_num, None)
+        else:
+            self.entries[room_num] = entry.split(":", 1)[1]
+        self.changed[room_num] = None
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self.flush)
+
+    def subscribe(self, key, deliver, query=None) -> None:
+        """Send the current list with deliver(text), then every diff; or,
+        given a RoomQuery, that page whenever it changes. Subscribing
+        again replaces the previous subscription of `key`."""
+        self.unsubscribe(key)
+        if query is None:
+            self.subscribers[key] = deliver
+            parts = list(split_runs(self.sent.items()))
+            for index, part in enumerate(parts):
+                self.send(deliver, json.dumps({
+                    "type": "RoomDirectory",
+                    "version": self.version,
+                    "part": index,
+                    "parts": len(parts),
+                    "rooms": dict(part),
+                }))
+            return
+        viewer = self.viewers[key] = [deliver, query, None]
+        self.show(viewer)
+
+    def unsubscribe(self, key) -> None:
+        self.subscribers.pop(key, None)
+        self.viewers.pop(key, None)
+
+    def subscriber_count(self) -> int:
+        return len(self.subscribers) + len(self.viewers)
+
+    def view(self, sort, free) -> list:
+        """Numbers of the rooms with `free` open slots, in `sort` order"""
+        rooms = self.views.get((sort, free))
+        if rooms is not None:
+            return rooms
+        counts = self.counts
+        limit = self.max_players - free
+        rooms = [num for num, count in counts.items() if count <= limit]
+        # sorts are stable (reversed ones too), so ties stay oldest first
+        if sort == "newest":
+            rooms.reverse()
+        elif sort == "players":
+            rooms.sort(key=counts.__getitem__, reverse=True)
+        elif sort == "name":
+            sent = self.sent
+            rooms.sort(key=lambda num: sent[num].partition(":")[0])
+        self.views[(sort, free)] = rooms
+        return rooms
+
+    def page(self, query) -> tuple:
+        """([room_num, entry] pairs on the page, rooms matching in all)"""
+        rooms = self.view(query.sort, query.free)
+        page = [[num, self.sent[num]] for num in rooms[query.offset:query.offset + query.limit]]
+        return page, len(rooms)
+
+    def page_message(self, query, page=None) -> str:
+        page, total = page or self.page(query)
+        return json.dumps({
+            "type": "RoomPage",
+            "version": self.version,
+            "offset": query.offset,
+            "total": total,
+            "rooms": page,
+        })
+
+    def show(self, viewer) -> None:
+        deliver, query, last = viewer
+        page = self.page(query)
+        if page != last:
+            viewer[2] = page
+            self.send(deliver, self.page_message(query, page))
+
+    @staticmethod
+    def send(deliver, message) -> None:
+        """deliver(message); a subscriber that fails does not keep the
+        rest from getting it, and finds the gap from the next version"""
+        try:
+            deliver(message)
+        except Exception as e:
+            print(f"[WARN] Could not send a room list update: {e}")
+
+    def flush(self) -> None:
+        self.flush_handle = None
+        changes = []  # (room_num, entry or None if removed, whether it is new)
+        # Only the changed rooms are looked at, in the order they changed
+        for room_num in self.changed:
+            entry = self.entries.get(room_num)
+            old = self.sent.get(room_num)
+            if entry == old:
+                continue
+            changes.append((room_num, entry, old is None))
+            if entry is None:
+                del self.sent[room_num]
+                del self.counts[room_num]
+                continue
+            self.sent[room_num] = entry
+            self.counts[room_num] = players(entry)
+        self.changed.clear()
+        if not changes:
+            return
+
+        self.views.clear()
+        for run in split_runs(changes):
+            self.version += 1
+            message = json.dumps({
+                "type": "RoomDiff",
+                "base": self.version - 1,
+                "version": self.version,
+                "added": {num: entry for num, entry, new in run if new},
+                "updated": {num: entry for num, entry, new in run if entry and not new},
+                "removed": [num for num, entry, _ in run if entry is None],
+            })
+            for deliver in list(self.subscribers.values()):
+                self.send(deliver, message)
+        for viewer in list(self.viewers.values()):
+            self.show(viewer)
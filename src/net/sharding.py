@@ -0,0 +1,66 @@
+"""Helpers for running the server as one acceptor plus N room workers.
+
+The acceptor ("front") owns the listening socket. It answers room-list
+queries itself and, as soon as a connection names a room, passes the socket
+to the worker process that owns that room over an AF_UNIX SOCK_SEQPACKET
+control channel (SCM_RIGHTS via socket.send_fds). Rooms are mapped to
+workers with a consistent hash ring so every room number always lands on
+the same worker.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import socket
+
+# virtual nodes per worker, evens out the share of rooms each one gets
+REPLICAS = 64
+MAX_MESSAGE = 65536
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping room numbers to worker indexes"""
+
+    def __init__(self, workers: int, replicas: int = REPLICAS) -> None:
+        self.points = sorted(
+            (_hash(f"worker-{w}:{r}"), w)
+            for w in range(workers)
+            for r in range(replicas)
+        )
+        self.keys = [point for point, _ in self.points]
+
+    def owner(self, room_num: str) -> int:
+        i = bisect.bisect(self.keys, _hash(str(room_num))) % len(self.keys)
+        return self.points[i][1]
+
+
+def control_pair():
+    """returns (front_end, worker_end) of a control channel"""
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+
+async def send_message(sock, message: dict, fds=()) -> None:
+    """Send one JSON control message (plus optional fds) on a non-blocking
+    SEQPACKET socket, waiting for buffer space instead of blocking the loop."""
+    data = json.dumps(message).encode()
+    while True:
+        try:
+            socket.send_fds(sock, [data], list(fds))
+            return
+        except BlockingIOError:
+            await asyncio.sleep(0.001)
+
+
+def recv_message(sock):
+    """Receive one control message; returns (message, fds) or (None, [])
+    on EOF. Raises BlockingIOError if nothing is pending."""
+    data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, 1)
+    if not data:
+        for fd in fds:
+            socket.close(fd)
+        return None, []
+    return json.loads(data), fds
@@ -0,0 +1,64 @@
+class Standings:
+    """Members of a room ordered by how far they have flown (x, furthest
+    first), for skill targeting and the rank sent with every snapshot.
+
+    Each member's 1-based place is kept in member["rank"]. A position
+    update moves its member past the neighbours it overtook or fell
+    behind, so the cost is the number of places that changed, usually
+    none. Members with equal x keep their current order.
+    """
+
+    def __init__(self):
+        self.order = []
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def add(self, member) -> None:
+        self.order.append(member)
+        member["rank"] = len(self.order)
+        self.moved(member)
+
+    def remove(self, member) -> None:
+        index = member["rank"] - 1
+        del self.order[index]
+        self._renumber(index, len(self.order))
+
+    def reset(self, members) -> None:
+        """Start over from `members` (in that order, on equal x)"""
+        self.order = sorted(members, key=_x, reverse=True)
+        self._renumber(0, len(self.order))
+
+    def moved(self, member) -> bool:
+        """Restore the order after member["game"]["x"] changed; True if
+        any rank changed. Only one member may be out of place: after
+        changing several, use reset."""
+        order = self.order
+        start = index = member["rank"] - 1
+        x = _x(member)
+        while index > 0 and _x(order[index - 1]) < x:
+            order[index] = order[index - 1]
+            index -= 1
+        while index < len(order) - 1 and _x(order[index + 1]) > x:
+            order[index] = order[index + 1]
+            index += 1
+        if index == start:
+            return False
+        order[index] = member
+        self._renumber(min(start, index), max(start, index) + 1)
+        return True
+
+    def leader(self, exclude=None):
+        """Member furthest ahead other than `exclude`, or None"""
+        for member in self.order:
+            if member is not exclude:
+                return member
+        return None
+
+    def _renumber(self, start, end) -> None:
+        for index in range(start, end):
+            self.order[index]["rank"] = index + 1
+
+
+def _x(member):
+    return member["game"]["x"]
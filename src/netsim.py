@@ -0,0 +1,197 @@
+"""Local proxy that puts simulated network conditions in front of the server.
+
+    python -m src.server --port 5555
+    python -m src.netsim --port 5556 --server-port 5555 --latency 0.08 --jitter 0.02
+    python -m src.loadgen --port 5556 --rooms 10
+
+Clients connect to the proxy instead of the server. TCP is relayed with
+latency, jitter, bandwidth caps and retransmission stalls for lost
+segments. The UDP state channel is relayed as well, with real loss and
+reordering: UdpToken messages are rewritten to send clients to a relay port
+of the proxy. `--scenario file.json` plays conditions that change over the
+run (format in net/netsim.py). Connections and UDP clients are numbered in
+arrival order and their links are seeded from that, so replaying a
+scenario with the same seed treats the n-th packet of each link the same.
+"""
+import argparse
+import asyncio
+import socket
+
+from .net import netsim, protocol
+
+HOST = "127.0.0.1"
+PORT = 5556
+SERVER_PORT = 5555
+RECV_SIZE = 65536
+
+
+def forward(writer, data):
+    if not writer.is_closing():
+        writer.write(data)
+
+
+def close(writer):
+    writer.close()
+
+
+class Proxy:
+    def __init__(self, scenario, host, server):
+        self.scenario = scenario
+        self.host = host
+        self.server = server  # (host, port)
+        self.connections = 0
+        self.udp_clients = 0
+        self.relays = {}  # server UDP port -> task creating its UdpRelay
+
+    async def serve(self, port):
+        listener = await asyncio.start_server(self.handle, self.host, port)
+        print(f"Relaying {self.host}:{port} -> {self.server[0]}:{self.server[1]}")
+        for start, conditions in self.scenario.phases:
+            print(f"  from {start}s: {conditions}")
+        async with listener:
+            await listener.serve_forever()
+
+    async def handle(self, client_reader, client_writer):
+        self.connections += 1
+        links = netsim.links(self.scenario, f"conn{self.connections}")
+        try:
+            server_reader, server_writer = await asyncio.open_connection(*self.server)
+        except OSError as e:
+            print(f"[ERROR] Cannot reach the server: {e}")
+            client_writer.close()
+            return
+        await asyncio.gather(
+            self.pump(client_reader, server_writer, links["up"]),
+            self.pump(server_reader, client_writer, links["down"], from_server=True),
+        )
+
+    async def pump(self, reader, writer, link, from_server=False):
+        """Relay one direction until EOF, then close the other end once
+        everything in flight has arrived"""
+        # Binary streams from the server are decoded to find UdpToken
+        decoder = None
+        head = b"" if from_server else None
+        while True:
+            try:
+                data = await reader.read(RECV_SIZE)
+            except OSError:
+                data = b""
+            if not data:
+                break
+
+            if head is not None:
+                # The start of the server's stream says which protocol it is
+                head += data
+                if len(head) < len(protocol.HELLO_ACK) and protocol.HELLO_ACK.startswith(head):
+                    continue
+                data, head = head, None
+                if data.startswith(protocol.HELLO_ACK):
+                    decoder = protocol.FrameDecoder()
+                    link.send(len(protocol.HELLO_ACK), forward, writer, protocol.HELLO_ACK)
+                    data = data[len(protocol.HELLO_ACK):]
+
+            if decoder is not None:
+                decoder.feed(data)
+                data = b"".join([await self.rewrite(*frame) for frame in decoder.frames()])
+            if data:
+                link.send(len(data), forward, writer, data)
+        link.send(0, close, writer)
+
+    async def rewrite(self, msg_type, payload):
+        """Re-encode one frame from the server, pointing UdpToken at our relay"""
+        if msg_type == protocol.MSG_TEXT and payload[:9] == b"UdpToken:":
+            _, token, port = str(payload, "utf-8").split(":")
+            relay = await self.relay(int(port))
+            return protocol.encode_text(f"UdpToken:{token}:{relay.port}")
+        return protocol.encode_frame(msg_type, bytes(payload))
+
+    async def relay(self, server_port):
+        task = self.relays.get(server_port)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = self.relays[server_port] = loop.create_task(loop.create_datagram_endpoint(
+                lambda: UdpRelay(self, (self.server[0], server_port)), local_addr=(self.host, 0)
+            ))
+        _, relay = await task
+        return relay
+
+
+class UdpRelay(asyncio.DatagramProtocol):
+    """Proxy port for one server UDP port. Each client address gets its own
+    socket towards the server, so replies can be told apart."""
+
+    def __init__(self, proxy, server):
+        self.proxy = proxy
+        self.server = server
+        self.transport = None
+        self.port = None
+        self.peers = {}  # client address -> UdpPeer
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.port = transport.get_extra_info("sockname")[1]
+
+    def datagram_received(self, data, addr):
+        peer = self.peers.get(addr)
+        if peer is None:
+            self.proxy.udp_clients += 1
+            links = netsim.links(self.proxy.scenario, f"udp{self.proxy.udp_clients}")
+            peer = self.peers[addr] = UdpPeer(self, addr, links)
+        peer.links["up_udp"].send(len(data), peer.send, data)
+
+
+class UdpPeer:
+    def __init__(self, relay, addr, links):
+        self.relay = relay
+        self.addr = addr
+        self.links = links
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.connect(relay.server)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self.readable)
+
+    def send(self, data):
+        try:
+            self.sock.send(data)
+        except OSError:
+            pass  # e.g. ICMP unreachable from an earlier datagram; UDP is lossy
+
+    def readable(self):
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except OSError:
+            return
+        self.links["down_udp"].send(len(data), self.relay.transport.sendto, data, self.addr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Network condition simulator for the server")
+    parser.add_argument("--host", default=HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="port clients connect to")
+    parser.add_argument("--server-host", default=HOST)
+    parser.add_argument("--server-port", type=int, default=SERVER_PORT)
+    parser.add_argument("--scenario", help="JSON scenario file; overrides the options below")
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds added to the delay")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability a packet is lost")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability a datagram is held back")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes per second per direction, 0 = unlimited")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.scenario:
+        scenario = netsim.Scenario.load(args.scenario)
+    else:
+        scenario = netsim.Scenario.constant(
+            netsim.Conditions(args.latency, args.jitter, args.loss, args.reorder, args.bandwidth),
+            args.seed,
+        )
+    proxy = Proxy(scenario, args.host, (args.server_host, args.server_port))
+    try:
+        asyncio.run(proxy.serve(args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
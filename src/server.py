@@ -1,30 +1,304 @@
-import socket
+import argparse
+import asyncio
+import collections
 import json
-from _thread import start_new_thread
-
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server = '0.0.0.0'
-port = 5555
-
-try:
-    s.bind((server, port))
-except socket.error as e:
-    print(str(e))
-
-s.listen(4)
-print("Waiting for a connection")
-
-room_list = []
-room_members = {}
-full_room_list = []
-room_states = {}
-ready_players = {}
-ready_next_index = {}
-early_ready = {}
-start_room = {}
-
-def broadcast_lobby_update(room_num):
-    if room_num in room_members:
+import multiprocessing
+import secrets
+import socket
+import time
+
+from .net import (
+    HashRing,
+    Metrics,
+    RoomDirectory,
+    RoomQuery,
+    RoomRegistry,
+    Standings,
+    listing_message,
+    lockstep,
+    metrics,
+    protocol,
+    sharding,
+)
+
+HOST = "0.0.0.0"
+PORT = 5555
+MAX_PLAYERS = 4
+TICK_RATE = 30  # GameUpdate snapshots per second, per room
+MAX_OUTBOX = 256  # queued messages per connection before it is dropped
+METRICS_PORT = 9555
+STATS_INTERVAL = 10  # seconds between --stats-file rewrites
+# pixels of scrolling between two pipes, sent with the match seed
+PIPE_SPACING = 192
+# lockstep mode: frames the server's birds trail their clients, so that
+# inputs usually arrive before the frame they are stamped for
+INPUT_DELAY = 6
+# lockstep mode: frames a client may run ahead of the match clock (its
+# estimate of our clock can be off); later frame numbers are dropped
+FRAME_MARGIN = 2 * lockstep.FPS
+# seconds between AllReady and the start of the match (the client countdown)
+COUNTDOWN = 3
+# seconds after Start that players have to send Ready, see Room.on_ready_timeout
+READY_TIMEOUT = 10
+MATCH_TIME = 300  # seconds a match lasts
+# seconds without a byte from a client before it is dropped; quiet binary
+# clients get a Heartbeat (which they answer) after a third of that, text
+# clients are probed by TCP keepalive instead (see keep_alive)
+IDLE_TIMEOUT = 30
+
+# per-packet logging, switched on with --debug
+DEBUG = False
+
+# outbox placeholder for the connection's latest pending snapshot
+SNAPSHOT = object()
+
+
+def debug(*args):
+    if DEBUG:
+        print(*args)
+
+
+def pong(ping):
+    """Reply to Ping:<client time> with our clock, for the client's offset
+    estimate (utils/clock.py)"""
+    sent = ping.split(":")[1]
+    return f"Pong:{sent}:{time.time():.6f}"
+
+
+def keep_alive(sock, idle_timeout):
+    """Have the kernel probe a quiet connection. This is what catches text
+    clients, which do not answer Heartbeat (nor can be told from a client
+    yet to speak): one that vanished is reset after about idle_timeout and
+    closes like any other connection."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):  # elsewhere the system timing applies
+        probe = max(int(idle_timeout / 3), 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, probe)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, probe)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 2)
+
+
+def new_game_state():
+    return {"x": 0, "y": 0, "rot": 0.0, "res": False, "pen": False, "tf": False}
+
+
+def new_member(session, player_id, host):
+    return {
+        "session": session,
+        "player_id": player_id,
+        "name": f"Player {player_id + 1}",
+        "skin_id": 0,
+        "lobby": {"ready": False, "host": host},
+        "game": new_game_state(),
+        "rank": None,  # place in the race, kept by the room's Standings
+        # lockstep mode: the member's bird and (frame, time) it last reported
+        "sim": None,
+        "anchor": None,
+    }
+
+
+class Session:
+    """One client connection.
+
+    Outgoing data is queued and written by the session's own flush task, so
+    a client that stops reading only ever delays itself. Control messages
+    are queued in order and always delivered (a client that lets
+    MAX_OUTBOX of them pile up is disconnected). Snapshots are superseded
+    instead: at most one is pending, and a newer one replaces it.
+    """
+
+    def __init__(self, conn, metrics):
+        self.conn = conn
+        self.metrics = metrics
+        self.closed = False
+        self.last_seen = time.monotonic()  # last data from the client, TCP or UDP
+        self.outbox = collections.deque()
+        self.snapshot = None
+        self.wakeup = asyncio.Event()
+        self.flusher = asyncio.create_task(self.flush_loop())
+        # switched on by the protocol.HELLO handshake
+        self.binary = False
+        self.negotiated = False
+        # receive buffer the connection reads into (see ClientProtocol);
+        # text connections use it as a plain buffer
+        self.decoder = protocol.FrameDecoder()
+        # player_id -> (x, y, rot, flags, rank) this client last received
+        self.baseline = {}
+        # UDP state channel, set up by UdpOpen + MSG_UDP_HELLO. Snapshots
+        # only go to udp_addr once the client has confirmed the channel
+        # (UdpReady or a position datagram); until then its hello's
+        # address waits in udp_peer
+        self.udp_token = None
+        self.udp_peer = None
+        self.udp_addr = None
+        self.udp_seq_in = None
+        self.udp_seq_out = 0
+
+    def write(self, data: bytes):
+        """Queue bytes that must be delivered"""
+        if self.closed:
+            return
+        if len(self.outbox) >= MAX_OUTBOX:
+            print("[WARN] Client is not reading, closing its connection")
+            self.metrics.inc("send_failures_total", reason="overflow")
+            self.close()
+            return
+        self.outbox.append(data)
+        self.wakeup.set()
+
+    def write_snapshot(self, snapshot):
+        """Queue a GameUpdate, replacing any older one still waiting.
+
+        `snapshot` is the JSON bytes for text clients, or the
+        player_id -> (x, y, rot, flags, rank) states that binary clients get as a
+        delta; the delta is only encoded when it is actually written, so a
+        dropped snapshot never leaves the baseline ahead of the client.
+        """
+        if self.closed:
+            return
+        if self.snapshot is not None:
+            self.outbox.remove(SNAPSHOT)
+            self.metrics.inc("snapshots_superseded_total")
+        self.snapshot = snapshot
+        self.outbox.append(SNAPSHOT)
+        self.wakeup.set()
+
+    def discard_snapshot(self):
+        if self.snapshot is not None:
+            self.outbox.remove(SNAPSHOT)
+            self.snapshot = None
+
+    async def flush_loop(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.outbox:
+                    data = self.outbox.popleft()
+                    if data is SNAPSHOT:
+                        data, self.snapshot = self.snapshot, None
+                        if self.binary:
+                            data = protocol.encode_game_delta(self.baseline, data)
+                            if data is None:
+                                continue
+                    self.conn.write(data)
+                    self.metrics.inc("messages_sent_total", transport="tcp")
+                    self.metrics.inc("bytes_sent_total", len(data), transport="tcp")
+                    # Waits only while this client's socket buffer is full
+                    await self.conn.drain()
+        except (ConnectionError, RuntimeError):
+            self.metrics.inc("send_failures_total", reason="error")
+
+    def close(self):
+        self.closed = True
+        self.flusher.cancel()
+        self.outbox.clear()
+        self.snapshot = None
+        self.conn.close()
+
+    def send(self, text: str):
+        """Send a text command/JSON message in this connection's framing"""
+        if self.binary:
+            self.write(protocol.encode_text(text))
+        else:
+            self.write(text.encode())
+
+
+class Room:
+    """A game room. Its members and match state are only ever touched by the
+    room's own task, which consumes commands from `inbox` one at a time."""
+
+    def __init__(self, server, room_id, room_num, password):
+        self.server = server
+        self.registry = server.registry
+        self.room_id = room_id
+        self.room_num = room_num
+        self.password = password
+        self.members = []
+        self.standings = Standings()
+        self.listed = True
+        self.default_initialized = False
+        # sessions that sent Ready for the match being started, and the
+        # timer that stops waiting for the rest (None when not starting)
+        self.ready_sessions = set()
+        self.ready_timer = None
+        self.dirty = False
+        self.inbox = asyncio.Queue()
+        self.task = None
+        self.ticker = None
+        self.end_timer = None  # ends the running match at its announced time
+        self.match_start = None  # time.monotonic() of the running match's frame 0
+
+    @property
+    def entry(self):
+        return f"{self.room_id}:{self.room_num}:{self.password}:{len(self.members)}"
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        self.stop_match()
+        if self.task:
+            self.task.cancel()
+
+    def start_ticker(self):
+        if self.ticker is None:
+            self.ticker = asyncio.create_task(self.tick_loop())
+
+    def stop_ticker(self):
+        if self.ticker:
+            self.ticker.cancel()
+            self.ticker = None
+
+    def stop_match(self):
+        if self.ready_timer:
+            self.ready_timer.cancel()
+            self.ready_timer = None
+        self.stop_ticker()
+        if self.end_timer:
+            self.end_timer.cancel()
+            self.end_timer = None
+
+    async def tick_loop(self):
+        """Run on_tick every 1/tick_rate seconds on a fixed schedule"""
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.server.tick_rate
+        next_tick = loop.time()
+        while True:
+            next_tick += interval
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            self.submit(self.on_tick)
+
+    def post(self, session, parts):
+        self.submit(self.handle, session, parts)
+
+    def submit(self, func, *args):
+        """Queue `func(*args)` to run on the room's task"""
+        self.inbox.put_nowait((func, args))
+
+    async def run(self):
+        while True:
+            func, args = await self.inbox.get()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Error in room {self.room_num}:", e)
+
+    def handle(self, session, parts):
+        command = parts[0]
+        handler = self.handlers.get(command)
+        if handler:
+            handler(self, session, parts)
+        elif command == self.room_num:
+            self.on_position(session, parts)
+
+    # --- broadcasts ------------------------------------------------------
+
+    def broadcast(self, data):
+        for m in self.members:
+            m["session"].send(data)
+
+    def broadcast_lobby_update(self):
         players_info = [
             {
                 "player_id": m["player_id"],
@@ -33,18 +307,63 @@ def broadcast_lobby_update(room_num):
                 "ready": m["lobby"]["ready"],
                 "host": m["lobby"]["host"]
             }
-            for m in room_members[room_num]
+            for m in self.members
         ]
-        message = json.dumps({"type": "LobbyUpdate", "players": players_info})
-
-        for m in room_members[room_num]:
-            try:
-                m["conn"].send(message.encode())
-            except:
-                pass
-
-def broadcast_game_update(room_num):
-    if room_num in room_members:
+        started = time.perf_counter()
+        self.broadcast(json.dumps({"type": "LobbyUpdate", "players": players_info}))
+        self.server.metrics.observe("broadcast_seconds", time.perf_counter() - started, kind="lobby")
+
+    def send_player_info(self):
+        """Send the static roster to binary clients and restart their deltas
+        from an empty baseline, so the next tick carries full state."""
+        frame = protocol.encode_player_info([
+            {"player_id": m["player_id"], "name": m["name"], "skin_id": m["skin_id"]}
+            for m in self.members
+        ])
+        for m in self.members:
+            session = m["session"]
+            if session.binary:
+                # A queued delta against the old baseline would land
+                # before the roster and be ignored by the client
+                session.discard_snapshot()
+                session.baseline = {}
+                session.write(frame)
+        self.dirty = True
+
+    def roster_changed(self):
+        # Only matters mid-match; the roster is sent again at every AllReady
+        if self.ticker:
+            self.send_player_info()
+
+    def broadcast_game_update(self, reliable=False):
+        """Send every member the current game state. Unless `reliable`,
+        members with a UDP state channel get it as a datagram."""
+        if any(m["session"].binary for m in self.members):
+            states = {
+                m["player_id"]: (
+                    m["game"]["x"],
+                    m["game"]["y"],
+                    m["game"]["rot"],
+                    protocol.pack_flags(m["game"]["res"], m["game"]["pen"], m["game"]["tf"]),
+                    m["rank"],
+                )
+                for m in self.members
+            }
+            snapshot = None
+            for m in self.members:
+                session = m["session"]
+                if session.udp_addr and not reliable:
+                    # Datagrams can be lost, so always send the full state
+                    if snapshot is None:
+                        snapshot = protocol.pack_game_delta({}, states)
+                    self.server.send_datagram(session, protocol.MSG_GAME_DELTA, snapshot)
+                elif session.binary:
+                    session.write_snapshot(states)
+
+        if all(m["session"].binary for m in self.members):
+            return
+
+        # Text clients still get the full JSON snapshot
         game_info = [
             {
                 "player_id": m["player_id"],
@@ -55,468 +374,1149 @@ def broadcast_game_update(room_num):
                 "rot": m["game"]["rot"],
                 "respawn": m["game"]["res"],
                 "penetration": m["game"]["pen"],
-                "time_freeze": m["game"]["tf"]
+                "time_freeze": m["game"]["tf"],
+                "rank": m["rank"],
             }
-            for m in room_members[room_num]
+            for m in self.members
         ]
-
-        message = json.dumps({"type": "GameUpdate", "players": game_info})
-        for m in room_members[room_num]:
-            try:
-                m["conn"].send(message.encode())
-            except:
-                pass
-
-def notify_room_closed(room_num):
-    """Notify all members that the room has been closed"""
-    if room_num in room_members:
-        message = json.dumps({"type": "RoomClosed"})
-        for m in room_members[room_num]:
-            try:
-                m["conn"].send(message.encode())
-            except:
-                pass
-
-def threaded_client(conn):
-    global room_list, room_members, full_room_list, room_states, ready_players, ready_next_index, early_ready, start_room
-
-    while True:
+        text = json.dumps({"type": "GameUpdate", "players": game_info}).encode()
+        for m in self.members:
+            if not m["session"].binary:
+                m["session"].write_snapshot(text)
+
+    def notify_room_closed(self):
+        """Notify all members that the room has been closed"""
+        self.broadcast(json.dumps({"type": "RoomClosed"}))
+
+    # --- membership ------------------------------------------------------
+
+    def member_by_session(self, session):
+        member = self.registry.member_of(session)
+        if member and member["room"] is self:
+            return member
+        return None
+
+    def member_by_id(self, player_id):
+        for m in self.members:
+            if m["player_id"] == player_id:
+                return m
+        return None
+
+    def reassign_ids(self):
+        """Keep the host as player 0 and renumber everyone else from 1"""
+        host = None
+        others = []
+        for m in self.members:
+            if m["player_id"] == 0:
+                host = m
+            else:
+                others.append(m)
+
+        for i, m in enumerate(others, start=1):
+            m["player_id"] = i
+            m["session"].send(f"UpdateID:{i}\n")
+
+        self.members = ([host] if host else []) + others
+
+    def add_member(self, session, host):
+        member = new_member(session, len(self.members), host)
+        self.members.append(member)
+        self.standings.add(member)
+        self.registry.add_member(self, member)
+        self.registry.update(self)
+        return member
+
+    def remove_member(self, member):
+        self.members.remove(member)
+        self.standings.remove(member)
+        self.registry.remove_member(member)
+
+        if not self.members:
+            self.server.remove_room(self)
+            return
+        if member["player_id"] == 0:
+            # Only the host can Start or Restart, the room is no use now
+            print(f"[INFO] Host left room {self.room_num}, closing it")
+            self.close()
+            return
+
+        self.reassign_ids()
+
+        self.registry.update(self)
+        self.broadcast_lobby_update()
+        self.roster_changed()
+        # The match may have been waiting only for this player
+        self.ready_sessions.discard(member["session"])
+        self.check_ready()
+
+    # --- command handlers ------------------------------------------------
+
+    def on_create(self, session, parts):
+        self.add_member(session, host=True)
+        session.send(f"Joined:{self.room_num}:0:host")
+        self.broadcast_lobby_update()
+
+    def on_join(self, session, parts):
+        if len(self.members) >= MAX_PLAYERS:
+            print(f"[INFO] Room {self.room_num} is full")
+            return
+
+        member = self.add_member(session, host=False)
+        session.send(f"Joined:{self.room_num}:{member['player_id']}:member")
+        self.broadcast_lobby_update()
+
+    def on_leave(self, session, parts):
+        member = self.member_by_session(session)
+        if member:
+            self.remove_member(member)
+
+    def on_disconnect(self, session):
+        """The connection is gone without a Leave Room: same thing"""
+        member = self.member_by_session(session)
+        if member:
+            print(f"[INFO] Player {member['player_id']} disconnected from room {self.room_num}")
+            self.remove_member(member)
+
+    def on_remove(self, session, parts):
+        self.close()
+
+    def close(self):
+        # Notify all members before removing the room
+        self.notify_room_closed()
+        self.server.remove_room(self)
+        self.members = []
+
+    def on_kick(self, session, parts):
+        target = self.member_by_id(int(parts[2]))
+        if target:
+            target["session"].send("Kicked\n")
+            self.remove_member(target)
+
+    def on_update(self, session, parts):
+        name, skin_id, ready_str = parts[3], int(parts[4]), parts[5]
+
+        # Match on the connection so player_id shifts don't matter
+        member = self.member_by_session(session)
+        if member:
+            entry = (name, skin_id, ready_str == "True")
+            if entry == (member["name"], member["skin_id"], member["lobby"]["ready"]):
+                return  # a keepalive, everyone already has this
+            member["name"], member["skin_id"], member["lobby"]["ready"] = entry
+
+        self.broadcast_lobby_update()
+
+    def on_start(self, session, parts):
+        # Hide the room from the room list while the match runs
+        self.listed = False
+        self.registry.update(self)
+
+        # Everyone sends Ready as soon as their game is set up, in any
+        # order; the match starts once all have, or at the timeout
+        self.stop_match()
+        self.ready_sessions = set()
+        self.ready_timer = asyncio.get_running_loop().call_later(
+            self.server.ready_timeout, self.submit, self.on_ready_timeout
+        )
+        self.broadcast("Start")
+
+    def on_ready(self, session, parts):
+        # Matched on the connection: player ids shift when someone leaves
+        if self.ready_timer is None or not self.member_by_session(session):
+            return  # no match starting, or it already has
+        self.ready_sessions.add(session)
+        self.check_ready()
+
+    def check_ready(self):
+        if self.ready_timer is None or not self.members:
+            return
+        if all(m["session"] in self.ready_sessions for m in self.members):
+            self.ready_timer.cancel()
+            self.ready_timer = None
+            self.begin_match()
+
+    def on_ready_timeout(self):
+        """Players that did not send Ready in time are kicked and the
+        match starts without them. If that would leave no one, or no
+        host, the room goes back to the lobby instead."""
+        if self.ready_timer is None:
+            return  # started or stopped after the timer fired
+        self.ready_timer = None
+        stragglers = [m for m in self.members if m["session"] not in self.ready_sessions]
+        if len(stragglers) == len(self.members) or any(m["player_id"] == 0 for m in stragglers):
+            print(f"[INFO] Room {self.room_num} was not ready in time, back to the lobby")
+            self.return_to_lobby()
+            return
+
+        for m in stragglers:
+            print(f"[INFO] Player {m['player_id']} was not ready in time, removing them from room {self.room_num}")
+            self.server.metrics.inc("ready_evictions_total")
+            m["session"].send("Kicked\n")
+            self.remove_member(m)
+        self.begin_match()
+
+    def begin_match(self):
+        # Start and end on our clock; clients convert them to theirs, so
+        # the match starts and ends at the same moment for everyone
+        start = time.time() + COUNTDOWN
+        end = start + self.server.match_time
+        self.match_start = time.monotonic() + COUNTDOWN
+        self.end_timer = asyncio.get_running_loop().call_later(
+            end - time.time(), self.submit, self.end_match
+        )
+        # Every client builds the same pipe course from this seed
+        seed = secrets.randbits(32)
+        self.broadcast(f"AllReady:{seed}:{PIPE_SPACING}:{self.server.netcode}:{start:.6f}:{end:.6f}")
+        if self.server.netcode == "lockstep":
+            self.start_lockstep(seed)
+        self.start_ticker()
+        self.send_player_info()
+
+    def on_tick(self):
+        self.advance_sims()
+        # One coalesced snapshot per tick, only if something moved
+        if self.dirty:
+            self.dirty = False
+            started = time.perf_counter()
+            self.broadcast_game_update()
+            self.server.metrics.observe("broadcast_seconds", time.perf_counter() - started, kind="game")
+
+    def end_match(self):
+        """Freeze the standings at the announced end time: positions are
+        no longer accepted, and everyone gets the same final snapshot"""
+        self.end_timer = None
+        self.stop_ticker()
+        self.dirty = False
+        for m in self.members:
+            session = m["session"]
+            if session.binary:
+                # In full and over TCP: UDP snapshots may have been lost
+                session.discard_snapshot()
+                session.baseline = {}
+        self.broadcast_game_update(reliable=True)
+        self.broadcast("MatchEnd")
+        print(f"[INFO] Match ended in room {self.room_num}")
+
+    def on_position(self, session, parts):
+        # Text form: room:id:x:y:rot:res:pen:tf
+        self.set_position(
+            session,
+            int(parts[1]),
+            float(parts[2]),
+            float(parts[3]),
+            float(parts[4]),
+            parts[5] == "True",
+            parts[6] == "True",
+            parts[7] == "True",
+        )
+
+    def set_position(self, session, player_id, x, y, rot, respawn, penetration, time_freeze):
+        member = self.member_by_id(player_id)
+        # Lockstep birds are simulated here, never taken from the client;
+        # and nothing moves outside a running match
+        if member and not member["sim"] and self.ticker:
+            member["game"]["x"] = x
+            member["game"]["y"] = y
+            member["game"]["rot"] = rot
+            member["game"]["res"] = respawn
+            member["game"]["pen"] = penetration
+            member["game"]["tf"] = time_freeze
+            self.standings.moved(member)
+            self.dirty = True
+
+    def on_pipe(self, session, parts):
+        # Legacy hosts still roll the gaps and send them; legacy members
+        # build their pipes from these rather than from the match seed.
+        # Binary clients always use the seeded course
+        message = f"Pipe:{self.room_num}:{parts[2]}:"
+        for m in self.members:
+            if not m["session"].binary and m["session"] is not session:
+                m["session"].send(message)
+
+    def leader(self, exclude_id):
+        """Member furthest ahead (highest x), ignoring `exclude_id`"""
+        return self.standings.leader(exclude=self.member_by_id(exclude_id))
+
+    def on_use_freeze(self, session, parts):
+        user_id = int(parts[2])
+        debug(f"DEBUG SERVER: Player {user_id} used freeze in room {self.room_num}")
+
+        target = self.leader(exclude_id=user_id)
+        if target:
+            target["session"].send(f"GetFrozen:{user_id}")
+            if target["sim"]:
+                target["sim"].bird.freeze()
+                self.resync(target)
+            debug(f"DEBUG SERVER: Player {user_id} froze player {target['player_id']} (highest X: {target['game']['x']})")
+        else:
+            debug(f"DEBUG SERVER: No valid target found for freeze from player {user_id}")
+
+    def on_use_teleport(self, session, parts):
+        user_id = int(parts[2])
+        debug(f"DEBUG SERVER: Player {user_id} used teleport in room {self.room_num}")
+
+        user = self.member_by_id(user_id)
+        target = self.leader(exclude_id=user_id)
+        if not (user and target):
+            return
+
+        # Swap positions
+        user_x, user_y = user["game"]["x"], user["game"]["y"]
+        target_x, target_y = target["game"]["x"], target["game"]["y"]
+        user["game"]["x"], user["game"]["y"] = target_x, target_y
+        target["game"]["x"], target["game"]["y"] = user_x, user_y
+        # Two birds moved at once: moved() fixes up one at a time
+        self.standings.reset(self.standings.order)
+        self.dirty = True
+        for m, (x, y) in ((user, (target_x, target_y)), (target, (user_x, user_y))):
+            if m["sim"]:
+                m["sim"].bird.teleport(x, y)
+                self.resync(m)
+
+        user["session"].send(f"TeleportTo:{target_x}:{target_y}")
+        target["session"].send(f"TeleportTo:{user_x}:{user_y}")
+        debug(f"DEBUG SERVER: Teleport swap completed between {user_id} and {target['player_id']}")
+
+    def start_lockstep(self, seed):
+        course = lockstep.Course(seed, PIPE_SPACING)
+        for m in self.members:
+            # Text clients keep streaming positions
+            if m["session"].binary:
+                m["sim"] = lockstep.LockstepSim(m["player_id"], course)
+                m["anchor"] = None
+
+    def advance_sims(self):
+        """Run every lockstep bird up to INPUT_DELAY frames behind where
+        its client should be by now"""
+        now = time.monotonic()
+        for m in self.members:
+            if m["sim"] and m["anchor"]:
+                frame, at = m["anchor"]
+                m["sim"].advance_to(frame + int((now - at) * lockstep.FPS) - INPUT_DELAY)
+                self.load_sim_state(m)
+
+    def load_sim_state(self, member):
+        x, y, rot, respawn, penetration, time_freeze = member["sim"].bird.snapshot()
+        game = member["game"]
+        if (game["x"], game["y"], game["rot"]) != (x, y, rot) or (
+            game["res"], game["pen"], game["tf"]
+        ) != (respawn, penetration, time_freeze):
+            game.update(x=x, y=y, rot=rot, res=respawn, pen=penetration, tf=time_freeze)
+            self.standings.moved(member)
+            self.dirty = True
+
+    def frame_allowed(self, frame):
+        """Whether the match clock allows a client to have reached
+        `frame`: clients start frame 0 when the countdown ends, so a
+        forged or corrupt frame number cannot make us simulate ahead"""
+        elapsed = max(0.0, time.monotonic() - self.match_start)
+        if frame <= elapsed * lockstep.FPS + FRAME_MARGIN:
+            return True
+        self.server.metrics.inc("lockstep_frames_rejected_total")
+        return False
+
+    def on_input(self, session, frame, kind):
+        member = self.member_by_session(session)
+        if member and member["sim"] and self.frame_allowed(frame):
+            member["anchor"] = (frame, time.monotonic())
+            member["sim"].add_input(frame, kind)
+
+    def on_state_hash(self, session, frame, state_hash):
+        member = self.member_by_session(session)
+        if not (member and member["sim"] and self.frame_allowed(frame)):
+            return
+        member["anchor"] = (frame, time.monotonic())
+        sim = member["sim"]
+        # The client hashed after simulating `frame`
+        sim.advance_to(frame + 1)
+        expected = sim.hashes.get(frame)
+        if expected is not None and expected != state_hash:
+            self.resync(member)
+
+    def resync(self, member):
+        """Send the member's authoritative bird; the client rewinds to it"""
+        sim = member["sim"]
+        # Continue from exactly what the client will load (float32 fields)
+        sim.bird.unpack(sim.bird.pack())
+        member["session"].write(
+            protocol.encode_frame(protocol.MSG_RESYNC, lockstep.encode_resync(sim.frame, sim.bird))
+        )
+        self.server.metrics.inc("lockstep_resyncs_total")
+        self.load_sim_state(member)
+
+    def on_restart(self, session, parts):
+        print(f"[INFO] Host restarted room {self.room_num}")
+        self.return_to_lobby()
+
+    def return_to_lobby(self):
+        # Notify all players in the room to return to lobby
+        self.broadcast("Restart")
+        self.stop_match()
+        self.dirty = False
+
+        for m in self.members:
+            m["game"] = new_game_state()
+            m["lobby"]["ready"] = False
+            m["sim"] = m["anchor"] = None
+        self.standings.reset(self.members)
+
+        self.listed = True
+        self.registry.update(self)
+
+        self.default_initialized = False
+        self.ready_sessions = set()
+
+    handlers = {
+        "Create Room": on_create,
+        "Join Room": on_join,
+        "Leave Room": on_leave,
+        "Remove Room": on_remove,
+        "Kick": on_kick,
+        "Update": on_update,
+        "Start": on_start,
+        "Ready": on_ready,
+        "Pipe": on_pipe,
+        "UseFreeze": on_use_freeze,
+        "UseTeleport": on_use_teleport,
+        "Restart": on_restart,
+    }
+
+
+class Server:
+    """Accepts connections and routes each command to the room that owns it.
+
+    Everything runs on one event loop thread, so the room directory below is
+    never mutated concurrently and needs no locking.
+    """
+
+    # Commands that carry the room number as their first argument
+    ROOM_COMMANDS = (
+        "Join Room",
+        "Leave Room",
+        "Remove Room",
+        "Kick",
+        "Update",
+        "Ready",
+        "Pipe",
+        "UseFreeze",
+        "UseTeleport",
+    )
+    # Commands that apply to the sender's current room
+    SESSION_COMMANDS = ("Start", "Restart")
+
+    def __init__(self, tick_rate=TICK_RATE, netcode="state", match_time=MATCH_TIME,
+                 idle_timeout=IDLE_TIMEOUT, ready_timeout=READY_TIMEOUT):
+        self.tick_rate = tick_rate
+        self.match_time = match_time
+        self.idle_timeout = idle_timeout
+        self.ready_timeout = ready_timeout
+        self.sessions = set()
+        # "state": clients stream positions; "lockstep": clients send inputs
+        self.netcode = netcode
+        self.registry = RoomRegistry(MAX_PLAYERS)
+        # pushed to clients browsing the room list, see RoomDirectory
+        self.directory = RoomDirectory(MAX_PLAYERS)
+        self.registry.watchers.append(self.directory.update)
+        # UDP state channel transport and token -> Session
+        self.udp = None
+        self.udp_sessions = {}
+        self.metrics = Metrics()
+        self.metrics.gauge("rooms", self.room_counts)
+        self.metrics.gauge(
+            "room_list_subscribers", lambda: {(): self.directory.subscriber_count()}
+        )
+
+    def room_counts(self):
+        """rooms by state, for the `rooms` gauge"""
+        listed = len(self.registry.open) + len(self.registry.full)
+        return {
+            (("state", "open"),): len(self.registry.open),
+            (("state", "full"),): len(self.registry.full),
+            (("state", "playing"),): len(self.registry) - listed,
+        }
+
+    def create_room(self, room_num, password):
+        existing = self.registry.get(room_num)
+        if existing:
+            self.remove_room(existing)
+
+        room = Room(self, str(len(self.registry.open) + 1), room_num, password)
+        self.registry.add(room)
+        room.start()
+        return room
+
+    def remove_room(self, room):
+        self.registry.remove(room)
+        room.stop()
+
+    def dispatch(self, session, data):
+        parts = data.split(":")
+        command = parts[0]
+        handler = self.handlers.get(command)
+        if handler:
+            handler(self, session, parts)
+        elif command in self.registry:
+            # In-game position packet: room:id:x:y:rot:res:pen:tf
+            self.registry.get(command).post(session, parts)
+
+    # --- command handlers ------------------------------------------------
+
+    def on_game_room(self, session, parts):
+        if len(parts) > 1:
+            session.send(self.directory.page_message(RoomQuery.parse(parts[1:])))
+        else:
+            session.send(self.registry.listing())
+
+    def on_subscribe_rooms(self, session, parts):
+        query = RoomQuery.parse(parts[1:]) if len(parts) > 1 else None
+        self.directory.subscribe(session, session.send, query)
+
+    def on_unsubscribe_rooms(self, session, parts):
+        self.directory.unsubscribe(session)
+
+    def on_create_room(self, session, parts):
+        # Done browsing
+        self.directory.unsubscribe(session)
+        room = self.create_room(parts[1], parts[2])
+        room.post(session, parts)
+
+    def on_room_command(self, session, parts):
+        if parts[0] == "Join Room":
+            self.directory.unsubscribe(session)
+        room = self.registry.get(parts[1])
+        if room:
+            room.post(session, parts)
+
+    def on_session_command(self, session, parts):
+        room = self.registry.room_of(session)
+        if room:
+            room.post(session, parts)
+
+    def on_ping(self, session, parts):
+        session.send(pong(":".join(parts)))
+
+    def on_heartbeat(self, session, parts):
+        pass  # any traffic counts, see watch_idle
+
+    def on_udp_open(self, session, parts):
+        self.open_state_channel(session)
+
+    def on_udp_ready(self, session, parts):
+        # Our hello echo got through: switch snapshots to UDP
+        if session.udp_addr is None:
+            session.udp_addr = session.udp_peer
+
+    def on_udp_close(self, session, parts):
+        # The client gave up on UDP, everything goes over TCP again
+        self.close_state_channel(session)
+
+    handlers = {
+        "Game Room": on_game_room,
+        "Subscribe Rooms": on_subscribe_rooms,
+        "Unsubscribe Rooms": on_unsubscribe_rooms,
+        "Create Room": on_create_room,
+        **dict.fromkeys(ROOM_COMMANDS, on_room_command),
+        **dict.fromkeys(SESSION_COMMANDS, on_session_command),
+        "Ping": on_ping,
+        "Heartbeat": on_heartbeat,
+        "UdpOpen": on_udp_open,
+        "UdpReady": on_udp_ready,
+        "UdpClose": on_udp_close,
+    }
+
+    def dispatch_frame(self, session, msg_type, payload):
+        if msg_type == protocol.MSG_TEXT:
+            text = str(payload, "utf-8")
+            debug("Received:", text)
+            self.dispatch(session, text)
+
+        elif msg_type == protocol.MSG_POSITION:
+            room = self.registry.room_of(session)
+            if room:
+                room.submit(room.set_position, session, *protocol.decode_position(payload))
+
+        elif msg_type == protocol.MSG_INPUT:
+            room = self.registry.room_of(session)
+            if room:
+                room.submit(room.on_input, session, *protocol.INPUT.unpack(payload))
+
+        elif msg_type == protocol.MSG_STATE_HASH:
+            room = self.registry.room_of(session)
+            if room:
+                room.submit(room.on_state_hash, session, *protocol.STATE_HASH.unpack(payload))
+
+    def open_state_channel(self, session):
+        """Hand a binary client the token for its UDP state channel"""
+        if not (self.udp and session.binary):
+            return
+        if session.udp_token is None:
+            session.udp_token = secrets.randbits(32)
+            self.udp_sessions[session.udp_token] = session
+        port = self.udp.get_extra_info("sockname")[1]
+        session.send(f"UdpToken:{session.udp_token}:{port}")
+
+    def close_state_channel(self, session):
+        self.udp_sessions.pop(session.udp_token, None)
+        if session.udp_addr:
+            # The client has applied full UDP snapshots since the last TCP
+            # delta: the next one over TCP must be full as well
+            session.discard_snapshot()
+            session.baseline = {}
+        session.udp_token = None
+        session.udp_peer = session.udp_addr = None
+
+    def send_datagram(self, session, msg_type, payload=b"", addr=None):
+        session.udp_seq_out += 1
+        data = protocol.encode_datagram(session.udp_token, msg_type, session.udp_seq_out, payload)
+        try:
+            self.udp.sendto(data, addr or session.udp_addr)
+        except Exception:
+            self.metrics.inc("send_failures_total", reason="udp")
+            return
+        self.metrics.inc("messages_sent_total", transport="udp")
+        self.metrics.inc("bytes_sent_total", len(data), transport="udp")
+
+    def datagram_received(self, data, addr):
         try:
-            data = conn.recv(2048).decode("utf-8")
+            token, msg_type, seq, payload = protocol.decode_datagram(data)
+        except Exception:
+            return
+        session = self.udp_sessions.get(token)
+        if session is None:
+            return
+        session.last_seen = time.monotonic()
+        self.metrics.inc("messages_received_total", transport="udp")
+        self.metrics.inc("bytes_received_total", len(data), transport="udp")
+
+        if msg_type == protocol.MSG_UDP_HELLO:
+            # Echo it, but keep snapshots on TCP until the client confirms
+            # that the echo arrived
+            session.udp_peer = addr
+            self.send_datagram(session, protocol.MSG_UDP_HELLO, addr=addr)
+
+        elif msg_type == protocol.MSG_POSITION:
+            if not protocol.seq_newer(seq, session.udp_seq_in):
+                return  # stale or duplicate, a newer position already arrived
+            session.udp_seq_in = seq
+            # Follow the client if its NAT mapping changed
+            session.udp_addr = addr
+            room = self.registry.room_of(session)
+            if room:
+                room.submit(room.set_position, session, *protocol.decode_position(payload))
+
+    async def open_udp(self, host, port):
+        """Bind the UDP state channel; port 0 picks a free port"""
+        loop = asyncio.get_running_loop()
+        self.udp, _ = await loop.create_datagram_endpoint(
+            lambda: StateChannel(self), local_addr=(host, port)
+        )
+
+    def negotiate(self, session):
+        """Switch to binary framing if the connection opens with HELLO"""
+        decoder = session.decoder
+        if decoder.unread()[:len(protocol.HELLO)] == protocol.HELLO:
+            decoder.start += len(protocol.HELLO)
+            self.enable_binary(session)
+            session.write(protocol.HELLO_ACK)
+
+    def enable_binary(self, session):
+        session.binary = True
+
+    def open_session(self, conn, binary=False, pending=b""):
+        """Start serving a connection. A connection handed over by the
+        shard front arrives already negotiated (`binary`) and with the
+        bytes the front had read but not handled (`pending`)."""
+        print("Connected to:", conn.get_extra_info("peername"))
+        keep_alive(conn.get_extra_info("socket"), self.idle_timeout)
+        session = Session(conn, self.metrics)
+        self.sessions.add(session)
+        if binary:
+            self.enable_binary(session)
+        session.negotiated = binary
+        self.metrics.inc("connections_total")
+        self.metrics.add("connections_active", 1)
+        if pending:
+            session.decoder.feed(pending)
+            self.process(session)
+        return session
+
+    def received(self, session, count):
+        """`count` bytes were read into session.decoder"""
+        session.last_seen = time.monotonic()
+        self.metrics.inc("bytes_received_total", count, transport="tcp")
+        self.process(session)
+
+    def process(self, session):
+        """Handle every complete message in the session's receive buffer"""
+        decoder = session.decoder
+        try:
+            if not session.negotiated:
+                session.negotiated = True
+                self.negotiate(session)
+
+            if session.binary:
+                for msg_type, payload in decoder.frames():
+                    self.metrics.inc("messages_received_total", transport="tcp")
+                    self.dispatch_frame(session, msg_type, payload)
+                return
+
+            # Text protocol: one command per read
+            text = str(decoder.unread(), "utf-8")
+            decoder.start = decoder.end
+            if text:
+                self.metrics.inc("messages_received_total", transport="tcp")
+                debug("Received:", text)
+                self.dispatch(session, text)
+        except Exception as e:
+            print("Error:", e)
+            session.close()
+
+    def close_session(self, session):
+        """The connection is gone, whichever end closed it"""
+        print("Connection Closed")
+        self.metrics.add("connections_active", -1)
+        self.sessions.discard(session)
+        self.directory.unsubscribe(session)
+        self.close_state_channel(session)
+        session.close()
+        room = self.registry.room_of(session)
+        if room:
+            room.submit(room.on_disconnect, session)
+
+    async def watch_idle(self):
+        """Heartbeat quiet binary connections and close the ones that stay
+        silent for idle_timeout: a client that vanished without closing its
+        connection never sends EOF. Closing ends up in close_session,
+        which takes the member out of its room. Text clients cannot answer
+        Heartbeat; TCP keepalive looks after them."""
+        interval = self.idle_timeout / 3
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for session in list(self.sessions):
+                if not session.binary:
+                    continue
+                idle = now - session.last_seen
+                if idle >= self.idle_timeout:
+                    print(f"[INFO] No data for {idle:.0f}s, closing connection")
+                    self.metrics.inc("idle_disconnects_total")
+                    session.close()
+                elif idle >= interval:
+                    session.send("Heartbeat")
+
+
+class ClientProtocol(asyncio.BufferedProtocol):
+    """TCP connection of one Session. The event loop reads straight into
+    the session's receive buffer, and the Session writes through this as
+    it would through a StreamWriter."""
+
+    def __init__(self, server, binary=False, pending=b""):
+        self.server = server
+        self.binary = binary
+        self.pending = pending
+        self.transport = None
+        self.session = None
+        self.writable = asyncio.Event()  # cleared while the socket buffer is full
+        self.writable.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.session = self.server.open_session(self, self.binary, self.pending)
+        self.pending = b""
+
+    def get_buffer(self, sizehint):
+        return self.session.decoder.writable()
+
+    def buffer_updated(self, nbytes):
+        self.session.decoder.written(nbytes)
+        self.server.received(self.session, nbytes)
+
+    def connection_lost(self, exc):
+        self.writable.set()  # wake a pending drain(), which then fails
+        self.server.close_session(self.session)
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        await self.writable.wait()
+        if self.transport.is_closing():
+            raise ConnectionResetError("Connection lost")
+
+    def close(self):
+        self.transport.close()
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+
+class StateChannel(asyncio.DatagramProtocol):
+    """UDP endpoint feeding datagrams to the Server"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.datagram_received(data, addr)
+
+
+def routing_key(text):
+    """Room number a text command is addressed to, or None"""
+    parts = text.split(":")
+    if len(parts) > 1 and (parts[0] == "Create Room" or parts[0] in Server.ROOM_COMMANDS):
+        return parts[1]
+    return None
+
+
+class ShardFront:
+    """Acceptor of the sharded server.
+
+    Answers HELLO, `Game Room`, Ping and room list subscriptions itself,
+    and hands every connection over to the worker owning the first room it
+    names. Workers report changes to their open rooms, which are merged
+    here into the global room directory; browsing clients are connected
+    here, so this is where its diffs are pushed from.
+    """
+
+    def __init__(self, controls, idle_timeout=IDLE_TIMEOUT):
+        self.controls = controls
+        self.idle_timeout = idle_timeout
+        self.ring = HashRing(len(controls))
+        self.directory = RoomDirectory(MAX_PLAYERS)
+        self._listing = None
+
+    def listing(self):
+        if self._listing is None:
+            # Rooms on different workers number themselves independently
+            self._listing = listing_message([
+                f"{i}:{entry}"
+                for i, entry in enumerate(self.directory.entries.values(), start=1)
+                if int(entry.rsplit(":", 1)[1]) < MAX_PLAYERS  # open rooms only
+            ])
+        return self._listing
+
+    async def serve(self, host, port):
+        loop = asyncio.get_running_loop()
+        for control in self.controls:
+            control.setblocking(False)
+            loop.create_task(self.watch_worker(control))
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(1024)
+        listener.setblocking(False)
+        print(f"Waiting for a connection ({len(self.controls)} workers)")
+
+        while True:
+            conn, addr = await loop.sock_accept(listener)
+            print("Connected to:", addr)
+            keep_alive(conn, self.idle_timeout)
+            loop.create_task(self.route(conn))
+
+    async def watch_worker(self, control):
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await loop.sock_recv(control, sharding.MAX_MESSAGE)
             if not data:
-                break
-            print("Received:", data)
-            parts = data.split(":")
-            command = parts[0]
-            reply = ""
-
-            if command == "Game Room":
-                reply = json.dumps(room_list)
-                conn.sendall(reply.encode())
-
-            elif command == "Create Room":
-                room_num, room_password = parts[1], parts[2]
-                room_id = str(len(room_list) + 1)
-                room_list.append(f"{room_id}:{room_num}:{room_password}:{1}")
-                room_members[room_num] = [{
-                    "conn": conn,
-                    "player_id": 0,
-                    "name": "Player 1",
-                    "skin_id": 0,
-                    "lobby": {"ready": False, "host": True},
-                    "game": {"x": 0, "y": 0, "rot": 0.0, "res": False, "pen": False, "tf": False}
-                }]
-                room_states[room_num] = {"default_initialized": False,}
-                conn.sendall(f"Joined:{room_num}:0:host".encode())
-                broadcast_lobby_update(room_num)
-
-            elif command == "Join Room":
-                room_num = parts[1]
-                
-                if room_num in room_members and len(room_members[room_num]) < 4:
-                    player_id = len(room_members[room_num])
-                    room_members[room_num].append({
-                        "conn":conn, 
-                        "player_id":player_id, 
-                        "name":f"Player {player_id+1}", 
-                        "skin_id":0, 
-                        "lobby": {"ready": False, "host": False},
-                        "game": {"x": 0, "y": 0, "rot": 0.0, "res": False, "pen": False, "tf": False}
-                        })
-
-                # Update capacity in room_list
-                for i in range(len(room_list)):
-                    room_id, name, password, capacity = room_list[i].split(":")
-                    if name == room_num:
-                        new_capacity = str(len(room_members[room_num]))
-                        updated_room = f"{room_id}:{name}:{password}:{new_capacity}"
-
-                        # If room is now full, move it to full_room_list and remove from room_list
-                        if int(new_capacity) >= 4:
-                            full_room_list.append(updated_room)
-                            room_list.pop(i)
-                        else:
-                            room_list[i] = updated_room
-                        break  # Done, exit loop
-
-                conn.sendall(f"Joined:{room_num}:{player_id}:member".encode())
-                broadcast_lobby_update(room_num)
-
-            elif command == "Leave Room":
-                room_num, pid = parts[1], int(parts[2])
-                if room_num in room_members:
-                    # Remove based on connection only
-                    room_members[room_num] = [m for m in room_members[room_num] if m["conn"] != conn]
-
-                    # Separate host and non-hosts
-                    host = None
-                    others = []
-
-                    for m in room_members[room_num]:
-                        if m["player_id"] == 0:
-                            host = m
-                        else:
-                            others.append(m)
-
-                    # Reassign player IDs for non-hosts starting from 1
-                    for i, m in enumerate(others, start=1):
-                        m["player_id"] = i
-                        try:
-                            m["conn"].sendall(f"UpdateID:{i}\n".encode())
-                        except:
-                            pass
-
-                    # Rebuild room_members list
-                    room_members[room_num] = ([host] if host else []) + others
-
-                    new_capacity = len(room_members[room_num])
-
-                    # Update room_list
-                    for i in range(len(room_list)):
-                        room_id, name, password, capacity = room_list[i].split(":", 3)
-                        if name == room_num:
-                            room_list[i] = f"{room_id}:{name}:{password}:{new_capacity}"
-                            break
-
-                    # Move from full_room_list to room_list if necessary
-                    for i in range(len(full_room_list)):
-                        room_id, name, password, capacity = full_room_list[i].split(":", 3)
-                        if name == room_num:
-                            full_room_list.pop(i)
-                            room_list.append(f"{room_id}:{name}:{password}:{new_capacity}")
-                            break
-
-                    # Optionally delete room if empty
-                    if new_capacity == 0:
-                        room_members.pop(room_num, None)
-                        room_list = [r for r in room_list if room_num not in r]
-                        full_room_list = [r for r in full_room_list if room_num not in r]
-                        return
-
-                    broadcast_lobby_update(room_num)
-
-            elif command == "Remove Room":
-                room_num = parts[1]
-                # Notify all members before removing the room
-                notify_room_closed(room_num)
-                
-                # Remove from room lists
-                room_list = [r for r in room_list if room_num not in r]
-                full_room_list = [r for r in full_room_list if room_num not in r]
-                
-                # Remove room members
-                if room_num in room_members:
-                    del room_members[room_num]
-
-            elif command == "Kick":
-                room_num, target_id = parts[1], int(parts[2])
-
-                if room_num in room_members:
-                    kicked_conn = None
-
-                    # Remove the target player and store their connection
-                    new_room = []
-                    for m in room_members[room_num]:
-                        if m["player_id"] == target_id:
-                            kicked_conn = m["conn"]
-                            try:
-                                kicked_conn.send("Kicked\n".encode())
-                            except:
-                                pass
-                        else:
-                            new_room.append(m)
-                    
-                    room_members[room_num] = new_room
-
-                    # Separate host and others
-                    host = None
-                    others = []
-                    for m in room_members[room_num]:
-                        if m["player_id"] == 0:
-                            host = m
-                        else:
-                            others.append(m)
-
-                    # Reassign IDs for non-hosts starting from 1
-                    for i, m in enumerate(others, start=1):
-                        old_id = m["player_id"]
-                        m["player_id"] = i
-                        try:
-                            m["conn"].sendall(f"UpdateID:{i}\n".encode())
-                        except:
-                            pass
-
-                    # Rebuild room member list
-                    room_members[room_num] = ([host] if host else []) + others
-
-                    new_capacity = len(room_members[room_num])
-                    # Update room_list
-                    for i in range(len(room_list)):
-                        room_id, name, password, capacity = room_list[i].split(":", 3)
-                        if name == room_num:
-                            room_list[i] = f"{room_id}:{name}:{password}:{new_capacity}"
-                            break
-
-                    # Move from full_room_list to room_list if necessary
-                    for i in range(len(full_room_list)):
-                        room_id, name, password, capacity = full_room_list[i].split(":", 3)
-                        if name == room_num:
-                            full_room_list.pop(i)
-                            room_list.append(f"{room_id}:{name}:{password}:{new_capacity}")
-                            break
-
-                    broadcast_lobby_update(room_num)
-
-            elif command == "Update":
-                room_num, pid, name, skin_id, ready_str = parts[1], int(parts[2]), parts[3], int(parts[4]), parts[5]
-                ready = ready_str == "True"
-
-                # Update the matching player in the room based on connection (safe from player_id shifts)
-                for m in room_members.get(room_num, []):
-                    if m["conn"] == conn:
-                        m["name"] = name
-                        m["skin_id"] = skin_id
-                        m["lobby"]["ready"] = ready
-                        break
-
-                # Broadcast updated lobby state to all clients
-                broadcast_lobby_update(room_num)
-            
-            elif command == "Start":
-                # Save the room string from room_list before removing
-                for r in room_list:
-                    if room_num in r:
-                        start_room[room_num] = r
-                        break
-
-                # Remove the room from room_list
-                room_list = [r for r in room_list if room_num not in r]
-
-                # Reset ready info
-                ready_players[room_num] = set()
-                ready_next_index[room_num] = 0
-
-                # Send "Start" to all players
-                for player in room_members[room_num]:
-                    try:
-                        player["conn"].send("Start".encode())
-                    except:
-                        continue
-
-                # Prompt first player to send Ready
-                first_player = room_members[room_num][0]
+                print("[ERROR] Lost a shard worker")
+                return
+            message = json.loads(data)
+            self.directory.update(message["room"], message["entry"])
+            self._listing = None
+
+    async def route(self, conn):
+        """Serve a fresh connection until it names a room, then hand it off"""
+        loop = asyncio.get_running_loop()
+        binary = None  # until the first read
+        decoder = protocol.FrameDecoder()
+        # Room list diffs are pushed from other tasks: one write at a time
+        lock = asyncio.Lock()
+
+        async def send(text):
+            async with lock:
                 try:
-                    first_player["conn"].send(f"ReadyNext:{first_player['player_id']}".encode())
-                except:
-                    pass
-
-            elif command == "Ready":
-                room_num, player_id = parts[1], int(parts[2])
-
-                if room_num not in ready_next_index:
-                    ready_next_index[room_num] = 0
-
-                players = room_members.get(room_num, [])
-                current_index = ready_next_index[room_num]
-
-                if current_index < len(players):
-                    expected_player_id = players[current_index]["player_id"]
-
-                    if player_id == expected_player_id:
-                        # Accept the ready in turn
-                        ready_players.setdefault(room_num, set()).add(player_id)
-                        ready_next_index[room_num] += 1
-
-                        # Check if next player had already sent Ready early
-                        while ready_next_index[room_num] < len(players):
-                            next_player = players[ready_next_index[room_num]]
-                            next_id = next_player["player_id"]
-
-                            if room_num in early_ready and next_id in early_ready[room_num]:
-                                # Remove from early_ready and process
-                                early_ready[room_num].remove(next_id)
-                                ready_players[room_num].add(next_id)
-                                ready_next_index[room_num] += 1
-                            else:
-                                # Prompt the next player
-                                try:
-                                    next_player["conn"].send(f"ReadyNext:{next_id}".encode())
-                                except:
-                                    pass
-                                break  # Exit loop once next_player is notified
-
-                        # If all players are ready
-                        if ready_next_index[room_num] >= len(players):
-                            for player in players:
-                                try:
-                                    player["conn"].send("AllReady".encode())
-                                except:
-                                    pass
-
-                    else:
-                        # Save this player's early Ready
-                        early_ready.setdefault(room_num, set()).add(player_id)
-                        print(f"[INFO] Queued early Ready from player {player_id} (waiting turn)")
-
-            elif parts[0] in room_members:
-                room_num = parts[0]
-                player_id = int(parts[1])
-                respawn_str = parts[5]
-                penetration_str = parts[6]
-                timefreeze_str = parts[7]
-                
-                # After countdown, handle actual player game data
-                x = float(parts[2])
-                y = float(parts[3])
-                rot = float(parts[4])
-                respawn = respawn_str == "True"
-                penetration = penetration_str == "True"
-                timefreeze = timefreeze_str == "True"
-
-                for m in room_members[room_num]:
-                    if m["player_id"] == player_id:
-                        m["game"]["x"] = x
-                        m["game"]["y"] = y
-                        m["game"]["rot"] = rot
-                        m["game"]["res"] = respawn
-                        m["game"]["pen"] = penetration
-                        m["game"]["tf"] = timefreeze
-                        break
-
-                broadcast_game_update(room_num)
-
-            elif command == "Pipe":
-                room_num, gap_y = parts[1], parts[2]
-                for player in room_members.get(room_num, []):
-                    try:
-                        player["conn"].send(f"Pipe:{room_num}:{gap_y}:".encode())
-                    except:
-                        pass
-            
-            elif command == "UseFreeze":
-                room_num, user_id = parts[1], int(parts[2])
-                print(f"DEBUG SERVER: Player {user_id} used freeze in room {room_num}")
-                
-                if room_num in room_members:
-                    # Find the player with the highest X coordinate (furthest ahead)
-                    highest_x = -999999
-                    target_player = None
-                    
-                    for member in room_members[room_num]:
-                        player_id = member["player_id"]
-                        player_x = member["game"]["x"]
-                        
-                        # Don't target the player who used the skill
-                        if player_id != user_id:
-                            if player_x > highest_x:
-                                highest_x = player_x
-                                target_player = member
-                    
-                    if target_player:
-                        target_id = target_player["player_id"]
-                        try:
-                            # Send freeze command only to the player with highest X
-                            target_player["conn"].send(f"GetFrozen:{user_id}".encode())
-                            print(f"DEBUG SERVER: Player {user_id} froze player {target_id} (highest X: {highest_x})")
-                        except Exception as e:
-                            print(f"Failed to send freeze to player {target_id}: {e}")
-                    else:
-                        print(f"DEBUG SERVER: No valid target found for freeze from player {user_id}")
-                
-            # ADD after "UseFreeze" command handling:
-            elif command == "UseTeleport":
-                room_num, user_id = parts[1], int(parts[2])
-                print(f"DEBUG SERVER: Player {user_id} used teleport in room {room_num}")
-                    
-                if room_num in room_members:
-                    # Find highest X player and user player
-                    highest_x = -999999
-                    target_player = None
-                    user_player = None
-                        
-                    for member in room_members[room_num]:
-                        player_id = member["player_id"]
-                        player_x = member["game"]["x"]
-                            
-                        if player_id == user_id:
-                            user_player = member
-                        elif player_x > highest_x:
-                            highest_x = player_x
-                            target_player = member
-                        
-                    if target_player and user_player:
-                        # Swap positions
-                        user_x = user_player["game"]["x"]
-                        user_y = user_player["game"]["y"]
-                        target_x = target_player["game"]["x"]
-                        target_y = target_player["game"]["y"]
-                        target_id = target_player["player_id"]
-                        
-                        user_player["game"]["x"] = target_x
-                        user_player["game"]["y"] = target_y
-                        target_player["game"]["x"] = user_x
-                        target_player["game"]["y"] = user_y
-                        
-                        # Send teleport commands
-                        try:
-                            user_player["conn"].send(f"TeleportTo:{target_x}:{target_y}".encode())
-                            target_player["conn"].send(f"TeleportTo:{user_x}:{user_y}".encode())
-                            print(f"DEBUG SERVER: Teleport swap completed between {user_id} and {target_id}")
-                        except Exception as e:
-                            print(f"Failed to send teleport commands: {e}")
-            
-            elif command == "Restart":
-                if room_num in room_members:
-                    print(f"[INFO] Host restarted room {room_num}")
-
-                    # Notify all players in the room to return to lobby
-                    for p in room_members[room_num]:
-                        try:
-                            p["conn"].send("Restart".encode())
-                        except:
-                            continue
-
-                    # Reset game state values
-                    for m in room_members[room_num]:
-                        m["game"] = {"x": 0, "y": 0, "rot": 0.0}
-                        m["lobby"]["ready"] = False
-
-                    # Restore room string if it’s not in either list
-                    if (room_num not in "".join(room_list)) and (room_num not in "".join(full_room_list)):
-                        if room_num in start_room:
-                            room_list.append(start_room[room_num])
-                            print(f"[INFO] Room {room_num} re-added to room_list after restart.")
-                    
-                    new_capacity = len(room_members[room_num])
-                    # Update room_list
-                    for i in range(len(room_list)):
-                        room_id, name, password, capacity = room_list[i].split(":", 3)
-                        if name == room_num:
-                            room_list[i] = f"{room_id}:{name}:{password}:{new_capacity}"
-                            break
-
-                    # Move from full_room_list to room_list if necessary
-                    for i in range(len(full_room_list)):
-                        room_id, name, password, capacity = full_room_list[i].split(":", 3)
-                        if name == room_num:
-                            full_room_list.pop(i)
-                            room_list.append(f"{room_id}:{name}:{password}:{new_capacity}")
-                            break
-
-                    # Reset room tracking
-                    room_states[room_num]["default_initialized"] = False
-                    ready_players[room_num] = set()
-                    ready_next_index[room_num] = 0
-                    early_ready[room_num] = set()
-                    
+                    await loop.sock_sendall(conn, protocol.encode_text(text) if binary else text.encode())
+                except OSError:
+                    pass  # closed or handed off meanwhile
+
+        try:
+            while await self.read(conn, decoder, binary, send):
+                if binary is None:
+                    binary = await self.negotiate(conn, decoder)
+                for text in self.commands(decoder, binary):
+                    key = routing_key(text)
+                    if key is not None:
+                        # The worker replays this command and whatever
+                        # follows (unread() still holds the current one)
+                        pending = bytes(decoder.unread())
+                        async with lock:
+                            self.directory.unsubscribe(conn)
+                            return await self.hand_off(conn, key, binary, pending)
+                    await self.answer(conn, text, send)
         except Exception as e:
             print("Error:", e)
-            break
-
-    print("Connection Closed")
-    conn.close()
-
-while True:
-    conn, addr = s.accept()
-    print("Connected to:", addr)
-    start_new_thread(threaded_client, (conn,))
\ No newline at end of file
+        finally:
+            self.directory.unsubscribe(conn)
+        conn.close()
+
+    async def read(self, conn, decoder, binary, send):
+        """Read from the connection into `decoder`, returning the byte count,
+        0 once it is gone. Quiet binary clients get a Heartbeat and are
+        dropped after idle_timeout; text ones are left to keep_alive."""
+        loop = asyncio.get_running_loop()
+        interval = self.idle_timeout / 3
+        idle = 0
+        while True:
+            try:
+                count = await asyncio.wait_for(
+                    loop.sock_recv_into(conn, decoder.writable()), interval
+                )
+            except asyncio.TimeoutError:
+                if not binary:
+                    continue
+                idle += interval
+                if idle >= self.idle_timeout:
+                    print("[INFO] Closing idle connection")
+                    return 0
+                await send("Heartbeat")
+                continue
+            decoder.written(count)
+            return count
+
+    async def negotiate(self, conn, decoder):
+        """Switch to binary framing if the connection opens with HELLO"""
+        if decoder.unread()[:len(protocol.HELLO)] != protocol.HELLO:
+            return False
+        decoder.start += len(protocol.HELLO)
+        await asyncio.get_running_loop().sock_sendall(conn, protocol.HELLO_ACK)
+        return True
+
+    def commands(self, decoder, binary):
+        """Every text command in the receive buffer. Each one is still
+        unread while the caller handles it."""
+        if binary:
+            for msg_type, payload in decoder.frames():
+                if msg_type == protocol.MSG_TEXT:
+                    yield str(payload, "utf-8")
+            return
+        # Text protocol: one command per read
+        yield str(decoder.unread(), "utf-8")
+        decoder.start = decoder.end
+
+    async def answer(self, conn, text, send):
+        """Handle a command that needs no room"""
+        command, _, args = text.partition(":")
+        if command == "Game Room":
+            if args:
+                await send(self.directory.page_message(RoomQuery.parse(args.split(":"))))
+            else:
+                await send(self.listing())
+        elif command == "Ping":
+            await send(pong(text))
+        elif command == "Subscribe Rooms":
+            loop = asyncio.get_running_loop()
+            query = RoomQuery.parse(args.split(":")) if args else None
+            self.directory.subscribe(conn, lambda message: loop.create_task(send(message)), query)
+        elif command == "Unsubscribe Rooms":
+            self.directory.unsubscribe(conn)
+
+    async def hand_off(self, conn, room_num, binary, pending):
+        control = self.controls[self.ring.owner(room_num)]
+        message = {"binary": binary, "pending": pending.decode("latin-1")}
+        await sharding.send_message(control, message, fds=[conn.fileno()])
+        # The worker now holds its own copy of the descriptor
+        conn.close()
+
+
+class ShardWorker:
+    """Runs a regular Server for the rooms hashed to this worker"""
+
+    def __init__(self, server, control):
+        self.server = server
+        self.control = control
+        self.outbox = asyncio.Queue()
+        server.registry.watchers.append(self.room_changed)
+
+    def room_changed(self, room_num, entry):
+        self.outbox.put_nowait({"room": room_num, "entry": entry})
+
+    async def report(self):
+        while True:
+            message = await self.outbox.get()
+            await sharding.send_message(self.control, message)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.control.setblocking(False)
+        closed = loop.create_future()
+        loop.add_reader(self.control.fileno(), self.adopt, closed)
+        reporter = loop.create_task(self.report())
+        await closed
+        reporter.cancel()
+
+    def adopt(self, closed):
+        try:
+            message, fds = sharding.recv_message(self.control)
+        except BlockingIOError:
+            return
+        if message is None:
+            # Front went away, shut this worker down
+            asyncio.get_running_loop().remove_reader(self.control.fileno())
+            closed.set_result(None)
+            return
+        for fd in fds:
+            conn = socket.socket(fileno=fd)
+            asyncio.get_running_loop().create_task(
+                self.serve_connection(conn, message["binary"], message["pending"].encode("latin-1"))
+            )
+
+    async def serve_connection(self, conn, binary, pending):
+        await asyncio.get_running_loop().connect_accepted_socket(
+            lambda: ClientProtocol(self.server, binary, pending), sock=conn
+        )
+
+
+def run_worker(control, inherited, args, index):
+    # Drop the front's ends of every control channel inherited through fork,
+    # otherwise a worker never sees EOF when the front exits
+    for sock in inherited:
+        sock.close()
+
+    async def main():
+        server = Server(
+            tick_rate=args.tick_rate,
+            netcode=args.netcode,
+            match_time=args.match_time,
+            idle_timeout=args.idle_timeout,
+            ready_timeout=args.ready_timeout,
+        )
+        # Each worker gets its own UDP port, announced in UdpToken
+        await server.open_udp(args.host, 0)
+        asyncio.create_task(server.watch_idle())
+        await start_monitoring(server.metrics, args, index)
+        await ShardWorker(server, control).run()
+
+    asyncio.run(main())
+
+
+def serve_sharded(args):
+    if not hasattr(socket, "send_fds"):
+        raise SystemExit("--workers needs socket.send_fds (Unix, Python 3.9+)")
+
+    context = multiprocessing.get_context("fork")
+    controls = []
+    for index in range(args.workers):
+        front_end, worker_end = sharding.control_pair()
+        controls.append(front_end)
+        context.Process(
+            target=run_worker, args=(worker_end, controls, args, index), daemon=True
+        ).start()
+        worker_end.close()
+
+    asyncio.run(ShardFront(controls, args.idle_timeout).serve(args.host, args.port))
+
+
+async def start_monitoring(server_metrics, args, index=0):
+    """Start the metrics endpoint and JSON dump. Shard worker N uses
+    --metrics-port + N and --stats-file with a .N suffix."""
+    if args.metrics_port:
+        port = args.metrics_port + index
+        try:
+            await metrics.serve_http(server_metrics, "127.0.0.1", port)
+            print(f"Metrics on http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            print(f"[WARN] Metrics endpoint disabled: {e}")
+    if args.stats_file:
+        path = args.stats_file if args.workers == 1 else f"{args.stats_file}.{index}"
+        asyncio.create_task(metrics.dump_periodically(server_metrics, path, args.stats_interval))
+
+
+async def serve(args):
+    server = Server(
+        tick_rate=args.tick_rate,
+        netcode=args.netcode,
+        match_time=args.match_time,
+        idle_timeout=args.idle_timeout,
+        ready_timeout=args.ready_timeout,
+    )
+    await server.open_udp(args.host, args.port)
+    asyncio.create_task(server.watch_idle())
+    await start_monitoring(server.metrics, args)
+    listener = await asyncio.get_running_loop().create_server(
+        lambda: ClientProtocol(server), args.host, args.port, backlog=1024
+    )
+    print("Waiting for a connection")
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    global DEBUG
+
+    parser = argparse.ArgumentParser(description="FlapPyBird multiplayer server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--tick-rate",
+        type=int,
+        default=TICK_RATE,
+        help="GameUpdate snapshots sent per room per second (e.g. 20, 30, 60)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes to shard rooms across (1 = single process)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="local HTTP port for /metrics (Prometheus) and /stats (JSON); 0 disables",
+    )
+    parser.add_argument("--stats-file", help="periodically write metrics as JSON to this file")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL)
+    parser.add_argument(
+        "--netcode",
+        choices=("state", "lockstep"),
+        default="state",
+        help="state: clients stream bird positions; lockstep: clients send only inputs "
+        "and the server simulates every bird",
+    )
+    parser.add_argument(
+        "--match-time",
+        type=float,
+        default=MATCH_TIME,
+        help="seconds a match lasts, counted from the end of the countdown",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        help="seconds of silence after which a binary client is dropped from its room "
+        "(text clients are probed with TCP keepalive on about the same schedule)",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=READY_TIMEOUT,
+        help="seconds players have to get ready after Start before the match begins without them",
+    )
+    parser.add_argument("--debug", action="store_true", help="log every received packet")
+    args = parser.parse_args()
+    DEBUG = args.debug
+
+    if args.workers > 1:
+        serve_sharded(args)
+    else:
+        asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
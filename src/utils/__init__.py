@@ -4,5 +4,6 @@ from .sounds import Sounds
 from .utils import clamp, get_hit_mask, pixel_collision
 from .window import Window
 from .network import Network
+from .async_network import AsyncNetwork
 from .mode import Mode
 from .video import Video
\ No newline at end of file
@@ -0,0 +1,289 @@
+import asyncio
+import os
+
+from ..net import netsim, protocol
+from .network import (
+    CLOCK_INTERVAL,
+    CLOCK_SAMPLES,
+    RECV_SIZE,
+    SEND_LIMITS,
+    UDP_HELLO_ATTEMPTS,
+    Network,
+)
+
+CONNECT_TIMEOUT = 3  # seconds
+NEGOTIATE_TIMEOUT = 0.5  # seconds to wait for HELLO_ACK before using text
+JOIN_TIMEOUT = 2.5  # seconds to wait for the reply to Create/Join Room
+UDP_HELLO_INTERVAL = 0.2  # seconds between hello datagrams
+# path of a net/netsim.py scenario to play the game under
+NETSIM_ENV = "FLAPPY_NETSIM"
+
+
+class AsyncNetwork(Network):
+    """Network on an asyncio transport, run by the game's own event loop.
+
+    A ServerConnection protocol reads the socket straight into the
+    decoder's buffer and feeds every message to the handlers as it
+    arrives, so no frame ever waits on the socket and nothing crosses
+    threads; writes are buffered by the transport. While the listener is
+    stopped, reading is paused. Create it with `await AsyncNetwork.open()`.
+    Requests that expect a reply (send_receive_id) are coroutines.
+
+    With a netsim.Scenario (or a scenario file named by $FLAPPY_NETSIM),
+    everything sent and received after the handshake goes through
+    simulated links with that scenario's latency, loss and so on.
+    """
+
+    def __init__(self, send_limits=SEND_LIMITS, scenario=None):
+        super().__init__(send_limits, connect=False)
+        self.transport = None
+        self.handshake = None  # future set once the HELLO reply is in
+        self.space = None  # view last handed to the transport to read into
+        self.join_reply = None  # future for the pending Create/Join Room
+        self.links = netsim.links(scenario, "client") if scenario else None
+        # delayed deliveries need their own copy of what was read
+        self.scratch = memoryview(bytearray(RECV_SIZE)) if scenario else None
+
+    @classmethod
+    async def open(cls, send_limits=SEND_LIMITS, scenario=None):
+        if scenario is None and os.environ.get(NETSIM_ENV):
+            scenario = netsim.Scenario.load(os.environ[NETSIM_ENV])
+            print(f"[INFO] Simulating network conditions from {os.environ[NETSIM_ENV]}")
+        network = cls(send_limits, scenario)
+        loop = asyncio.get_running_loop()
+        network.handshake = loop.create_future()
+        try:
+            network.transport, _ = await asyncio.wait_for(
+                loop.create_connection(lambda: ServerConnection(network), network.host, network.port),
+                CONNECT_TIMEOUT,
+            )
+            network.binary = await network.negotiate()
+        except Exception as e:
+            print("Failed to connect:", e)
+            return network
+        network.start_listener()
+        return network
+
+    async def negotiate(self):
+        """Ask the server for binary framing, falling back to text if it
+        does not acknowledge within NEGOTIATE_TIMEOUT."""
+        self.transport.write(protocol.HELLO)
+        try:
+            await asyncio.wait_for(self.handshake, NEGOTIATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.handshake = None
+
+        # The reply was read into the binary decoder; anything after the
+        # ACK stays there until the listener starts
+        reply = self.decoder.unread()
+        if reply[:len(protocol.HELLO_ACK)] == protocol.HELLO_ACK:
+            self.decoder.start += len(protocol.HELLO_ACK)
+            print("[INFO] Using binary protocol")
+            return True
+        print("[INFO] Server did not acknowledge binary protocol, using text")
+        self.decoder = protocol.TextDecoder()
+        self.decoder.feed(reply)
+        return False
+
+    def check_handshake(self):
+        """Wake negotiate() once the reply is long enough to tell whether
+        it is a HELLO_ACK, or already cannot be one"""
+        reply = bytes(self.decoder.unread()[:len(protocol.HELLO_ACK)])
+        if len(reply) == len(protocol.HELLO_ACK) or not protocol.HELLO_ACK.startswith(reply):
+            if not self.handshake.done():
+                self.handshake.set_result(None)
+
+    def transmit(self, direction, deliver, data):
+        """deliver(data) now, or once it has crossed the simulated link
+        for `direction` (see netsim.links)"""
+        if self.links is None:
+            deliver(data)
+        else:
+            self.links[direction].send(len(data), deliver, data)
+
+    def write(self, data):
+        if self.transport is None or self.transport.is_closing():
+            raise ConnectionError("not connected")
+        self.stats.sent(len(data))
+        self.transmit("up", self._write, data)
+
+    def _write(self, data):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def send_datagram(self, data):
+        self.stats.sent(len(data))
+        self.transmit("up_udp", self._send_datagram, data)
+
+    def _send_datagram(self, data):
+        if self.udp is not None:
+            self.udp.sendto(data)
+
+    def get_buffer(self):
+        """Where the next read goes: straight into the decoder, or into
+        the scratch buffer when it must first cross a simulated link"""
+        if self.links is not None and self.handshake is None:
+            return self.scratch
+        self.space = self.decoder.writable()
+        return self.space
+
+    def buffer_updated(self, count):
+        if self.links is not None and self.handshake is None:
+            self.transmit("down", self.receive, bytes(self.scratch[:count]))
+            return
+        if self.binary or self.handshake is not None:
+            self.decoder.written(count)
+        else:
+            self.decoder.written(count, drained=count < len(self.space))
+        if self.handshake is not None:
+            self.check_handshake()
+        elif self.running:
+            self.dispatch(self.decode_frames(count))
+        else:
+            self.stats.received(count)  # decoded once the listener starts
+
+    def dispatch(self, frames):
+        for msg_type, payload in frames:
+            self.handle_frame(msg_type, payload)
+
+    def feed(self, data):
+        """Decode received bytes, returning the messages they complete"""
+        if self.binary:
+            self.decoder.feed(data)
+        else:
+            self.decoder.feed(data, drained=len(data) < RECV_SIZE)
+        return self.decode_frames(len(data))
+
+    def receive(self, data):
+        self.dispatch(self.feed(data))
+
+    def connection_lost(self, exc):
+        if self.handshake is not None and not self.handshake.done():
+            self.handshake.set_result(None)
+        if self.running:
+            print(f"Error in listener: {exc or 'server closed the connection'}")
+            print("[INFO] Listener stopped.")
+        self.running = False
+
+    def start_listener(self):
+        if self.transport is None or self.transport.is_closing():
+            return
+        if not self.running:
+            self.running = True
+            self.transport.resume_reading()
+            # messages that arrived while stopped, after the current handler
+            asyncio.get_running_loop().call_soon(self.dispatch_pending)
+
+    def dispatch_pending(self):
+        if self.running:
+            self.dispatch(self.decode_frames(0))
+
+    def stop_listeners(self):
+        self.running = False
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.pause_reading()
+
+    async def send_receive_id(self, data):
+        """Send Create/Join Room and wait for the Joined reply"""
+        self.join_reply = asyncio.get_running_loop().create_future()
+        self.start_listener()
+        self.send(data)
+        # New room: everything must be sent at least once again
+        for limiter in self.limiters.values():
+            limiter.reset()
+        try:
+            return await asyncio.wait_for(self.join_reply, JOIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Failed to get proper join response from server")
+            self.id = "0"
+            return ""
+        finally:
+            self.join_reply = None
+
+    def sync_clock(self, samples=CLOCK_SAMPLES):
+        asyncio.get_running_loop().create_task(self._sync_clock(samples))
+
+    async def _sync_clock(self, samples):
+        for _ in range(samples):
+            if self.transport is None:
+                return
+            self.send_ping()
+            await asyncio.sleep(CLOCK_INTERVAL)
+
+    def on_joined(self, args):
+        super().on_joined(args)
+        if self.join_reply and not self.join_reply.done():
+            self.join_reply.set_result(":".join(["Joined", *args]))
+
+    def open_state_channel(self, token, port):
+        self.close_state_channel()
+        self.udp_token = token
+        self.udp_last_seq = None
+        asyncio.get_running_loop().create_task(self._open_state_channel(token, port))
+
+    async def _open_state_channel(self, token, port):
+        loop = asyncio.get_running_loop()
+        try:
+            udp, _ = await loop.create_datagram_endpoint(
+                lambda: StateChannel(self), remote_addr=(self.host, port)
+            )
+        except Exception as e:
+            print(f"[INFO] UDP unavailable, staying on TCP: {e}")
+            return
+        if self.udp_token != token or self.transport is None:
+            udp.close()  # superseded or disconnected while opening
+            return
+        self.udp = udp
+        hello = self.udp_hello()
+        for _ in range(UDP_HELLO_ATTEMPTS):
+            if self.udp is not udp or self.udp_ready:
+                return
+            self.send_datagram(hello)
+            await asyncio.sleep(UDP_HELLO_INTERVAL)
+        if self.udp is udp and not self.udp_ready:
+            print("[INFO] No UDP reply from server, staying on TCP")
+            self.fall_back_to_tcp()
+
+    def disconnect(self):
+        self.stop_listeners()
+        self.close_state_channel()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+
+class ServerConnection(asyncio.BufferedProtocol):
+    """TCP connection reading into an AsyncNetwork's decoder"""
+
+    def __init__(self, network):
+        self.network = network
+
+    def get_buffer(self, sizehint):
+        return self.network.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            self.network.buffer_updated(nbytes)
+        except ValueError as e:  # malformed frame: the stream is lost
+            print(f"Error in listener: {e}")
+            self.network.transport.close()
+
+    def connection_lost(self, exc):
+        self.network.connection_lost(exc)
+
+
+class StateChannel(asyncio.DatagramProtocol):
+    """UDP endpoint feeding datagrams to an AsyncNetwork"""
+
+    def __init__(self, network):
+        self.network = network
+
+    def datagram_received(self, data, addr):
+        self.network.transmit("down_udp", self.network.handle_datagram, data)
+
+    def error_received(self, exc):
+        if self.network.udp is not None:
+            print(f"[INFO] UDP channel failed, back to TCP: {exc}")
+            self.network.fall_back_to_tcp()
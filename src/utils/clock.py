@@ -0,0 +1,56 @@
+"""Estimate of the server's clock, from Ping/Pong exchanges.
+
+The client sends Ping:<t0> and the server answers Pong:<t0>:<server time>.
+As in NTP, the server's clock is assumed to have been read halfway through
+the round trip, so offset = server time - (t0 + t3) / 2 where t3 is the
+arrival of the Pong. That is exact only when both directions take equally
+long; the error is at most half the round trip, so the sample with the
+shortest round trip out of the last KEEP is the one we trust.
+"""
+import threading
+import time
+
+KEEP = 8  # samples kept; older ones only reflect clock drift
+
+
+class ClockSync:
+    """Offset between time.time() here and on the server"""
+
+    def __init__(self):
+        self.samples = []  # (round trip, offset), oldest first
+        self.lock = threading.Lock()
+
+    def add(self, sent, server_time, received=None):
+        received = time.time() if received is None else received
+        with self.lock:
+            self.samples.append((received - sent, server_time - (sent + received) / 2))
+            if len(self.samples) > KEEP:
+                del self.samples[0]
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    @property
+    def synced(self):
+        return bool(self.samples)
+
+    @property
+    def offset(self):
+        """Server time minus local time, 0 before any Pong arrived"""
+        with self.lock:
+            if not self.samples:
+                return 0.0
+            return min(self.samples)[1]
+
+    @property
+    def round_trip(self):
+        with self.lock:
+            return min(self.samples)[0] if self.samples else None
+
+    def server_time(self, now=None):
+        return (time.time() if now is None else now) + self.offset
+
+    def to_local(self, server_time):
+        """time.time() at which the server's clock reads `server_time`"""
+        return server_time - self.offset
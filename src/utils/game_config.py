@@ -1,4 +1,6 @@
+import asyncio
 import os
+import time
 
 import pygame
 
@@ -23,6 +25,13 @@ class GameConfig:
         self.images = images
         self.sounds = sounds
         self.debug = os.environ.get("DEBUG", False)
+        self.next_frame = 0.0
 
-    def tick(self) -> None:
-        self.clock.tick(self.fps)
+    async def tick(self) -> None:
+        """Wait out the rest of the frame on the event loop; Clock.tick(fps)
+        would sleep the whole thread and stall the network with it"""
+        frame = 1 / self.fps
+        await asyncio.sleep(max(self.next_frame - time.perf_counter(), 0))
+        # keep the cadence, but don't rush to catch up after a slow frame
+        self.next_frame = max(self.next_frame, time.perf_counter() - frame) + frame
+        self.clock.tick()
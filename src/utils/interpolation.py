@@ -0,0 +1,86 @@
+"""Smooth drawing of remote birds from irregularly arriving snapshots.
+
+Every snapshot is stored with its arrival time, and remote birds are drawn
+DELAY seconds in the past, interpolated between the two snapshots around
+that moment. Network jitter then no longer lines up (or fails to) with the
+frame clock. When no newer snapshot has arrived yet, the bird keeps moving
+along its last velocity for at most EXTRAPOLATE seconds, then holds still.
+"""
+import threading
+import time
+
+DELAY = 0.1  # seconds behind the newest snapshots we render
+EXTRAPOLATE = 0.1  # seconds we guess ahead of the newest snapshot
+SNAP_DISTANCE = 150  # px; bigger jumps are respawns/teleports, not motion
+KEEP = 32  # snapshots kept per player
+
+
+def _lerp(a, b, t):
+    return a + (b - a) * t
+
+
+class SnapshotBuffer:
+    """Timestamped per-player snapshots, filled by the network thread and
+    sampled by the game loop"""
+
+    def __init__(self, delay=DELAY, extrapolate=EXTRAPOLATE):
+        self.delay = delay
+        self.extrapolate = extrapolate
+        self.history = {}  # player_id -> [(arrival time, player dict)]
+        self.lock = threading.Lock()
+
+    def push(self, players, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for player in players:
+                entries = self.history.setdefault(player.get("player_id"), [])
+                entries.append((now, player))
+                if len(entries) > KEEP:
+                    del entries[0]
+
+    def clear(self):
+        with self.lock:
+            self.history.clear()
+
+    def sample(self, players, now=None):
+        """`players` with x/y/rot as of `delay` seconds ago"""
+        render_time = (time.monotonic() if now is None else now) - self.delay
+        with self.lock:
+            for player_id in self.history.keys() - {p.get("player_id") for p in players}:
+                del self.history[player_id]
+            return [self._sample(player, render_time) for player in players]
+
+    def _sample(self, player, render_time):
+        entries = self.history.get(player.get("player_id"))
+        if not entries:
+            return player
+
+        # Drop what we no longer need: everything before the last snapshot
+        # at or before render_time
+        while len(entries) > 2 and entries[1][0] <= render_time:
+            del entries[0]
+
+        (t0, a), (t1, b) = entries[0], entries[-1]
+        if len(entries) == 1 or render_time <= t0:
+            return a
+
+        if render_time > t1:
+            # Late: continue from the last two snapshots
+            t0, a = entries[-2]
+            render_time = min(render_time, t1 + self.extrapolate)
+        else:
+            t1, b = entries[1]
+
+        if _jumped(a, b) or t1 <= t0:
+            return b
+        t = (render_time - t0) / (t1 - t0)
+        return {
+            **a,
+            "x": _lerp(a["x"], b["x"], t),
+            "y": _lerp(a["y"], b["y"], t),
+            "rot": _lerp(a.get("rot", 0), b.get("rot", 0), t),
+        }
+
+
+def _jumped(a, b):
+    return abs(b["x"] - a["x"]) > SNAP_DISTANCE or abs(b["y"] - a["y"]) > SNAP_DISTANCE
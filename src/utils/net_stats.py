@@ -0,0 +1,65 @@
+"""Connection counters behind the diagnostics overlay.
+
+Network bumps these on every read, write and snapshot. Each update is an
+addition or two, so they are always on; the overlay (or anything else)
+turns them into per-second figures with `rates`. There is no lock: a
+torn read only skews one displayed sample.
+"""
+import time
+
+# RFC 3550 smoothing: each new round trip moves the jitter 1/16 of the way
+JITTER_GAIN = 1 / 16
+
+
+class NetStats:
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.snapshots = 0  # game_state updates applied
+        self.last_snapshot = None  # time.monotonic() of the newest one
+        self.rtt = None  # seconds, latest Ping/Pong round trip
+        self.jitter = 0.0  # seconds, smoothed change between round trips
+        self.batch = 0  # most messages decoded from a single read
+        self.buffered = 0  # bytes of a partial message waiting for the rest
+        self._mark = (time.monotonic(), 0, 0, 0)
+
+    def received(self, count):
+        self.bytes_in += count
+
+    def sent(self, count):
+        self.bytes_out += count
+
+    def decoded(self, messages, buffered):
+        """A read produced `messages`, leaving `buffered` bytes undecoded"""
+        self.batch = max(self.batch, messages)
+        self.buffered = buffered
+
+    def snapshot(self):
+        self.snapshots += 1
+        self.last_snapshot = time.monotonic()
+
+    def round_trip(self, rtt):
+        if self.rtt is not None:
+            self.jitter += (abs(rtt - self.rtt) - self.jitter) * JITTER_GAIN
+        self.rtt = rtt
+
+    def snapshot_age(self, now=None):
+        """Seconds since game_state last changed, None if it never has"""
+        if self.last_snapshot is None:
+            return None
+        return (time.monotonic() if now is None else now) - self.last_snapshot
+
+    def rates(self, now=None):
+        """(snapshots, bytes in, bytes out) per second and the largest
+        read batch since the previous call"""
+        now = time.monotonic() if now is None else now
+        then, snapshots, bytes_in, bytes_out = self._mark
+        elapsed = max(now - then, 1e-6)
+        self._mark = (now, self.snapshots, self.bytes_in, self.bytes_out)
+        batch, self.batch = self.batch, 0
+        return (
+            (self.snapshots - snapshots) / elapsed,
+            (self.bytes_in - bytes_in) / elapsed,
+            (self.bytes_out - bytes_out) / elapsed,
+            batch,
+        )
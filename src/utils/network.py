@@ -3,84 +3,585 @@ import threading
 import json
 import time
 
+from ..net import lockstep, protocol
+from .clock import ClockSync
+from .interpolation import SnapshotBuffer
+from .net_stats import NetStats
+
+# hello datagrams (one per recv timeout) before giving up on UDP
+UDP_HELLO_ATTEMPTS = 5
+
+# message kind -> (max sends per second, keepalive interval in seconds).
+# Unchanged content is only resent once per keepalive interval.
+SEND_LIMITS = {
+    "position": (30, 1.0),
+    "lobby": (10, 5.0),
+}
+
+RECV_SIZE = 2048
+
+# Ping/Pong round trips per clock sync, and seconds between them
+CLOCK_SAMPLES = 5
+CLOCK_INTERVAL = 0.1
+# seconds a send may come before its slot: GameConfig.tick() frames can
+# wake a little early or follow a late one sooner than 1/rate
+SEND_TOLERANCE = 0.005
+
+
+class SendLimiter:
+    """Decides whether a periodically offered message is worth sending:
+    at most `rate` per second, and only when its content differs from what
+    was last sent or the keepalive interval has passed"""
+
+    def __init__(self, rate, keepalive):
+        self.interval = 1 / rate
+        self.keepalive = keepalive
+        self.last_content = None
+        self.last_sent = float("-inf")
+        self.next_due = float("-inf")
+
+    def due(self, content, now=None):
+        now = time.monotonic() if now is None else now
+        if now < self.next_due - SEND_TOLERANCE:
+            return False
+        if content == self.last_content and now - self.last_sent < self.keepalive:
+            return False
+        # Slots follow on from the previous one, so sends keep to `rate`
+        # without drifting late; after a pause they start over from now
+        if now - self.next_due > self.interval:
+            self.next_due = now
+        self.next_due += self.interval
+        self.last_content = content
+        self.last_sent = now
+        return True
+
+    def reset(self):
+        self.last_content = None
+        self.last_sent = float("-inf")
+        self.next_due = float("-inf")
+
+
 class Network:
-    def __init__(self):
-        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    """Client connection over a blocking socket; the listener runs in a
+    thread. AsyncNetwork (async_network.py) is the same client on asyncio."""
+
+    def __init__(self, send_limits=SEND_LIMITS, connect=True):
         self.host = "26.189.170.88" # ip address should same as server ip address
         self.port = 5555
         self.addr = (self.host, self.port)
         self.id = "0"
         self.lobby_state = []
         self.game_state = []
+        self.snapshots = SnapshotBuffer()  # game_state history for drawing others
+        self.players = {}  # player_id -> full GameUpdate dict, rebuilt from deltas
         self.room_num = None
+        self.room_list = []
+        # room list subscription: room_num -> "room:password:players", and
+        # the directory version it reflects (None until subscribed)
+        self.rooms = {}
+        self.rooms_version = None
+        # rooms matching a paged subscription, None for a whole list
+        self.room_total = None
         self.running = True
         self.kicked = False
         self.room_closed = False
         self.game_start = False
         self.restart = False
-        self.pipe_callback = None
+        # pipe course of the current match, from AllReady
+        self.pipe_seed = None
+        self.pipe_spacing = None
+        # input-only match mode, see net/lockstep.py
+        self.lockstep = False
+        self.resync = None  # (frame, bird state) from the server
         self.timer_callback = None
-        self.lobby_listener_thread = None
-        self.game_listener_thread = None
-
+        # our estimate of the server's clock, and the current match's
+        # (start, end) on it, from AllReady
+        self.clock = ClockSync()
+        self.match_times = None
+        self.match_over = False
+        self.stats = NetStats()  # for the diagnostics overlay
+        self.listener_thread = None
+        self.binary = False
+        self.decoder = protocol.FrameDecoder()  # a TextDecoder for text servers
+        self.handlers = {
+            "LobbyUpdate": self.on_lobby_update,
+            "GameUpdate": self.on_game_update,
+            "RoomClosed": self.on_room_closed,
+            "UpdateID": self.on_update_id,
+            "Kicked": self.on_kicked,
+            "Start": self.on_start,
+            "Restart": self.on_restart,
+            "AllReady": self.on_all_ready,
+            "GetFrozen": self.on_frozen,
+            "TeleportTo": self.on_teleport,
+            "UdpToken": self.on_udp_token,
+            "Joined": self.on_joined,
+            "RoomList": self.on_room_list,
+            "RoomDirectory": self.on_room_directory,
+            "RoomDiff": self.on_room_diff,
+            "RoomPage": self.on_room_page,
+            "Pong": self.on_pong,
+            "MatchEnd": self.on_match_end,
+            "Heartbeat": self.on_heartbeat,
+            # relayed from legacy hosts; we build the course from the seed
+            "Pipe": lambda args: None,
+        }
+        # optional UDP channel for positions/snapshots, see open_state_channel
+        self.udp = None
+        self.udp_token = None
+        self.udp_ready = False
+        self.udp_seq = 0
+        self.udp_last_seq = None
+        self.limiters = {kind: SendLimiter(*limits) for kind, limits in send_limits.items()}
+
+        if connect:
+            self.connect()
+
+    def connect(self):
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.client.connect(self.addr)
             self.client.settimeout(0.5)  # Set initial timeout for recv
+            self.binary = self.negotiate()
         except Exception as e:
             print("Failed to connect:", e)
 
+    def negotiate(self):
+        """Ask the server for binary framing, falling back to text if it
+        does not acknowledge within the recv timeout."""
+        self.client.sendall(protocol.HELLO)
+        reply = b""
+        try:
+            while len(reply) < len(protocol.HELLO_ACK):
+                data = self.client.recv(RECV_SIZE)
+                if not data:
+                    break
+                reply += data
+        except socket.timeout:
+            pass
+
+        if reply.startswith(protocol.HELLO_ACK):
+            self.decoder.feed(reply[len(protocol.HELLO_ACK):])
+            print("[INFO] Using binary protocol")
+            return True
+        print("[INFO] Server did not acknowledge binary protocol, using text")
+        self.decoder = protocol.TextDecoder()
+        self.decoder.feed(reply)
+        return False
+
+    def write(self, data):
+        self.client.send(data)
+        self.stats.sent(len(data))
+
+    def send_datagram(self, data):
+        self.udp.send(data)
+        self.stats.sent(len(data))
+
     def send(self, data):
         try:
             print(f"Sending: {data}")
-            self.client.send(data.encode())
+            if self.binary:
+                self.write(protocol.encode_text(data))
+            else:
+                self.write(data.encode())
         except Exception as e:
             print(f"Failed to send data: {e}")
 
+    def subscribe_rooms(self, query=None):
+        """Ask for the room list once; the server then pushes its changes
+        and room_list stays current (see RoomDirectory on the server).
+        With a RoomQuery, room_list is only that page of it."""
+        if query is None:
+            self.rooms_version = None
+            self.send("Subscribe Rooms")
+        else:
+            self.send(f"Subscribe Rooms:{query}")
+
+    def sync_clock(self, samples=CLOCK_SAMPLES):
+        """Send `samples` Pings, CLOCK_INTERVAL apart, in the background;
+        each Pong refines `clock`"""
+        def ping():
+            for _ in range(samples):
+                self.send_ping()
+                time.sleep(CLOCK_INTERVAL)
+
+        threading.Thread(target=ping, daemon=True).start()
+
+    def send_ping(self):
+        self.send(f"Ping:{time.time():.6f}")
+
+    def match_window(self):
+        """Local time.time() of the current match's start and end, or
+        (None, None) if the server did not announce them"""
+        if self.match_times is None:
+            return None, None
+        start, end = self.match_times
+        return self.clock.to_local(start), self.clock.to_local(end)
+
+    def send_lobby_update(self, room_num, name, skin_id, ready, host):
+        """Send this player's lobby entry, if it changed (see SEND_LIMITS)"""
+        message = f"Update:{room_num}:{self.id}:{name}:{skin_id}:{ready}:{host}:"
+        if self.limiters["lobby"].due(message):
+            self.send(message)
+
+    def send_position(self, x, y, rot, respawn, penetration, time_freeze, force=False):
+        """Send this player's bird state for the current room, if it changed
+        (see SEND_LIMITS); `force` skips the rate limit"""
+        limiter = self.limiters["position"]
+        state = (self.room_num, x, y, rot, respawn, penetration, time_freeze)
+        if force:
+            limiter.reset()
+        if not limiter.due(state):
+            return
+        if not self.binary:
+            self.send(f"{self.room_num}:{self.id}:{x}:{y}:{rot}:{respawn}:{penetration}:{time_freeze}")
+            return
+        if self.udp_ready:
+            self.udp_seq += 1
+            try:
+                self.send_datagram(protocol.encode_datagram(
+                    self.udp_token,
+                    protocol.MSG_POSITION,
+                    self.udp_seq,
+                    protocol.pack_position(self.id, x, y, rot, respawn, penetration, time_freeze),
+                ))
+                return
+            except Exception as e:
+                print(f"[INFO] UDP send failed, back to TCP: {e}")
+                self.fall_back_to_tcp()
+        try:
+            self.write(protocol.encode_position(self.id, x, y, rot, respawn, penetration, time_freeze))
+        except Exception as e:
+            print(f"Failed to send position: {e}")
+
+    def send_input(self, frame, kind):
+        try:
+            self.write(protocol.encode_input(frame, kind))
+        except Exception as e:
+            print(f"Failed to send input: {e}")
+
+    def send_state_hash(self, frame, state_hash):
+        try:
+            self.write(protocol.encode_state_hash(frame, state_hash))
+        except Exception as e:
+            print(f"Failed to send state hash: {e}")
+
+    def open_state_channel(self, token, port):
+        """Start moving positions and snapshots to UDP. TCP keeps carrying
+        them until the server answers our hello datagram."""
+        self.close_state_channel()
+        try:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.connect((self.host, port))
+            udp.settimeout(0.2)
+        except Exception as e:
+            print(f"[INFO] UDP unavailable, staying on TCP: {e}")
+            return
+        self.udp = udp
+        self.udp_token = token
+        self.udp_last_seq = None
+        threading.Thread(target=self._listen_datagrams, args=(udp,), daemon=True).start()
+
+    def close_state_channel(self):
+        self.udp_ready = False
+        udp, self.udp = self.udp, None
+        if udp:
+            udp.close()
+
+    def fall_back_to_tcp(self):
+        """Give up on the UDP channel and tell the server, which would
+        otherwise keep sending our snapshots there"""
+        self.close_state_channel()
+        self.send("UdpClose")
+
+    def _listen_datagrams(self, udp):
+        hello = self.udp_hello()
+        attempts = UDP_HELLO_ATTEMPTS
+
+        while self.udp is udp:
+            try:
+                if not self.udp_ready:
+                    if attempts == 0:
+                        print("[INFO] No UDP reply from server, staying on TCP")
+                        self.fall_back_to_tcp()
+                        break
+                    attempts -= 1
+                    udp.send(hello)
+                data = udp.recv(2048)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.udp is udp:  # not closed by us
+                    print(f"[INFO] UDP channel failed, back to TCP: {e}")
+                    self.fall_back_to_tcp()
+                break
+            self.handle_datagram(data)
+
+    def udp_hello(self):
+        return protocol.encode_datagram(self.udp_token, protocol.MSG_UDP_HELLO, 0)
+
+    def handle_datagram(self, data):
+        self.stats.received(len(data))
+        try:
+            token, msg_type, seq, payload = protocol.decode_datagram(data)
+        except Exception:
+            return
+        if token != self.udp_token or not protocol.seq_newer(seq, self.udp_last_seq):
+            return  # not ours, or older than what we already applied
+        self.udp_last_seq = seq
+
+        if not self.udp_ready:
+            # Any datagram from the server proves the path works; the
+            # server waits for this before sending snapshots over UDP
+            print("[INFO] Using UDP for game state")
+            self.udp_ready = True
+            self.send("UdpReady")
+        if msg_type == protocol.MSG_GAME_DELTA:
+            self.handle_frame(msg_type, payload)
+
+    def recv_frames(self):
+        """Receive once and return every message that is now complete, as
+        (msg_type, payload); text servers' messages come back as MSG_TEXT.
+        Payloads point into the receive buffer: use them before the next
+        call."""
+        space = self.decoder.writable()
+        count = self.client.recv_into(space)
+        if not count:
+            return []
+        if self.binary:
+            self.decoder.written(count)
+        else:
+            self.decoder.written(count, drained=count < len(space))
+        return self.decode_frames(count)
+
+    def decode_frames(self, count):
+        """Every message completed by the `count` bytes just received"""
+        frames = list(self.decoder.frames())
+        self.stats.received(count)
+        self.stats.decoded(len(frames), self.decoder.end - self.decoder.start)
+        return frames
+
+    def handle_frame(self, msg_type, payload):
+        if msg_type == protocol.MSG_GAME_DELTA:
+            players = self.players
+            for player_id, changes in protocol.decode_game_delta(payload):
+                if player_id in players:
+                    # Replace rather than mutate, the game loop may be reading
+                    players[player_id] = {**players[player_id], **changes}
+            self.publish_game_state()
+        elif msg_type == protocol.MSG_PLAYER_INFO:
+            self.players = {p["player_id"]: p for p in protocol.decode_player_info(payload)}
+            self.publish_game_state()
+        elif msg_type == protocol.MSG_RESYNC:
+            self.resync = lockstep.decode_resync(payload)
+        elif msg_type == protocol.MSG_TEXT:
+            self.handle_text(str(payload, "utf-8").strip())
+
+    def publish_game_state(self):
+        # Only players whose position has arrived are drawable
+        self.set_game_state([p for p in self.players.values() if "x" in p])
+
+    def set_game_state(self, players):
+        self.game_state = players
+        self.snapshots.push(players)
+        self.stats.snapshot()
+
+    def smoothed_game_state(self):
+        """game_state as it was DELAY ago, interpolated for drawing"""
+        return self.snapshots.sample(self.game_state)
+
+    def register(self, kind, handler):
+        """Route messages of `kind` to handler(args). JSON documents are
+        keyed by their "type" and passed whole; a text command such as
+        TeleportTo:1.0:2.0 is keyed by its head and gets the list of its
+        ':'-separated arguments."""
+        self.handlers[kind] = handler
+
+    def handle_text(self, message):
+        """Dispatch one complete text message to its handler"""
+        if message.startswith(("{", "[")):
+            try:
+                data = json.loads(message)
+            except Exception as e:
+                print(f"Error parsing JSON message: {e}")
+                return
+            if isinstance(data, list):
+                kind, args = "RoomList", data
+            else:
+                kind, args = data.get("type"), data
+        else:
+            kind, _, rest = message.partition(":")
+            args = rest.split(":") if rest else []
+
+        handler = self.handlers.get(kind)
+        if handler is None:
+            print(f"[INFO] Ignoring message: {message[:40]}")
+            return
+        try:
+            handler(args)
+        except (IndexError, ValueError, KeyError) as e:
+            print(f"[ERROR] Malformed {kind} message {message[:40]!r}: {e}")
+
+    def on_lobby_update(self, data):
+        self.lobby_state = data["players"]
+
+    def on_game_update(self, data):
+        self.set_game_state(data["players"])
+
+    def on_room_closed(self, data):
+        print("[INFO] Room was closed by host.")
+        self.handle_room_termination(reason="closed")
+
+    def on_update_id(self, args):
+        self.id = int(args[0])
+        print(f"[INFO] Updated player ID to {self.id}")
+
+    def on_kicked(self, args):
+        print("[INFO] You were kicked from the room.")
+        self.handle_room_termination(reason="kicked")
+
+    def on_start(self, args):
+        print("[INFO] Host has started the game.")
+        self.game_start = True
+        # A Restart before this belongs to the previous match
+        self.restart = False
+
+    def on_restart(self, args):
+        print("[INFO] Restart command received. Returning to Room Lobby.")
+        self.restart = True
+
+    def on_frozen(self, args):
+        print(f"[INFO] Got frozen by player {args[0]}")
+        self.freeze_active = True
+        self.freeze_start_time = time.time()
+
+    def on_teleport(self, args):
+        self.teleport_x = float(args[0])
+        self.teleport_y = float(args[1])
+        print(f"[INFO] Received teleport to ({self.teleport_x}, {self.teleport_y})")
+        self.teleport_active = True
+
+    def on_udp_token(self, args):
+        self.open_state_channel(int(args[0]), int(args[1]))
+
+    def on_joined(self, args):
+        """Joined:<room>:<player id>:<host|member>, our reply to Create/Join Room"""
+        self.room_num = args[0]
+        self.id = args[1]
+        self.sync_clock()
+        if self.binary:
+            # Servers without UDP support just ignore this
+            self.send("UdpOpen")
+
+    def on_room_list(self, rooms):
+        self.room_list = rooms
+        self.room_total = None
+
+    def on_room_directory(self, data):
+        """RoomDirectory: the whole list, split into `parts` messages when
+        it is long"""
+        if data.get("part", 0) == 0:
+            self.rooms = {}
+        elif data["version"] != self.rooms_version:
+            return  # a part of a list we did not see the start of
+        self.rooms.update(data["rooms"])
+        self.rooms_version = data["version"]
+        self.publish_rooms()
+
+    def on_room_diff(self, data):
+        if data["base"] != self.rooms_version:
+            if self.rooms_version is not None:
+                print("[INFO] Missed a room list update, subscribing again")
+                self.subscribe_rooms()
+            return
+        for room_num in data["removed"]:
+            self.rooms.pop(room_num, None)
+        self.rooms.update(data["updated"])
+        self.rooms.update(data["added"])
+        self.rooms_version = data["version"]
+        self.publish_rooms()
+
+    def on_room_page(self, data):
+        """RoomPage: the rooms of our query from its offset on, and how
+        many match it in all"""
+        offset = data["offset"]
+        self.rooms_version = data["version"]
+        self.room_total = data["total"]
+        self.room_list = [
+            f"{offset + i}:{entry}" for i, (_, entry) in enumerate(data["rooms"], start=1)
+        ]
+
+    def publish_rooms(self):
+        # A new list, so readers can tell it changed by identity
+        self.room_list = [f"{i}:{entry}" for i, entry in enumerate(self.rooms.values(), start=1)]
+        self.room_total = None
+
+    def on_heartbeat(self, args):
+        # The server drops connections it has not heard from for a while
+        self.send("Heartbeat")
+
+    def on_pong(self, args):
+        """Pong:<our Ping time>:<server time>"""
+        sent, received = float(args[0]), time.time()
+        self.clock.add(sent, float(args[1]), received)
+        self.stats.round_trip(received - sent)
+
+    def on_match_end(self, args):
+        # Follows the final GameUpdate, game_state is now the final standings
+        print("[INFO] Match over.")
+        self.match_over = True
+
+    def on_all_ready(self, args):
+        """AllReady[:<pipe seed>:<pipe spacing>[:<netcode>[:<start>:<end>]]],
+        start and end of the match on the server's clock"""
+        print("[INFO] All players are ready.")
+        if len(args) >= 2:
+            self.pipe_seed = int(args[0])
+            self.pipe_spacing = int(args[1])
+            # Lockstep inputs only exist in the binary protocol
+            self.lockstep = self.binary and args[2:3] == ["lockstep"]
+        self.match_times = (float(args[3]), float(args[4])) if len(args) >= 5 else None
+        self.match_over = False
+        self.snapshots.clear()  # nothing from the last match to blend with
+        self.all_ready = True
+
+    def _listen(self):
+        while self.running:
+            try:
+                for msg_type, payload in self.recv_frames():
+                    self.handle_frame(msg_type, payload)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"Error in listener: {e}")
+                break
+
+        print("[INFO] Listener stopped.")
+
     def send_receive_id(self, data):
         print(f"Sending to server: {data}")
         self.send(data)
+        # New room: everything must be sent at least once again
+        for limiter in self.limiters.values():
+            limiter.reset()
 
         max_attempts = 5
         for attempt in range(max_attempts):
             try:
-                reply = self.client.recv(2048).decode()
+                frames = self.recv_frames()
             except socket.timeout:
                 print("Timeout waiting for reply...")
                 continue
-            print(f"Received from server (attempt {attempt + 1}): {reply}")
 
-            if reply.startswith('['):
-                print("Received room list instead of join response, retrying...")
-                continue
-
-            if "Joined:" in reply:
-                try:
-                    parts = reply.split(":")
-                    if len(parts) >= 3:
-                        self.id = parts[2]
-                        self.room_num = parts[1]
-                        time.sleep(0.1)
-
-                        try:
-                            self.client.settimeout(0.5)
-                            initial_data = self.client.recv(2048).decode()
-                            if initial_data and '{' in initial_data:
-                                message = json.loads(initial_data)
-                                if message.get("type") == "LobbyUpdate":
-                                    self.lobby_state = message["players"]
-                                    print("Initial Lobby State:", self.lobby_state)
-                            self.client.settimeout(0.5)
-                        except Exception:
-                            pass
-
-                        return reply
-                    else:
-                        print(f"Unexpected reply format: {reply}")
-                        self.id = "0"
-                except Exception as e:
-                    print(f"Error parsing reply: {e}")
-                    self.id = "0"
-                break
+            reply = None
+            for msg_type, payload in frames:
+                if msg_type == protocol.MSG_TEXT and payload[:7] == b"Joined:":
+                    reply = str(payload, "utf-8")
+                # The initial LobbyUpdate usually shares the same recv
+                self.handle_frame(msg_type, payload)
+            if reply:
+                return reply
 
         print("Failed to get proper join response from server")
         self.id = "0"
@@ -88,9 +589,9 @@ class Network:
 
     def receive_room_list(self):
         try:
-            data = self.client.recv(2048).decode()
-            if data:
-                return json.loads(data)
+            for msg_type, payload in self.recv_frames():
+                if msg_type == protocol.MSG_TEXT and payload[:1] == b"[":
+                    return json.loads(bytes(payload))
             return []
         except socket.timeout:
             return []
@@ -98,26 +599,24 @@ class Network:
             print(f"Error receiving room list: {e}")
             return []
 
-    def start_lobby_listener(self):
-        if self.lobby_listener_thread is None or not self.lobby_listener_thread.is_alive():
+    def start_listener(self):
+        """Start the one thread that reads the socket, if it is not running"""
+        if self.listener_thread is None or not self.listener_thread.is_alive():
             self.running = True
-            self.lobby_listener_thread = threading.Thread(target=self._listen_lobby_updates, daemon=True)
-            self.lobby_listener_thread.start()
+            self.listener_thread = threading.Thread(target=self._listen, daemon=True)
+            self.listener_thread.start()
+
+    def start_lobby_listener(self):
+        self.start_listener()
 
     def start_game_listener(self):
-        if self.game_listener_thread is None or not self.game_listener_thread.is_alive():
-            self.running = True
-            self.game_listener_thread = threading.Thread(target=self._listen_game_updates, daemon=True)
-            self.game_listener_thread.start()
+        self.start_listener()
 
     def stop_listeners(self):
         self.running = False
-        if self.lobby_listener_thread:
-            self.lobby_listener_thread.join(timeout=1)
-            self.lobby_listener_thread = None
-        if self.game_listener_thread:
-            self.game_listener_thread.join(timeout=1)
-            self.game_listener_thread = None
+        if self.listener_thread:
+            self.listener_thread.join(timeout=1)
+            self.listener_thread = None
 
     def handle_room_termination(self, reason="kicked"):
         print(f"Handling room termination due to {reason}")
@@ -127,212 +626,14 @@ class Network:
         self.kicked = (reason == "kicked")
         self.room_closed = (reason == "closed")
 
-    def _listen_lobby_updates(self):
-        buffer = ""
-
-        while self.running:
-            try:
-                data = self.client.recv(2048).decode()
-                print(data)
-                if not data:
-                    continue
-
-                buffer += data
-
-                while buffer:
-                    while "\n" in buffer:
-                        line, buffer = buffer.split("\n", 1)
-
-                        if line.startswith("UpdateID:"):
-                            # Extract ID part only
-                            id_part = line.split(":")[1]
-                            if "{" in id_part:
-                                id_part, leftover = id_part.split("{", 1)
-                                buffer = "{" + leftover + "\n" + buffer  # Put JSON back into buffer
-                            try:
-                                self.id = int(id_part.strip())
-                                print(f"[INFO] Updated player ID to {self.id}")
-                            except ValueError:
-                                print("[ERROR] Invalid ID received.")
-
-                        elif line == "Kicked":
-                            print("[INFO] You were kicked from the room.")
-                            self.handle_room_termination(reason="kicked")
-                            continue
-
-                    # Any leftover non-line-based commands (like Start, Restart)
-                    if buffer.startswith("Start"):
-                        print("[INFO] Host has started the game.")
-                        self.game_start = True
-                        buffer = buffer[len("Start"):]
-                        continue
-
-                    if buffer.startswith("Restart"):
-                        print("[INFO] Restart command received. Returning to Room Lobby.")
-                        self.restart = True
-                        buffer = buffer[len("Restart"):]
-                        continue
-
-                    # Process JSON messages
-                    if '{' in buffer:
-                        start = buffer.index('{')
-                        brace_count = 0
-                        end_pos = start
-                        for i in range(start, len(buffer)):
-                            if buffer[i] == '{':
-                                brace_count += 1
-                            elif buffer[i] == '}':
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    end_pos = i + 1
-                                    break
-                        if brace_count == 0:
-                            json_str = buffer[start:end_pos]
-                            try:
-                                message = json.loads(json_str)
-                                if message.get("type") == "LobbyUpdate":
-                                    self.lobby_state = message["players"]
-                                    print("Lobby Update:", self.lobby_state)
-                                elif message.get("type") == "RoomClosed":
-                                    print("[INFO] Room was closed by host.")
-                                    self.handle_room_termination(reason="closed")
-                            except Exception as e:
-                                print(f"Error parsing JSON message: {e}")
-                            buffer = buffer[end_pos:]
-                        else:
-                            break
-                    else:
-                        buffer = ""
-                        break
-
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if self.running:
-                    print(f"Error in lobby listener: {e}")
-                break
-
-        print("[INFO] Lobby listener stopped.")
-
-    def _listen_game_updates(self):
-        buffer = ""
-
-        while self.running:
-            try:
-                data = self.client.recv(2048).decode()
-                print(data)
-                if not data:
-                    continue
-
-                buffer += data
-
-                while buffer:
-                    if buffer.startswith("GetFrozen:"):
-                        # Extract who used the freeze skill
-                        freeze_user = int(buffer.split(":")[1])
-                        print(f"[INFO] Got frozen by player {freeze_user}")
-                        
-                        # Set freeze state on THIS player
-                        self.freeze_active = True
-                        self.freeze_start_time = time.time()
-                        
-                        # Remove the processed command from buffer
-                        buffer = buffer[len("GetFrozen:"):].split(":", 1)[-1] if ":" in buffer else ""
-                        continue
-                    
-                    if buffer.startswith("TeleportTo:"):
-                        parts = buffer.split(":")
-                        if len(parts) >= 3:
-                            new_x = float(parts[1])
-                            new_y = float(parts[2])
-                            print(f"[INFO] Received teleport to ({new_x}, {new_y})")
-                            
-                            self.teleport_active = True
-                            self.teleport_x = new_x
-                            self.teleport_y = new_y
-                            
-                            buffer = buffer[len(f"TeleportTo:{new_x}:{new_y}"):].lstrip(":")
-                            continue
-                    
-                    if buffer.startswith("AllReady"):
-                        print("[INFO] All players are ready.")
-                        self.all_ready = True
-                        buffer = buffer[len("AllReady"):]
-                        continue
-
-                    if buffer.startswith("ReadyNext:"):
-                        try:
-                            player_id = buffer.split(":")[1]
-                            print(f"[INFO] ReadyNext for player {player_id}")
-                            self.ready_next_player = player_id
-                        except Exception as e:
-                            print(f"Failed to handle ReadyNext: {e}")
-                        buffer = buffer[len(f"ReadyNext:{player_id}"):]
-                        continue
-
-                    if buffer.startswith("Pipe:"):
-                        try:
-                            parts = buffer.strip().split(":")
-                            if len(parts) >= 3:
-                                gap_y = int(parts[2])
-                                if self.id != "0":
-                                    if hasattr(self, "pipe_callback") and self.pipe_callback:
-                                        self.pipe_callback(gap_y)
-                            buffer = ""  # All done
-                            continue
-                        except Exception as e:
-                            print(f"Failed to handle pipe spawn: {e}")
-                            buffer = ""
-                            continue
-
-                    # Now handle JSON data only if there's no prefix
-                    first_brace = buffer.find("{")
-                    if first_brace != -1:
-                        # Skip any leading junk before JSON
-                        buffer = buffer[first_brace:]
-
-                        brace_count = 0
-                        end_pos = 0
-                        for i in range(len(buffer)):
-                            if buffer[i] == '{':
-                                brace_count += 1
-                            elif buffer[i] == '}':
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    end_pos = i + 1
-                                    break
-
-                        if brace_count == 0 and end_pos > 0:
-                            json_str = buffer[:end_pos]
-                            try:
-                                message = json.loads(json_str)
-                                if message.get("type") == "GameUpdate":
-                                    self.game_state = message["players"]
-                                    print("Game Update:", self.game_state)
-                            except Exception as e:
-                                print(f"Error parsing JSON message: {e}")
-                            buffer = buffer[end_pos:]
-                            continue
-
-                    # If we get here and still have leftover junk, discard it
-                    buffer = ""
-
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if self.running:
-                    print(f"Error in game listener: {e}")
-                break
-
-        print("[INFO] Game listener stopped.")
-
     def listen_for_lobby_updates(self):
-        self.start_lobby_listener()
+        self.start_listener()
 
     def listen_for_game_updates(self):
-        self.start_game_listener()
+        self.start_listener()
 
     def disconnect(self):
         self.running = False
+        self.close_state_channel()
         self.client.shutdown(socket.SHUT_RDWR)
         self.client.close()